@@ -1,8 +1,12 @@
 from flask import Flask
 from flask_cors import CORS
 from config import Config
+from commands import register_commands
+from services import clients
+from utils import metrics
 from routes.chat import chat_bp
 from routes.trips import trips_bp
+from routes.locations import locations_bp
 
 def create_app():
     app = Flask(__name__)
@@ -13,13 +17,24 @@ def create_app():
         r"/api/*": {
             "origins": Config.CORS_ORIGINS,
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"]
+            "allow_headers": ["Content-Type", "Authorization", "Cache-Control", "Last-Event-ID"]
         }
     })
     
     # 注册蓝图
     app.register_blueprint(chat_bp)
     app.register_blueprint(trips_bp)
+    app.register_blueprint(locations_bp)
+    
+    # 注册命令行工具
+    register_commands(app)
+    
+    # 请求耗时统计和 /metrics
+    metrics.init_app(app)
+    
+    # 客户端默认在首次使用时创建；开启 WARMUP_ON_START 时在后台提前创建
+    if Config.WARMUP_ON_START:
+        clients.warmup_in_background()
     
     # 健康检查端点
     @app.route('/health')
@@ -37,7 +52,9 @@ def create_app():
                 "chat_stream": "/api/chat/stream",
                 "trips": "/api/trips/<user_id>",
                 "trip_detail": "/api/trips/<user_id>/<conversation_id>",
-                "search": "/api/trips/<user_id>/search"
+                "search": "/api/trips/<user_id>/search",
+                "enrich_itinerary": "/api/locations/enrich-itinerary",
+                "metrics": "/metrics"
             }
         }
     
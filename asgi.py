@@ -0,0 +1,369 @@
+"""
+异步入口（ASGI）
+
+聊天接口 /api/chat/send、/api/chat/stream 由 asyncio 直接处理：
+阻塞的 boto 调用放到有界线程池中执行，事件循环本身只负责转发数据，
+一个进程可以同时保持数百个 Agent 流式响应。客户端断开后可以用 Last-Event-ID 续传，
+无人重连时关闭 Bedrock 流。
+
+其余请求（包括 CORS 预检）原样交给 Flask 应用处理。
+
+启动方式:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+from config import Config
+from services.clients import get_bedrock_service, get_prefetcher
+from services.chat_stream import (
+    first_turn_cacheable, format_trace, admission_key, finish_agent_turn, TRACE_MODES, RESUME_UNAVAILABLE,
+    ChunkCoalescer, streams, start_stream, next_batch, encode_batch
+)
+from utils.admission import AdmissionRejected, is_throttling
+from utils.metrics import HTTP_REQUEST_SECONDS
+from utils.sse import SSE_HEADERS
+
+flask_app = create_app()
+wsgi = WsgiToAsgi(flask_app)
+
+# 所有 Bedrock 调用共用的有界线程池；线程大部分时间在等待网络，开销很小
+executor = ThreadPoolExecutor(
+    max_workers=Config.CHAT_ASYNC_MAX_WORKERS,
+    thread_name_prefix='chat'
+)
+
+# 准入排队专用的线程池：排队的请求在这里等待，不占用 Bedrock 调用的线程
+# （否则等待者可能占满 executor，已拿到许可的调用反而得不到线程执行）。
+# 同时等待的请求最多 CHAT_QUEUE_SIZE 个，其余的申请会立即返回或被拒绝
+admission_executor = ThreadPoolExecutor(
+    max_workers=max(Config.CHAT_QUEUE_SIZE, 0) + 8,
+    thread_name_prefix='chat-admission'
+)
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def _cors_headers(scope) -> List[Tuple[bytes, bytes]]:
+    """与 Flask-CORS 的配置保持一致（只处理实际请求，预检仍由 Flask 响应）"""
+    origin = _header(scope, b'origin')
+    if not origin:
+        return []
+
+    if '*' in Config.CORS_ORIGINS:
+        return [(b'access-control-allow-origin', b'*')]
+    if origin in Config.CORS_ORIGINS:
+        return [
+            (b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'vary', b'Origin')
+        ]
+    return []
+
+
+async def _send_json(scope, send, body: Dict, code: int = 200,
+                     headers: Optional[List[Tuple[bytes, bytes]]] = None):
+    # 原始 trace 事件中可能有 datetime 等类型
+    payload = json.dumps(body, default=str).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': code,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+            *(headers or []),
+            *_cors_headers(scope)
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def _send_busy(scope, send, message: str, code: int, retry_after: int):
+    """准入控制拒绝或 Bedrock 限流时的响应（带 Retry-After），与 Flask 版本相同"""
+    await _send_json(scope, send, {
+        "success": False,
+        "message": message,
+        "error": {"retryAfter": retry_after}
+    }, code, [(b'retry-after', str(retry_after).encode())])
+
+
+def _release_abandoned(future):
+    """等待许可的协程已被取消：线程之后拿到的许可没有人使用，立即释放"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().release(False)
+
+
+async def _admit(data: Dict):
+    """
+    在准入专用的线程池中申请许可（排队时不阻塞事件循环）
+
+    协程在等待期间被取消（如客户端断开）时，线程仍可能在之后拿到许可，由回调释放
+
+    Raises:
+        AdmissionRejected: 未被接纳
+    """
+    admission = get_bedrock_service().admission
+    future = admission_executor.submit(admission.acquire, admission_key(data))
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(_release_abandoned)
+        raise
+
+
+async def _read_json(receive) -> Optional[Dict]:
+    """读取完整请求体并解析为 JSON；格式不正确时返回 None"""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def send_message(scope, receive, send):
+    """/api/chat/send 的异步实现，请求和响应格式与 Flask 版本相同"""
+    data = await _read_json(receive)
+
+    if not data or 'message' not in data:
+        return await _send_json(scope, send, {
+            "success": False,
+            "message": "Missing 'message' in request body",
+            "error": None
+        }, 400)
+
+    trace = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('trace', [None])[0]
+    if trace not in TRACE_MODES:
+        return await _send_json(scope, send, {
+            "success": False,
+            "message": f"'trace' must be one of: {', '.join(TRACE_MODES[1:])}",
+            "error": None
+        }, 400)
+
+    user_message = data['message']
+    session_id = data.get('sessionId') or str(uuid.uuid4())
+    use_cache = first_turn_cacheable(data, _header(scope, b'cache-control'))
+
+    loop = asyncio.get_running_loop()
+    try:
+        with await _admit(data):
+            result = await loop.run_in_executor(
+                executor,
+                lambda: get_bedrock_service().invoke_agent(
+                    user_message, session_id, enable_trace=trace is not None, use_cache=use_cache
+                )
+            )
+        finish_agent_turn(result['response'], data.get('userId'), session_id)
+        result = format_trace(result, trace)
+    except AdmissionRejected as e:
+        return await _send_busy(scope, send, str(e), e.status, e.retry_after)
+    except Exception as e:
+        if is_throttling(e):
+            return await _send_busy(scope, send, "Agent is busy, please retry later", 503,
+                                    get_bedrock_service().admission.retry_after())
+        return await _send_json(scope, send, {
+            "success": False,
+            "message": f"Error processing message: {str(e)}",
+            "error": None
+        }, 500)
+
+    await _send_json(scope, send, {
+        "success": True,
+        "message": "Message sent successfully",
+        "data": result
+    })
+
+
+async def stream_message(scope, receive, send):
+    """
+    /api/chat/stream 的异步实现（SSE，事件格式与 Flask 版本相同，同样支持 Last-Event-ID 续传）
+
+    线程池中的线程读取 Bedrock 流并写入 StreamBuffer，事件循环在有新事件时被唤醒，
+    按 ChunkCoalescer 合并分片、发送心跳；客户端断开后上游继续写入缓冲区，
+    CHAT_STREAM_RESUME_GRACE 秒内没有客户端重连时在收到下一个分片时停止，并关闭 Bedrock 连接
+    """
+    data = await _read_json(receive)
+    last_event_id = _header(scope, b'last-event-id')
+    loop = asyncio.get_running_loop()
+
+    if last_event_id:
+        data = data or {}
+        buffer, seq = streams.resolve(last_event_id)
+        if buffer is None:
+            return await _send_json(scope, send, {
+                "success": False,
+                "message": RESUME_UNAVAILABLE,
+                "error": None
+            }, 410)
+    else:
+        if not data or 'message' not in data:
+            return await _send_json(scope, send, {
+                "success": False,
+                "message": "Missing 'message' in request body",
+                "error": None
+            }, 400)
+
+        try:
+            permit = await _admit(data)
+        except AdmissionRejected as e:
+            return await _send_busy(scope, send, str(e), e.status, e.retry_after)
+
+        try:
+            buffer = start_stream(
+                get_bedrock_service(),
+                data['message'],
+                data.get('sessionId') or str(uuid.uuid4()),
+                first_turn_cacheable(data, _header(scope, b'cache-control')),
+                lambda produce: loop.run_in_executor(executor, produce).add_done_callback(lambda f: f.exception()),
+                permit,
+                data.get('userId')
+            )
+        except Exception as e:
+            # 上游没有启动（如线程池已关闭），许可不会被释放
+            permit.release(False)
+            return await _send_json(scope, send, {
+                "success": False,
+                "message": f"Error in streaming: {str(e)}",
+                "error": None
+            }, 500)
+        seq = 0
+
+    coalescer = ChunkCoalescer.from_config(data.get('coalesce', True) is not False)
+    wakeup = asyncio.Event()
+
+    def notify():
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            # 事件循环已关闭（进程退出中）
+            pass
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            *[(name.lower().encode(), value.encode()) for name, value in SSE_HEADERS.items()],
+            *_cors_headers(scope)
+        ]
+    })
+
+    async def forward():
+        position = seq
+        while True:
+            wakeup.clear()
+            position, batch, done = next_batch(buffer, position, coalescer)
+            if batch:
+                await send({
+                    'type': 'http.response.body',
+                    'body': encode_batch(batch).encode('utf-8'),
+                    'more_body': True
+                })
+            if done:
+                break
+            try:
+                await asyncio.wait_for(wakeup.wait(), coalescer.wait_timeout())
+            except asyncio.TimeoutError:
+                pass
+        await send({'type': 'http.response.body', 'body': b''})
+
+    buffer.subscribe(notify)
+    forward_task = asyncio.ensure_future(forward())
+    disconnect_task = asyncio.ensure_future(_wait_disconnect(receive))
+
+    try:
+        await asyncio.wait(
+            {forward_task, disconnect_task},
+            return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        buffer.unsubscribe(notify)
+        for task in (forward_task, disconnect_task):
+            task.cancel()
+
+    if forward_task.done() and not forward_task.cancelled() and forward_task.exception():
+        print(f"Error in streaming: {str(forward_task.exception())}")
+    elif disconnect_task.done() and not forward_task.done():
+        print(f"Client disconnected from chat stream {buffer.session_id}:{buffer.turn_id}")
+
+
+async def _timed(handler, route: str, scope, receive, send):
+    """与 Flask 路由一样记录 http_request_duration_seconds（流式响应到发送完为止）"""
+    start = time.perf_counter()
+    status = 500
+
+    async def send_with_status(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_with_status)
+    finally:
+        HTTP_REQUEST_SECONDS.labels(scope['method'], route, status).observe(
+            time.perf_counter() - start
+        )
+
+
+ROUTES = {
+    ('POST', '/api/chat/send'): send_message,
+    ('POST', '/api/chat/stream'): stream_message,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False, cancel_futures=True)
+            admission_executor.shutdown(wait=False, cancel_futures=True)
+            if Config.PREFETCH_ENABLED:
+                # 执行完已排队的预取任务（超时后取消），不阻塞事件循环
+                await asyncio.get_running_loop().run_in_executor(
+                    None, get_prefetcher().shutdown, Config.PREFETCH_DRAIN_TIMEOUT
+                )
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http':
+        route = scope['path'].rstrip('/')
+        handler = ROUTES.get((scope['method'], route))
+        if handler:
+            return await _timed(handler, route, scope, receive, send)
+
+    await wsgi(scope, receive, send)
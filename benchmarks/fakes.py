@@ -0,0 +1,542 @@
+"""
+压测用的进程内替身（不访问网络）
+
+- FakeBedrockClient: bedrock-agent-runtime 客户端，invoke_agent 返回按设定节奏产出分片的事件流
+- InMemoryDynamoDB / InMemoryTable: DynamoDB resource 和 Table，支持本项目用到的
+  query / scan / get_item / put_item / delete_item / update_item / batch_writer / batch_get_item /
+  batch_write_item，query 和 scan 遵循 DynamoDB 的 Limit 语义（先按 Limit 读取，再应用 FilterExpression）
+- FakeGeocoder: googlemaps 客户端，geocode 有固定延迟
+
+通过 services.clients.override() 替换真实客户端，Service 层的代码原样执行
+"""
+import copy
+import hashlib
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import AttributeBase, ConditionBase
+from botocore.exceptions import ClientError
+
+_MISSING = object()
+
+
+# ---------------------------------------------------------------- Bedrock
+
+class FakeEventStream:
+    """Bedrock 的 completion 事件流：按 (等待秒数, 事件) 的顺序产出事件"""
+
+    def __init__(self, timeline: List[Tuple[float, Dict]], on_close=None):
+        self.timeline = timeline
+        self.closed = False
+        self.on_close = on_close
+
+    def __iter__(self):
+        try:
+            for delay, event in self.timeline:
+                if self.closed:
+                    return
+                time.sleep(delay)
+                yield event
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed and self.on_close:
+            self.on_close()
+        self.closed = True
+
+
+class FakeBedrockClient:
+    """
+    bedrock-agent-runtime 客户端替身
+
+    Args:
+        chunk_count: 每次回复的分片数
+        chunk_size: 每个分片的字符数
+        first_chunk_delay: 首个分片前的等待（模拟 Agent 推理），秒
+        chunk_delay: 分片之间的间隔，秒
+        action_group_delay: enableTrace 时模拟的 action group 执行时间，秒；
+                            首个分片前的等待按 预处理 / 推理 / action group / 推理 拆分到各 trace 事件之间
+        max_concurrency: 模拟 Bedrock 的并发配额，同时进行的调用超过这个数时抛出 ThrottlingException；0 表示不限
+    """
+
+    def __init__(self, chunk_count: int = 20, chunk_size: int = 40,
+                 first_chunk_delay: float = 0.2, chunk_delay: float = 0.01,
+                 action_group_delay: float = 0.05, max_concurrency: int = 0):
+        self.chunk_count = chunk_count
+        self.chunk_size = chunk_size
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.action_group_delay = action_group_delay
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _trace_timeline(self, session_id: str) -> List[Tuple[float, Dict]]:
+        model_delay = max(self.first_chunk_delay - self.action_group_delay, 0) / 3
+
+        def trace(phase: str, part: Dict) -> Dict:
+            return {'trace': {'sessionId': session_id, 'trace': {phase: part}}}
+
+        return [
+            (0.0, trace('preProcessingTrace', {'modelInvocationInput': {'traceId': 'fake-pre-0'}})),
+            (model_delay, trace('preProcessingTrace', {'modelInvocationOutput': {'traceId': 'fake-pre-0'}})),
+            (0.0, trace('orchestrationTrace', {'modelInvocationInput': {'traceId': 'fake-step1-0'}})),
+            (model_delay, trace('orchestrationTrace', {'rationale': {'traceId': 'fake-step1-0', 'text': '...'}})),
+            (0.0, trace('orchestrationTrace', {'invocationInput': {
+                'traceId': 'fake-step1-0',
+                'invocationType': 'ACTION_GROUP',
+                'actionGroupInvocationInput': {'actionGroupName': 'TravelActions', 'apiPath': '/search'}
+            }})),
+            (self.action_group_delay, trace('orchestrationTrace', {'observation': {
+                'traceId': 'fake-step1-0', 'type': 'ACTION_GROUP'
+            }})),
+            (0.0, trace('orchestrationTrace', {'modelInvocationInput': {'traceId': 'fake-step2-0'}})),
+            (model_delay, trace('orchestrationTrace', {'observation': {
+                'traceId': 'fake-step2-0', 'type': 'FINISH'
+            }})),
+        ]
+
+    def invoke_agent(self, agentId=None, agentAliasId=None, sessionId=None,
+                     inputText='', enableTrace=False, **kwargs):
+        seed = hashlib.sha1(inputText.encode('utf-8')).hexdigest()
+        text = (seed * (self.chunk_size // len(seed) + 1))[:self.chunk_size]
+        chunks = [
+            (self.chunk_delay, {'chunk': {'bytes': text.encode('utf-8')}})
+            for _ in range(self.chunk_count)
+        ]
+
+        if enableTrace:
+            timeline = self._trace_timeline(sessionId) + chunks
+        else:
+            timeline = [(self.first_chunk_delay, chunks[0][1])] + chunks[1:] if chunks else []
+
+        with self._lock:
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                self.throttled += 1
+                raise ClientError(
+                    {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                    'InvokeAgent'
+                )
+            self.in_flight += 1
+
+        return {'sessionId': sessionId, 'completion': FakeEventStream(timeline, self._finished)}
+
+
+# ---------------------------------------------------------------- DynamoDB
+
+def _resolve(operand, item: Dict):
+    if isinstance(operand, AttributeBase):
+        return item.get(operand.name, _MISSING)
+    return operand
+
+
+def evaluate(condition: ConditionBase, item: Dict) -> bool:
+    """在内存中对一条记录求值 boto3 的 Key / Attr 条件"""
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+
+    if operator == 'AND':
+        return all(evaluate(value, item) for value in values)
+    if operator == 'OR':
+        return any(evaluate(value, item) for value in values)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+    if operator == 'attribute_exists':
+        return _resolve(values[0], item) is not _MISSING
+    if operator == 'attribute_not_exists':
+        return _resolve(values[0], item) is _MISSING
+
+    left = _resolve(values[0], item)
+    if left is _MISSING:
+        return False
+    args = [_resolve(value, item) for value in values[1:]]
+
+    try:
+        if operator == '=':
+            return left == args[0]
+        if operator == '<>':
+            return left != args[0]
+        if operator == '<':
+            return left < args[0]
+        if operator == '<=':
+            return left <= args[0]
+        if operator == '>':
+            return left > args[0]
+        if operator == '>=':
+            return left >= args[0]
+        if operator == 'BETWEEN':
+            return args[0] <= left <= args[1]
+        if operator == 'IN':
+            return left in args[0]
+        if operator == 'begins_with':
+            return isinstance(left, str) and left.startswith(args[0])
+        if operator == 'contains':
+            return args[0] in left
+    except TypeError:
+        return False
+
+    raise NotImplementedError(f"Unsupported condition operator: {operator}")
+
+
+def _conditional_check_failed(operation: str) -> ClientError:
+    return ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException',
+                   'Message': 'The conditional request failed'}},
+        operation
+    )
+
+
+def _key_equals(condition: ConditionBase, name: str):
+    """从 KeyConditionExpression 中取出分区键的值"""
+    expression = condition.get_expression()
+    if expression['operator'] == '=' and getattr(expression['values'][0], 'name', None) == name:
+        return expression['values'][1]
+    if expression['operator'] == 'AND':
+        for value in expression['values']:
+            found = _key_equals(value, name)
+            if found is not None:
+                return found
+    return None
+
+
+class _BatchWriter:
+    def __init__(self, table: 'InMemoryTable'):
+        self.table = table
+
+    def put_item(self, Item: Dict):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key: Dict):
+        self.table.delete_item(Key=Key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class InMemoryTable:
+    """
+    内存中的 DynamoDB 表（分区键 + 排序键，可带 GSI）
+
+    Args:
+        name: 表名
+        hash_key / range_key: 主键字段
+        indexes: {索引名: (分区键, 排序键)}
+        latency: 每次调用的固定延迟（秒），模拟网络往返
+    """
+
+    def __init__(self, name: str, hash_key: str = 'userId', range_key: str = 'conversationId',
+                 indexes: Optional[Dict[str, Tuple[str, str]]] = None, latency: float = 0.0):
+        self.name = self.table_name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.latency = latency
+        self._partitions: Dict[str, Dict[str, Dict]] = {}
+        self._lock = threading.Lock()
+
+    # ---- 内部工具
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _key(self, key: Dict) -> Tuple[str, str]:
+        return key[self.hash_key], key[self.range_key]
+
+    @staticmethod
+    def _project(item: Dict, projection: Optional[str], names: Optional[Dict]) -> Dict:
+        if not projection:
+            return copy.deepcopy(item)
+        names = names or {}
+        attributes = [names.get(part.strip(), part.strip()) for part in projection.split(',')]
+        return {attr: copy.deepcopy(item[attr]) for attr in attributes if attr in item}
+
+    def _candidates(self, index_name: Optional[str], key_condition: Optional[ConditionBase]) -> Tuple[List[Dict], Tuple[str, ...]]:
+        """按排序键顺序返回候选记录，以及 LastEvaluatedKey 需要的字段"""
+        table_keys = (self.hash_key, self.range_key)
+
+        if index_name:
+            hash_key, range_key = self.indexes[index_name]
+            key_attrs = tuple(dict.fromkeys((hash_key, range_key) + table_keys))
+            value = _key_equals(key_condition, hash_key) if key_condition is not None else None
+            with self._lock:
+                items = [
+                    item for partition in self._partitions.values() for item in partition.values()
+                    if hash_key in item and range_key in item
+                    and (value is None or item[hash_key] == value)
+                ]
+            items.sort(key=lambda item: (item[hash_key], item[range_key], item[self.range_key]))
+            return items, key_attrs
+
+        if key_condition is not None:
+            value = _key_equals(key_condition, self.hash_key)
+            with self._lock:
+                partition = self._partitions.get(value, {})
+                items = [partition[key] for key in sorted(partition)]
+        else:
+            with self._lock:
+                items = [
+                    partition[key]
+                    for hash_value in sorted(self._partitions)
+                    for partition in (self._partitions[hash_value],)
+                    for key in sorted(partition)
+                ]
+        return items, table_keys
+
+    def _read(self, index_name=None, key_condition=None, FilterExpression=None, Limit=None,
+              ExclusiveStartKey=None, ScanIndexForward=True, ProjectionExpression=None,
+              ExpressionAttributeNames=None, **kwargs) -> Dict:
+        self._wait()
+        items, key_attrs = self._candidates(index_name, key_condition)
+
+        if key_condition is not None:
+            items = [item for item in items if evaluate(key_condition, item)]
+        if not ScanIndexForward:
+            items.reverse()
+
+        if ExclusiveStartKey:
+            # 与 DynamoDB 一样按键的顺序继续，起始键对应的记录已被删除也没有关系
+            start = tuple(ExclusiveStartKey[attr] for attr in key_attrs)
+            position = lambda item: tuple(item.get(attr) for attr in key_attrs)  # noqa: E731
+            items = [
+                item for item in items
+                if (position(item) > start if ScanIndexForward else position(item) < start)
+            ]
+
+        # Limit 限制的是读取（评估）的条数，过滤在读取之后进行
+        evaluated = items[:Limit] if Limit else items
+        matched = [
+            item for item in evaluated
+            if FilterExpression is None or evaluate(FilterExpression, item)
+        ]
+
+        response = {
+            'Items': [self._project(item, ProjectionExpression, ExpressionAttributeNames) for item in matched],
+            'Count': len(matched),
+            'ScannedCount': len(evaluated)
+        }
+        if Limit and len(evaluated) == Limit and evaluated:
+            last = evaluated[-1]
+            response['LastEvaluatedKey'] = {attr: last[attr] for attr in key_attrs}
+        return response
+
+    # ---- Table API
+
+    def query(self, KeyConditionExpression, IndexName=None, **kwargs) -> Dict:
+        return self._read(IndexName, KeyConditionExpression, **kwargs)
+
+    def scan(self, IndexName=None, **kwargs) -> Dict:
+        return self._read(IndexName, None, **kwargs)
+
+    def get_item(self, Key: Dict, ProjectionExpression=None, ExpressionAttributeNames=None,
+                 **kwargs) -> Dict:
+        self._wait()
+        hash_value, range_value = self._key(Key)
+        with self._lock:
+            item = self._partitions.get(hash_value, {}).get(range_value)
+        if item is None:
+            return {}
+        return {'Item': self._project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def put_item(self, Item: Dict, ConditionExpression=None, **kwargs) -> Dict:
+        self._wait()
+        hash_value, range_value = self._key(Item)
+        with self._lock:
+            partition = self._partitions.setdefault(hash_value, {})
+            current = partition.get(range_value, {})
+            if ConditionExpression is not None and not evaluate(ConditionExpression, current):
+                raise _conditional_check_failed('PutItem')
+            partition[range_value] = copy.deepcopy(Item)
+        return {}
+
+    def delete_item(self, Key: Dict, ReturnValues: str = 'NONE', ConditionExpression=None,
+                    **kwargs) -> Dict:
+        self._wait()
+        hash_value, range_value = self._key(Key)
+        with self._lock:
+            partition = self._partitions.get(hash_value, {})
+            current = partition.get(range_value)
+            if ConditionExpression is not None and not evaluate(ConditionExpression, current or {}):
+                raise _conditional_check_failed('DeleteItem')
+            partition.pop(range_value, None)
+        if ReturnValues == 'ALL_OLD' and current is not None:
+            return {'Attributes': current}
+        return {}
+
+    _SET_RE = re.compile(r'^\s*SET\s+(.+)$', re.IGNORECASE)
+
+    def update_item(self, Key: Dict, UpdateExpression: str, ConditionExpression=None,
+                    ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+                    **kwargs) -> Dict:
+        """只支持 SET a = :v[, b = :w] 形式的更新"""
+        self._wait()
+        match = self._SET_RE.match(UpdateExpression)
+        if not match:
+            raise NotImplementedError(f"Unsupported UpdateExpression: {UpdateExpression}")
+
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        assignments = []
+        for part in match.group(1).split(','):
+            attr, placeholder = (side.strip() for side in part.split('='))
+            assignments.append((names.get(attr, attr), values[placeholder]))
+
+        hash_value, range_value = self._key(Key)
+        with self._lock:
+            partition = self._partitions.setdefault(hash_value, {})
+            current = partition.get(range_value)
+            if ConditionExpression is not None and not evaluate(ConditionExpression, current or {}):
+                raise _conditional_check_failed('UpdateItem')
+            item = current if current is not None else dict(Key)
+            for attr, value in assignments:
+                item[attr] = copy.deepcopy(value)
+            partition[range_value] = item
+        return {}
+
+    def batch_writer(self, **kwargs) -> _BatchWriter:
+        return _BatchWriter(self)
+
+    # ---- 压测辅助
+
+    def load(self, items: Iterable[Dict]):
+        """直接写入种子数据（不计延迟）"""
+        with self._lock:
+            for item in items:
+                hash_value, range_value = self._key(item)
+                self._partitions.setdefault(hash_value, {})[range_value] = copy.deepcopy(item)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(partition) for partition in self._partitions.values())
+
+
+class InMemoryDynamoDB:
+    """
+    DynamoDB resource 替身：Table(name)、batch_get_item 和 batch_write_item
+
+    Args:
+        batch_read_limit: 每次 batch_get_item 最多返回的条数，其余的键放在 UnprocessedKeys 中
+            （模拟 16MB 响应上限和限流），None 表示全部返回
+        batch_write_limit: 每次 batch_write_item 最多处理的请求数，其余的放在 UnprocessedItems 中
+    """
+
+    def __init__(self, *tables: InMemoryTable, batch_read_limit: Optional[int] = None,
+                 batch_write_limit: Optional[int] = None):
+        self.tables = {table.name: table for table in tables}
+        self.batch_read_limit = batch_read_limit
+        self.batch_write_limit = batch_write_limit
+
+    def Table(self, name: str) -> InMemoryTable:
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems: Dict) -> Dict:
+        """一次调用只计一次延迟；超过 100 个键时与 DynamoDB 一样报 ValidationException"""
+        if sum(len(request['Keys']) for request in RequestItems.values()) > 100:
+            raise ClientError(
+                {'Error': {'Code': 'ValidationException',
+                           'Message': 'Too many items requested for the BatchGetItem call'}},
+                'BatchGetItem'
+            )
+
+        responses = {}
+        unprocessed = {}
+        budget = self.batch_read_limit
+        for name, request in RequestItems.items():
+            table = self.tables[name]
+            table._wait()
+            keys = request['Keys']
+            if budget is not None:
+                keys, rest = keys[:budget], keys[budget:]
+                budget -= len(keys)
+                if rest:
+                    unprocessed[name] = {**request, 'Keys': rest}
+            with table._lock:
+                found = [table._partitions.get(key[table.hash_key], {}).get(key[table.range_key])
+                         for key in keys]
+            responses[name] = [
+                table._project(item, request.get('ProjectionExpression'),
+                               request.get('ExpressionAttributeNames'))
+                for item in found if item is not None
+            ]
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+    def batch_write_item(self, RequestItems: Dict) -> Dict:
+        """一次调用只计一次延迟；超过 25 个请求或同一个键出现两次时与 DynamoDB 一样报 ValidationException"""
+        requests = [(name, request) for name, table_requests in RequestItems.items() for request in table_requests]
+        keys = [
+            (name, tuple(sorted((request.get('DeleteRequest') or {}).get('Key', {}).items())))
+            for name, request in requests if 'DeleteRequest' in request
+        ]
+        if len(requests) > 25 or len(keys) != len(set(keys)):
+            raise ClientError(
+                {'Error': {'Code': 'ValidationException',
+                           'Message': 'Too many items or duplicate keys in the BatchWriteItem call'}},
+                'BatchWriteItem'
+            )
+
+        unprocessed = {}
+        budget = self.batch_write_limit
+        for name in RequestItems:
+            self.tables[name]._wait()
+        for name, request in requests:
+            if budget is not None:
+                if budget <= 0:
+                    unprocessed.setdefault(name, []).append(request)
+                    continue
+                budget -= 1
+            table = self.tables[name]
+            if 'DeleteRequest' in request:
+                key = request['DeleteRequest']['Key']
+                with table._lock:
+                    table._partitions.get(key[table.hash_key], {}).pop(key[table.range_key], None)
+            else:
+                table.load([request['PutRequest']['Item']])
+        return {'UnprocessedItems': unprocessed}
+
+
+# ---------------------------------------------------------------- Google Maps
+
+class FakeGeocoder:
+    """
+    googlemaps 客户端替身
+
+    Args:
+        latency: 每次 geocode 的延迟（秒）
+        miss_every: 每 N 个不同的查询中有一个查不到（0 表示全部能找到）
+    """
+
+    def __init__(self, latency: float = 0.05, miss_every: int = 0):
+        self.latency = latency
+        self.miss_every = miss_every
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def geocode(self, address: str, **kwargs) -> List[Dict]:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+        digest = int(hashlib.sha1(address.encode('utf-8')).hexdigest()[:8], 16)
+        if self.miss_every and digest % self.miss_every == 0:
+            return []
+
+        return [{
+            'geometry': {'location': {
+                'lat': round(-90 + (digest % 18000) / 100, 6),
+                'lng': round(-180 + (digest // 18000 % 36000) / 100, 6)
+            }},
+            'formatted_address': address,
+            'place_id': f"fake-{digest:08x}"
+        }]
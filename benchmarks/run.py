@@ -0,0 +1,295 @@
+"""
+离线压测：用进程内替身（benchmarks/fakes.py）代替 Bedrock、DynamoDB 和 Google Maps，
+对 routes/ 中的每个接口并发发送请求，输出 p50 / p95 / p99 延迟和每秒请求数
+
+不需要 AWS / Google 凭证，也不访问网络；Service 层和路由的代码原样执行，
+替身只模拟外部调用的延迟和行为（包括 DynamoDB 的 Limit 语义）。
+
+用法（在项目根目录执行）:
+    python -m benchmarks.run
+    python -m benchmarks.run --requests 500 --concurrency 16 --only trips_list,trip_detail
+    python -m benchmarks.run --bedrock-first-chunk-ms 800 --geocode-ms 80 --json
+    python -m benchmarks.run --only chat_stream --coalesce-ms 0   # 对比不合并分片
+    python -m benchmarks.run --only chat_send --concurrency 64 --bedrock-max-concurrency 16  # Bedrock 限流下的准入控制
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+# 必须在导入 config 之前设置：不写 SQLite 缓存文件，不需要真实的 Key
+os.environ.setdefault('GOOGLE_MAPS_API_KEY', 'benchmark')
+os.environ.setdefault('GEOCODE_CACHE_DB', '')
+os.environ.setdefault('BEDROCK_AGENT_ID', 'benchmark-agent')
+os.environ.setdefault('BEDROCK_AGENT_ALIAS_ID', 'benchmark-alias')
+os.environ['WARMUP_ON_START'] = 'false'
+# 后台预取会和被测接口争用地理编码替身，默认关闭以便对比
+os.environ.setdefault('PREFETCH_ENABLED', 'false')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeBedrockClient, FakeGeocoder, InMemoryDynamoDB, InMemoryTable  # noqa: E402
+from config import Config  # noqa: E402
+from services import clients  # noqa: E402
+
+BASE_CONVERSATION_ID = 1760000000000
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: Callable[[int], str]
+    body: Optional[Callable[[int], Dict]] = None
+    headers: Optional[Dict[str, str]] = None
+
+
+def place_name(index: int) -> str:
+    # 地点名在一个有限的池子里重复出现，和真实行程一样会命中地理编码缓存
+    return f"Landmark {index % 400}"
+
+
+def make_itinerary(seed: int, days: int, activities: int) -> List[Dict]:
+    return [
+        {
+            "day": day + 1,
+            "date": f"2025-06-{day + 1:02d}",
+            "theme": f"Day {day + 1}",
+            "activities": [
+                {
+                    "time": f"{9 + activity * 2:02d}:00",
+                    "name": place_name(seed * 7 + day * activities + activity),
+                    "address": "Tokyo, Japan"
+                }
+                for activity in range(activities)
+            ]
+        }
+        for day in range(days)
+    ]
+
+
+def seed_data(dynamodb_service, users: int, trips: int, days: int, activities: int,
+              deletable: int) -> Dict:
+    """写入压测数据：每个用户若干条行程（每 3 条中 1 条为 parameters），以及供删除接口使用的记录"""
+    destinations = ['Tokyo, Japan', 'Paris, France', 'New York, USA', 'Rome, Italy']
+    budgets = ['budget', 'mid', 'luxury']
+    itineraries = {}
+
+    for user in range(users):
+        user_id = f"bench-user-{user}"
+        for trip in range(trips):
+            conversation_id = f"conv-{BASE_CONVERSATION_ID + trip}"
+            data_type = 'parameters' if trip % 3 == 2 else 'itinerary'
+            item = {
+                'userId': user_id,
+                'conversationId': conversation_id,
+                'dataType': data_type,
+                'destination': destinations[trip % len(destinations)],
+                'budget_tier': budgets[trip % len(budgets)],
+                'days': days,
+                'travelers': 2,
+                'start_date': '2025-06-01'
+            }
+            if data_type == 'itinerary':
+                itinerary = make_itinerary(user * trips + trip, days, activities)
+                item['fullItinerary'] = json.dumps({"itinerary": itinerary})
+                item['tripJson'] = json.dumps({"destination": item['destination'], "days": days})
+                itineraries.setdefault(user_id, []).append(conversation_id)
+            else:
+                item['tripJson'] = json.dumps({"destination": item['destination'], "days": days})
+            dynamodb_service.save_trip(item)
+
+    for index in range(deletable):
+        dynamodb_service.save_trip({
+            'userId': 'bench-delete',
+            'conversationId': f"conv-{BASE_CONVERSATION_ID + index}",
+            'dataType': 'parameters',
+            'destination': 'Delete Me'
+        })
+
+    return itineraries
+
+
+def build_scenarios(users: int, trips: int, itineraries: Dict) -> List[Scenario]:
+    def user(i: int) -> str:
+        return f"bench-user-{i % users}"
+
+    def trip(i: int) -> str:
+        user_id = user(i)
+        owned = itineraries[user_id]
+        return user_id, owned[i % len(owned)]
+
+    return [
+        Scenario('chat_send', 'POST', lambda i: '/api/chat/send',
+                 lambda i: {"message": f"Plan a 3-day trip #{i}", "sessionId": f"bench-{i}", "userId": user(i)}),
+        Scenario('chat_send_trace', 'POST', lambda i: '/api/chat/send?trace=summary',
+                 lambda i: {"message": f"Plan a 3-day trip #{i}", "sessionId": f"bench-{i}", "userId": user(i)}),
+        Scenario('chat_stream', 'POST', lambda i: '/api/chat/stream',
+                 lambda i: {"message": f"Plan a 3-day trip #{i}", "sessionId": f"bench-{i}", "userId": user(i)}),
+        Scenario('chat_session_delete', 'DELETE', lambda i: f'/api/chat/session/bench-{i}'),
+        Scenario('chat_cache_stats', 'GET', lambda i: '/api/chat/cache/stats'),
+        Scenario('trips_list', 'GET', lambda i: f'/api/trips/{user(i)}?limit=10'),
+        Scenario('trips_list_summary', 'GET', lambda i: f'/api/trips/{user(i)}?limit=10&view=summary'),
+        Scenario('trip_detail', 'GET', lambda i: '/api/trips/{}/{}'.format(*trip(i))),
+        Scenario('trips_batch', 'POST', lambda i: f'/api/trips/{user(i)}/batch',
+                 lambda i: {"conversationIds": itineraries[user(i)][i % 4:i % 4 + 5]}),
+        Scenario('trips_search', 'GET', lambda i: f'/api/trips/{user(i)}/search?destination=Tokyo&limit=10'),
+        Scenario('trips_parameters', 'GET', lambda i: f'/api/trips/{user(i)}/parameters?limit=10'),
+        Scenario('trips_all', 'GET', lambda i: f'/api/trips/{user(i)}/all?limit=20'),
+        Scenario('trip_delete', 'DELETE',
+                 lambda i: f'/api/trips/bench-delete/conv-{BASE_CONVERSATION_ID + i}'),
+        Scenario('trips_purge_dry_run', 'POST', lambda i: f'/api/trips/{user(i)}/purge',
+                 lambda i: {"dataType": "parameters", "dryRun": True}),
+        Scenario('locations_enrich', 'POST', lambda i: '/api/locations/enrich',
+                 lambda i: {"locations": [place_name(i * 5 + k) for k in range(5)]}),
+        Scenario('locations_enrich_batch', 'POST', lambda i: '/api/locations/enrich-batch',
+                 lambda i: {"locations": [
+                     {"name": place_name(i * 5 + k), "context": "Tokyo, Japan"} for k in range(5)
+                 ]}),
+        Scenario('enrich_itinerary', 'POST', lambda i: '/api/locations/enrich-itinerary',
+                 lambda i: dict(zip(('userId', 'conversationId'), trip(i)))),
+        Scenario('enrich_itinerary_stream', 'POST', lambda i: '/api/locations/enrich-itinerary/stream',
+                 lambda i: dict(zip(('userId', 'conversationId'), trip(i)))),
+        Scenario('locations_cache_stats', 'GET', lambda i: '/api/locations/cache/stats'),
+    ]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_scenario(app, scenario: Scenario, requests: int, concurrency: int) -> Dict:
+    local = threading.local()
+
+    def call(i: int):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+
+        start = time.perf_counter()
+        response = local.client.open(
+            scenario.path(i),
+            method=scenario.method,
+            json=scenario.body(i) if scenario.body else None,
+            headers=scenario.headers,
+            buffered=True  # 读完整个响应体（包括 SSE 流）
+        )
+        elapsed = time.perf_counter() - start
+        ok = response.status_code < 400 and b'"type": "error"' not in response.data
+        # SSE 响应的帧数（每一帧对应一次写出）
+        frames = response.data.count(b'\n\n') if response.mimetype == 'text/event-stream' else 0
+        return elapsed, ok, frames
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, ok, _ in results if not ok),
+        "frames": round(sum(frames for _, _, frames in results) / requests, 1) if requests else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "rps": round(requests / wall, 1) if wall else 0.0
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Offline benchmark of every API route')
+    parser.add_argument('--requests', type=int, default=200, help='每个接口的请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数')
+    parser.add_argument('--only', default='', help='只运行这些场景（逗号分隔）')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--trips', type=int, default=30, help='每个用户的记录数')
+    parser.add_argument('--days', type=int, default=4, help='每个行程的天数')
+    parser.add_argument('--activities', type=int, default=4, help='每天的 activity 数')
+    parser.add_argument('--chunks', type=int, default=20, help='Bedrock 每次回复的分片数')
+    parser.add_argument('--chunk-size', type=int, default=40, help='Bedrock 每个分片的字符数')
+    parser.add_argument('--bedrock-first-chunk-ms', type=float, default=200)
+    parser.add_argument('--bedrock-chunk-ms', type=float, default=10)
+    parser.add_argument('--bedrock-max-concurrency', type=int, default=0,
+                        help='模拟 Bedrock 的并发配额，超出时返回 ThrottlingException（0 表示不限）')
+    parser.add_argument('--chat-max-concurrency', type=int, default=None,
+                        help='覆盖 CHAT_MAX_CONCURRENCY（0 表示关闭准入控制的全局上限）')
+    parser.add_argument('--coalesce-ms', type=float, default=None,
+                        help='覆盖 CHAT_STREAM_COALESCE_MS（0 表示每个分片单独发送）')
+    parser.add_argument('--coalesce-bytes', type=int, default=None, help='覆盖 CHAT_STREAM_COALESCE_BYTES')
+    parser.add_argument('--dynamodb-ms', type=float, default=3, help='每次 DynamoDB 调用的延迟')
+    parser.add_argument('--geocode-ms', type=float, default=50, help='每次地理编码的延迟')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    args = parser.parse_args(argv)
+
+    if args.chat_max_concurrency is not None:
+        Config.CHAT_MAX_CONCURRENCY = args.chat_max_concurrency
+    if args.coalesce_ms is not None:
+        Config.CHAT_STREAM_COALESCE_MS = args.coalesce_ms
+    if args.coalesce_bytes is not None:
+        Config.CHAT_STREAM_COALESCE_BYTES = args.coalesce_bytes
+
+    table = InMemoryTable(
+        Config.DYNAMODB_TABLE_NAME,
+        indexes={Config.DYNAMODB_TYPE_INDEX_NAME: ('userDataType', 'conversationId')}
+    )
+    search_table = InMemoryTable(Config.SEARCH_INDEX_TABLE_NAME, range_key='indexKey')
+    geocoder = FakeGeocoder(latency=args.geocode_ms / 1000, miss_every=25)
+    clients.override('dynamodb', InMemoryDynamoDB(table, search_table))
+    clients.override('google_maps', geocoder)
+    clients.override('bedrock_agent_runtime', FakeBedrockClient(
+        chunk_count=args.chunks,
+        chunk_size=args.chunk_size,
+        first_chunk_delay=args.bedrock_first_chunk_ms / 1000,
+        chunk_delay=args.bedrock_chunk_ms / 1000,
+        max_concurrency=args.bedrock_max_concurrency
+    ))
+
+    from app import create_app
+    app = create_app()
+
+    itineraries = seed_data(
+        clients.get_dynamodb_service(), args.users, args.trips, args.days, args.activities,
+        deletable=args.requests
+    )
+    # 种子数据写完后再加上调用延迟
+    table.latency = args.dynamodb_ms / 1000
+
+    scenarios = build_scenarios(args.users, args.trips, itineraries)
+    only = {name.strip() for name in args.only.split(',') if name.strip()}
+    if only:
+        unknown = only - {scenario.name for scenario in scenarios}
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        scenarios = [scenario for scenario in scenarios if scenario.name in only]
+
+    report = {}
+    for scenario in scenarios:
+        report[scenario.name] = run_scenario(app, scenario, args.requests, args.concurrency)
+        if not args.json:
+            result = report[scenario.name]
+            frames = f"  frames={result['frames']:>6.1f}" if result['frames'] else ''
+            print(f"{scenario.name:<26} n={result['requests']:<5} err={result['errors']:<4} "
+                  f"p50={result['p50_ms']:>8.2f}ms  p95={result['p95_ms']:>8.2f}ms  "
+                  f"p99={result['p99_ms']:>8.2f}ms  rps={result['rps']:>8.1f}{frames}")
+
+    if args.json:
+        print(json.dumps({
+            "config": {key: value for key, value in vars(args).items() if key not in ('json', 'only')},
+            "geocode_api_calls": geocoder.calls,
+            "results": report
+        }, indent=2))
+
+    return 1 if any(result['errors'] for result in report.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
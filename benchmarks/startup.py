@@ -0,0 +1,119 @@
+"""
+冷启动基准测试
+
+每轮在全新的 Python 进程中测量：
+- import: 导入 app 模块的耗时
+- create_app: 调用 create_app() 的耗时
+- first_response: 第一个请求（默认 GET /health）的耗时
+- total: 以上三项之和（即冷启动到第一个响应的时间）
+
+同时检查启动后已经导入的重量级模块（boto3 / botocore / googlemaps），
+这些模块应该在首次使用客户端时才导入。
+
+用法（在项目根目录执行）:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 20 --json
+    python -m benchmarks.startup --max-total-ms 500   # 超过阈值时退出码为 1，可用于 CI
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('boto3', 'botocore', 'googlemaps')
+
+# 在子进程中执行的测量脚本
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+response = flask_app.test_client().get(sys.argv[1])
+responded = time.perf_counter()
+print(json.dumps({
+    "import": (imported - start) * 1000,
+    "create_app": (created - imported) * 1000,
+    "first_response": (responded - created) * 1000,
+    "status": response.status_code,
+    "heavy_modules": [m for m in sys.argv[2].split(",") if m in sys.modules]
+}))
+'''
+
+
+def run_once(path: str) -> dict:
+    env = dict(os.environ)
+    # 只测量启动本身，不在后台创建客户端
+    env['WARMUP_ON_START'] = 'false'
+
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, path, ','.join(HEAVY_MODULES)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+
+    # 只取最后一行（前面可能有应用打印的日志）
+    result = json.loads(output.strip().splitlines()[-1])
+    result['total'] = result['import'] + result['create_app'] + result['first_response']
+    return result
+
+
+def summarize(samples: list) -> dict:
+    summary = {}
+    for metric in ('import', 'create_app', 'first_response', 'total'):
+        values = sorted(sample[metric] for sample in samples)
+        summary[metric] = {
+            "min": round(values[0], 1),
+            "median": round(statistics.median(values), 1),
+            "max": round(values[-1], 1)
+        }
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measure cold start time of create_app()')
+    parser.add_argument('--runs', type=int, default=10, help='测量轮数（每轮一个新进程）')
+    parser.add_argument('--path', default='/health', help='第一个请求的路径')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    parser.add_argument('--max-total-ms', type=float, default=None,
+                        help='total 中位数的上限（毫秒），超过时退出码为 1')
+    args = parser.parse_args(argv)
+
+    samples = [run_once(args.path) for _ in range(args.runs)]
+    report = {
+        "runs": args.runs,
+        "path": args.path,
+        "status": samples[-1]['status'],
+        "ms": summarize(samples),
+        "heavy_modules_at_startup": sorted({m for s in samples for m in s['heavy_modules']})
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Cold start over {args.runs} runs (GET {args.path} -> {report['status']}):")
+        for metric, values in report['ms'].items():
+            print(f"  {metric:<15} min {values['min']:>7.1f} ms   "
+                  f"median {values['median']:>7.1f} ms   max {values['max']:>7.1f} ms")
+        heavy = report['heavy_modules_at_startup']
+        print(f"  heavy modules imported at startup: {', '.join(heavy) if heavy else 'none'}")
+
+    failed = False
+    if report['heavy_modules_at_startup']:
+        print(f"FAIL: {', '.join(report['heavy_modules_at_startup'])} imported during startup",
+              file=sys.stderr)
+        failed = True
+    if args.max_total_ms is not None and report['ms']['total']['median'] > args.max_total_ms:
+        print(f"FAIL: median total {report['ms']['total']['median']} ms > {args.max_total_ms} ms",
+              file=sys.stderr)
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import time
+
+import click
+
+
+def register_commands(app):
+    """注册 flask 命令行工具（flask --app app <command>）"""
+
+    @app.cli.command('backfill-type-index')
+    @click.option('--create-index', is_flag=True, help='GSI 不存在时先创建并等待其可用')
+    @click.option('--checkpoint', default='.backfill_type_index.json', show_default=True,
+                  help='检查点文件，中断后重新执行会从这里继续')
+    @click.option('--batch-size', default=100, show_default=True, help='每批扫描的记录数')
+    @click.option('--pause', default=0.0, show_default=True, help='每批之间暂停的秒数（限制写入速率）')
+    @click.option('--max-batches', type=int, default=None, help='本次最多处理的批次数')
+    @click.option('--watch', type=float, default=None,
+                  help='每轮完成后等待这么多秒再开始新的一轮（持续补写 Agent 新写入的记录）')
+    def backfill_type_index(create_index, checkpoint, batch_size, pause, max_batches, watch):
+        """为已有记录回填类型索引字段 userDataType"""
+        from services.clients import get_dynamodb_service
+        from services.type_index_backfill import TypeIndexBackfill
+
+        backfill = TypeIndexBackfill(
+            get_dynamodb_service(),
+            checkpoint_path=checkpoint,
+            batch_size=batch_size,
+            pause=pause
+        )
+
+        if create_index:
+            click.echo(f"Index status: {backfill.ensure_index()}")
+
+        def progress(state):
+            click.echo(
+                f"scanned={state['scanned']} updated={state['updated']} skipped={state['skipped']}"
+            )
+
+        while True:
+            state = backfill.run(max_batches=max_batches, progress=progress)
+
+            if not state['done']:
+                click.echo(f"Stopped early; rerun to resume from {checkpoint}")
+            elif watch is None:
+                click.echo("Backfill pass complete. Rerun it regularly (or use --watch) while the agent "
+                           "writes records without userDataType.")
+            else:
+                click.echo(f"Pass {state['passes']} complete; next pass in {watch:g}s")
+
+            if watch is None:
+                break
+            time.sleep(watch)
+
+    @app.cli.command('rebuild-search-index')
+    @click.option('--user', 'user_id', default=None, help='只重建该用户的索引（默认全表）')
+    @click.option('--create-table', is_flag=True, help='索引表不存在时先创建并等待其可用')
+    def rebuild_search_index(user_id, create_table):
+        """为已有行程重建目的地/预算搜索索引（全表重建时同时清理旧版本的 search# 分区）"""
+        from services.clients import get_dynamodb_service
+
+        search_index = get_dynamodb_service().search_index
+        if create_table:
+            click.echo(f"Index table status: {search_index.ensure_table()}")
+
+        count = search_index.rebuild(
+            user_id,
+            progress=lambda count: click.echo(f"indexed={count}")
+        )
+
+        click.echo(f"Indexed {count} trips. Set SEARCH_USE_INDEX=true to search through the index.")
+
+    @app.cli.command('create-chat-replay-table')
+    def create_chat_replay_table():
+        """创建第一轮回复缓存使用的共享会话表（CHAT_CACHE_REPLAY_TABLE_NAME）"""
+        from config import Config
+        from services import clients
+        from services.response_cache import ReplayStore
+
+        if not Config.CHAT_CACHE_REPLAY_TABLE_NAME:
+            raise click.UsageError("CHAT_CACHE_REPLAY_TABLE_NAME is empty; replay state is kept in-process")
+
+        store = ReplayStore(clients.dynamodb().Table(Config.CHAT_CACHE_REPLAY_TABLE_NAME))
+        click.echo(f"Replay table status: {store.ensure_table()}")
+
+    @app.cli.command('reencode-blobs')
+    @click.option('--checkpoint', default='.backfill_reencode_blobs.json', show_default=True,
+                  help='检查点文件，中断后重新执行会从这里继续')
+    @click.option('--batch-size', default=50, show_default=True, help='每批扫描的记录数')
+    @click.option('--pause', default=0.0, show_default=True, help='每批之间暂停的秒数（限制写入速率）')
+    @click.option('--max-batches', type=int, default=None, help='本次最多处理的批次数')
+    @click.option('--drop-legacy', is_flag=True,
+                  help='同时删除原来的字符串字段（所有读取方都支持压缩字段之后再使用）')
+    def reencode_blobs(checkpoint, batch_size, pause, max_batches, drop_legacy):
+        """把旧记录的 fullItinerary / tripJson 字符串重新编码为压缩字段"""
+        from services.clients import get_dynamodb_service
+        from services.blob_reencode import BlobReencode
+
+        reencode = BlobReencode(
+            get_dynamodb_service().table,
+            checkpoint_path=checkpoint,
+            batch_size=batch_size,
+            pause=pause,
+            drop_legacy=drop_legacy
+        )
+
+        def progress(state):
+            click.echo(
+                f"scanned={state['scanned']} updated={state['updated']} skipped={state['skipped']} "
+                f"bytes={state['bytes_before']}->{state['bytes_after']}"
+            )
+
+        state = reencode.run(max_batches=max_batches, progress=progress)
+
+        if state['done']:
+            click.echo("Re-encode complete.")
+        else:
+            click.echo(f"Stopped early; rerun to resume from {checkpoint}")
+
+    @app.cli.command('purge-user-data')
+    @click.option('--user', 'user_ids', multiple=True, required=True, help='要删除数据的用户（可重复指定）')
+    @click.option('--data-type', default=None, help='只删除该类型的记录（itinerary / parameters）')
+    @click.option('--older-than-days', type=float, default=None, help='只删除创建时间早于 N 天前的记录')
+    @click.option('--dry-run', is_flag=True, help='只统计将被删除的记录')
+    @click.option('--workers', type=int, default=None, help='并发执行的 BatchWriteItem 数（默认 PURGE_WORKERS）')
+    @click.option('--page-size', type=int, default=None, help='每次查询读取的条数（默认 PURGE_PAGE_SIZE）')
+    @click.option('--yes', is_flag=True, help='不再确认，直接删除')
+    def purge_user_data(user_ids, data_type, older_than_days, dry_run, workers, page_size, yes):
+        """批量删除用户的记录（注销账号、清理废弃的 parameters 记录）"""
+        from services.clients import get_dynamodb_service
+        from services.trip_purge import TripPurge
+
+        if not dry_run and not yes:
+            scope = f"{data_type or 'all'} records"
+            if older_than_days is not None:
+                scope += f" older than {older_than_days:g} days"
+            click.confirm(f"Delete {scope} of {len(user_ids)} user(s)?", abort=True)
+
+        older_than_ms = None
+        if older_than_days is not None:
+            older_than_ms = int((time.time() - older_than_days * 86400) * 1000)
+
+        purge = TripPurge(get_dynamodb_service(), workers=workers, page_size=page_size)
+
+        def progress(state):
+            click.echo(
+                f"user={state['userId']} matched={state['matched']} deleted={state['deleted']} "
+                f"search_deleted={state['searchEntriesDeleted']} failed={state['failed']}"
+            )
+
+        failed = 0
+        for user_id in user_ids:
+            state = purge.run(user_id, data_type, older_than_ms, dry_run, progress)
+            failed += state['failed']
+            if dry_run:
+                click.echo(f"{user_id}: would delete {state['matched']} records {state['byType']} "
+                           f"and {state['searchEntries']} search entries")
+            else:
+                click.echo(f"{user_id}: deleted {state['deleted']} records "
+                           f"and {state['searchEntriesDeleted']} search entries")
+
+        if failed:
+            raise click.ClickException(f"{failed} deletes failed; rerun to delete the remaining records")
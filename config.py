@@ -8,17 +8,115 @@ class Config:
     AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
     AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
+    # boto 客户端公共配置（services/clients.py）
+    AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50))
+    AWS_TCP_KEEPALIVE = os.getenv('AWS_TCP_KEEPALIVE', 'true').lower() == 'true'
+    AWS_RETRY_MODE = os.getenv('AWS_RETRY_MODE', 'adaptive')  # legacy / standard / adaptive
+    AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', 5))  # 最多重试次数（不含第一次请求）
+    # 启动时在后台提前创建客户端（默认首次使用时才创建）
+    WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'false').lower() == 'true'
     
     # Bedrock Agent 配置
     BEDROCK_AGENT_ID = os.getenv('BEDROCK_AGENT_ID')
     BEDROCK_AGENT_ALIAS_ID = os.getenv('BEDROCK_AGENT_ALIAS_ID')
     
+    # 异步聊天网关（asgi.py）：阻塞的 boto 调用放到有界线程池中执行
+    CHAT_ASYNC_MAX_WORKERS = int(os.getenv('CHAT_ASYNC_MAX_WORKERS', 256))
+    
+    # Agent 调用的准入控制：全局 / 每个用户的并发上限和有界等待队列（上限为 0 表示不限制）
+    CHAT_MAX_CONCURRENCY = int(os.getenv('CHAT_MAX_CONCURRENCY', 64))
+    CHAT_MAX_CONCURRENCY_PER_USER = int(os.getenv('CHAT_MAX_CONCURRENCY_PER_USER', 4))
+    CHAT_QUEUE_SIZE = int(os.getenv('CHAT_QUEUE_SIZE', 128))
+    CHAT_QUEUE_TIMEOUT = float(os.getenv('CHAT_QUEUE_TIMEOUT', 10))  # 秒，排队超过这个时间返回 503
+    
+    # 新会话第一轮的回复缓存（默认关闭）
+    CHAT_CACHE_ENABLED = os.getenv('CHAT_CACHE_ENABLED', 'false').lower() == 'true'
+    # 命中缓存时不调用 Agent，Action Group 的副作用（如写入行程）也不会发生：
+    # 只对这些没有写入类 Action Group 的 Agent 别名启用（逗号分隔）
+    CHAT_CACHE_READONLY_ALIASES = [
+        alias.strip() for alias in os.getenv('CHAT_CACHE_READONLY_ALIASES', '').split(',') if alias.strip()
+    ]
+    CHAT_CACHE_SIZE = int(os.getenv('CHAT_CACHE_SIZE', 512))
+    CHAT_CACHE_TTL = int(os.getenv('CHAT_CACHE_TTL', 3600))  # 秒
+    # 由缓存回复开始的会话（多进程共享的 DynamoDB 表，先用 create-chat-replay-table 创建，如 TravelPlannerChatReplay；
+    # 默认留空，保存在进程内，只适用于单进程部署；表不存在时同样退回进程内并打印提示）
+    CHAT_CACHE_REPLAY_TABLE_NAME = os.getenv('CHAT_CACHE_REPLAY_TABLE_NAME', '')
+    CHAT_CACHE_REPLAY_SIZE = int(os.getenv('CHAT_CACHE_REPLAY_SIZE', 10000))  # 进程内最多保存的会话数
+    
+    # /api/chat/stream 的分片合并：窗口内的分片合并为一个 content 事件（窗口为 0 表示不合并）
+    CHAT_STREAM_COALESCE_MS = float(os.getenv('CHAT_STREAM_COALESCE_MS', 50))
+    CHAT_STREAM_COALESCE_BYTES = int(os.getenv('CHAT_STREAM_COALESCE_BYTES', 1024))  # 缓冲达到这个大小时立即发送
+    # 超过这个秒数没有输出时发送心跳注释（0 表示不发送），避免代理断开空闲连接
+    CHAT_STREAM_HEARTBEAT_SECONDS = float(os.getenv('CHAT_STREAM_HEARTBEAT_SECONDS', 15))
+    # 流式回复的续传缓冲（客户端断开后用 Last-Event-ID 重连，不重新调用 Agent）
+    CHAT_STREAM_BUFFER_EVENTS = int(os.getenv('CHAT_STREAM_BUFFER_EVENTS', 1024))  # 每轮最多保留的事件数
+    CHAT_STREAM_BUFFER_TTL = int(os.getenv('CHAT_STREAM_BUFFER_TTL', 600))  # 秒，从开始时计算
+    CHAT_STREAM_MAX_BUFFERS = int(os.getenv('CHAT_STREAM_MAX_BUFFERS', 1024))  # 每个进程最多保留的轮数
+    CHAT_STREAM_RESUME_GRACE = float(os.getenv('CHAT_STREAM_RESUME_GRACE', 30))  # 客户端全部断开后上游继续运行的秒数
+    
     # DynamoDB 配置
     DYNAMODB_TABLE_NAME = os.getenv('DYNAMODB_TABLE_NAME', 'TravelPlannerConversations')
+    DYNAMODB_MAX_PAGE_SIZE = int(os.getenv('DYNAMODB_MAX_PAGE_SIZE', 100))  # 每页最多返回条数
+    DYNAMODB_MAX_PAGE_READS = int(os.getenv('DYNAMODB_MAX_PAGE_READS', 5))  # 每页最多查询次数（读取预算）
+    DYNAMODB_PAGE_READ_SIZE = int(os.getenv('DYNAMODB_PAGE_READ_SIZE', 50))  # 带过滤条件时每次查询读取的条数
+    DYNAMODB_EXPORT_PAGE_SIZE = int(os.getenv('DYNAMODB_EXPORT_PAGE_SIZE', 100))  # 导出时每次查询读取的条数
+    EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', 64 * 1024))  # 导出响应每次写出的字节数
+    # 批量读取（BatchGetItem）：分块并发执行，UnprocessedKeys 退避后重试
+    DYNAMODB_BATCH_GET_SIZE = int(os.getenv('DYNAMODB_BATCH_GET_SIZE', 25))  # 每次请求的键数（最多 100）
+    DYNAMODB_BATCH_WORKERS = int(os.getenv('DYNAMODB_BATCH_WORKERS', 8))  # 并发执行的请求数（所有请求共享）
+    DYNAMODB_BATCH_MAX_ATTEMPTS = int(os.getenv('DYNAMODB_BATCH_MAX_ATTEMPTS', 8))  # 每块最多请求次数
+    TRIP_BATCH_MAX_IDS = int(os.getenv('TRIP_BATCH_MAX_IDS', 100))  # 批量获取行程接口一次最多的 ID 数
+    PURGE_WORKERS = int(os.getenv('PURGE_WORKERS', 4))  # 批量删除时并发执行的 BatchWriteItem 数
+    PURGE_PAGE_SIZE = int(os.getenv('PURGE_PAGE_SIZE', 500))  # 批量删除时每次查询读取的条数（只读取主键等少量字段）
+    # 类型索引（GSI，分区键 userDataType = userId#dataType），回填完成后再开启
+    # 目前没有接口调用 save_trip，记录全部由 Agent 直接写入，不带 userDataType：
+    # 这个字段实际只由 backfill-type-index 补写，开启前必须保持 backfill-type-index --watch 持续运行
+    DYNAMODB_USE_TYPE_INDEX = os.getenv('DYNAMODB_USE_TYPE_INDEX', 'false').lower() == 'true'
+    DYNAMODB_TYPE_INDEX_NAME = os.getenv('DYNAMODB_TYPE_INDEX_NAME', 'userDataType-conversationId-index')
+    # 搜索索引（独立的索引表，rebuild-search-index --create-table 创建）
+    # Agent 直接写入的行程在后台按排序键追赶补写索引（每轮对话结束后 / 搜索时）；更早的行程被外部修改后需要重新执行 rebuild-search-index
+    SEARCH_USE_INDEX = os.getenv('SEARCH_USE_INDEX', 'false').lower() == 'true'
+    SEARCH_INDEX_TABLE_NAME = os.getenv('SEARCH_INDEX_TABLE_NAME', 'TravelPlannerSearchIndex')
+    SEARCH_INDEX_CATCHUP_WINDOW = int(os.getenv('SEARCH_INDEX_CATCHUP_WINDOW', 24 * 3600))  # 秒，追赶时从上次位置往前多读的范围
+    SEARCH_INDEX_CATCHUP_INTERVAL = int(os.getenv('SEARCH_INDEX_CATCHUP_INTERVAL', 60))  # 秒，搜索触发的后台追赶每个用户最多一次
+    SEARCH_INDEX_MAX_PREFIX = int(os.getenv('SEARCH_INDEX_MAX_PREFIX', 32))  # 目的地前缀索引的最大长度，更长的查询词只匹配前面部分
+    
+    # 行程读缓存（进程内，写入/删除时失效，其他进程的写入最多延迟 TTL 秒可见），大小为 0 表示关闭
+    TRIP_CACHE_SIZE = int(os.getenv('TRIP_CACHE_SIZE', 1024))
+    TRIP_CACHE_TTL = int(os.getenv('TRIP_CACHE_TTL', 30))  # 秒
+    TRIP_CACHE_PAGES_PER_USER = int(os.getenv('TRIP_CACHE_PAGES_PER_USER', 16))
+    # 每个用户缓存的行程列表分页总大小（字节，按 JSON 计算），列表缓存最多占用 TRIP_CACHE_SIZE 倍
+    TRIP_CACHE_BYTES_PER_USER = int(os.getenv('TRIP_CACHE_BYTES_PER_USER', 256 * 1024))
+    
+    # 行程大字段压缩存储（fullItineraryZ / tripJsonZ），所有读取方都支持后再开启
+    # 只对 save_trip 生效，目前没有接口调用 save_trip（行程由 Agent 直接写入）：实际只能通过 reencode-blobs 压缩
+    DYNAMODB_COMPRESS_BLOBS = os.getenv('DYNAMODB_COMPRESS_BLOBS', 'false').lower() == 'true'
+    BLOB_COMPRESSION_LEVEL = int(os.getenv('BLOB_COMPRESSION_LEVEL', 6))
     
     # Google Maps 配置
     GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
     
+    # 地理编码缓存配置（内存 LRU + SQLite 持久化）
+    GEOCODE_CACHE_ENABLED = os.getenv('GEOCODE_CACHE_ENABLED', 'true').lower() == 'true'
+    GEOCODE_CACHE_SIZE = int(os.getenv('GEOCODE_CACHE_SIZE', 10000))
+    GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', 30 * 24 * 3600))  # 秒
+    GEOCODE_NEGATIVE_TTL = int(os.getenv('GEOCODE_NEGATIVE_TTL', 24 * 3600))  # 找不到的地点
+    GEOCODE_CACHE_DB = os.getenv('GEOCODE_CACHE_DB', 'geocode_cache.sqlite3')  # 留空则只用内存
+    GEOCODE_CACHE_DB_MAX_ROWS = int(os.getenv('GEOCODE_CACHE_DB_MAX_ROWS', 200000))  # 0 表示不限制
+    GEOCODE_CACHE_DB_PURGE_EVERY = int(os.getenv('GEOCODE_CACHE_DB_PURGE_EVERY', 1000))  # 每多少次写入清理过期记录
+    
+    # 批量地理编码配置（并发 + 令牌桶限流）
+    GEOCODE_MAX_WORKERS = int(os.getenv('GEOCODE_MAX_WORKERS', 10))
+    GEOCODE_QPS = float(os.getenv('GEOCODE_QPS', 40))  # Google 默认配额 50 QPS，0 表示不限流
+    GEOCODE_BURST = float(os.getenv('GEOCODE_BURST', 10))
+    
+    # 后台预取：Agent 回复行程后提前地理编码，打开地图时直接命中缓存
+    # （save_trip 保存行程后也会提交任务，但目前没有接口调用 save_trip，行程由 Agent 直接写入）
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() == 'true'
+    PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 2))
+    PREFETCH_QUEUE_SIZE = int(os.getenv('PREFETCH_QUEUE_SIZE', 256))
+    PREFETCH_DRAIN_TIMEOUT = float(os.getenv('PREFETCH_DRAIN_TIMEOUT', 10))  # 秒，进程退出时等待已排队任务的时间
+    
     # Flask 配置
     FLASK_ENV = os.getenv('FLASK_ENV', 'development')
     FLASK_PORT = int(os.getenv('FLASK_PORT', 5000))
@@ -1,21 +1,38 @@
 from flask import Blueprint, request, Response, stream_with_context
-from services.bedrock_service import BedrockService
+from services.clients import get_bedrock_service
+from services.chat_stream import (
+    first_turn_cacheable, format_trace, admission_key, finish_agent_turn, TRACE_MODES, RESUME_UNAVAILABLE,
+    ChunkCoalescer, streams, start_stream, iter_stream_batches, encode_batch
+)
+from utils.admission import AdmissionRejected, is_throttling
 from utils.response import success_response, error_response
+from utils.sse import SSE_HEADERS
+import threading
 import uuid
-import json
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/api/chat')
-bedrock_service = BedrockService()
+
+
+def _busy_response(message: str, code: int, retry_after: int):
+    """准入控制拒绝或 Bedrock 限流时的响应（带 Retry-After）"""
+    response, code = error_response(message, code, {"retryAfter": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, code
 
 @chat_bp.route('/send', methods=['POST'])
 def send_message():
     """
     发送消息给 Agent
     
+    查询参数:
+        trace: 可选，summary 返回本轮耗时分解（traceSummary），full 同时返回原始 trace 事件
+    
     请求体:
     {
         "message": "Plan a 3-day trip to Tokyo",
-        "sessionId": "optional-session-id"  # 可选，不传则自动生成
+        "sessionId": "optional-session-id",  # 可选，不传则自动生成
+        "cache": false,  # 可选，新会话跳过第一轮回复缓存
+        "userId": "user-123"  # 可选，用于每个用户的并发上限（不传时只受全局上限约束）和回复后的坐标预取（不传时按 sessionId）
     }
     
     响应:
@@ -27,6 +44,9 @@ def send_message():
             "sessionId": "session-uuid"
         }
     }
+    
+    Agent 繁忙时（并发已满且排队超时 / 队列已满，或 Bedrock 限流）返回 503，
+    同一用户并发过多时返回 429，两者都带 Retry-After 头
     """
     try:
         data = request.get_json()
@@ -34,15 +54,32 @@ def send_message():
         if not data or 'message' not in data:
             return error_response("Missing 'message' in request body", 400)
         
+        trace = request.args.get('trace')
+        if trace not in TRACE_MODES:
+            return error_response(f"'trace' must be one of: {', '.join(TRACE_MODES[1:])}", 400)
+        
         user_message = data['message']
         session_id = data.get('sessionId') or str(uuid.uuid4())
+        use_cache = first_turn_cacheable(data, request.headers.get('Cache-Control'))
         
-        # 调用 Bedrock Agent
-        result = bedrock_service.invoke_agent(user_message, session_id)
+        bedrock_service = get_bedrock_service()
+        
+        # 调用 Bedrock Agent（先通过准入控制，必要时排队）
+        with bedrock_service.admission.acquire(admission_key(data)):
+            result = bedrock_service.invoke_agent(
+                user_message, session_id, enable_trace=trace is not None, use_cache=use_cache
+            )
+        finish_agent_turn(result['response'], data.get('userId'), session_id)
+        result = format_trace(result, trace)
         
         return success_response(result, "Message sent successfully")
         
+    except AdmissionRejected as e:
+        return _busy_response(str(e), e.status, e.retry_after)
     except Exception as e:
+        if is_throttling(e):
+            return _busy_response("Agent is busy, please retry later", 503,
+                                  get_bedrock_service().admission.retry_after())
         return error_response(f"Error processing message: {str(e)}", 500)
 
 
@@ -54,44 +91,64 @@ def stream_message():
     请求体:
     {
         "message": "Plan a 3-day trip to Tokyo",
-        "sessionId": "optional-session-id"
+        "sessionId": "optional-session-id",
+        "cache": false,  # 可选
+        "coalesce": false  # 可选，每个分片单独发送（默认合并 CHAT_STREAM_COALESCE_MS 内的分片）
     }
     
-    响应: Server-Sent Events (SSE) 流
+    响应: Server-Sent Events (SSE) 流；长时间没有输出时发送 ": keepalive" 注释
+    
+    每个事件带有 id（<sessionId>:<turnId>:<序号>）。连接中断后带上请求头
+    Last-Event-ID 重新请求（请求体可以为空），从中断处继续发送，不会再次调用 Agent；
+    无法续传（已过期）时返回 410；Agent 繁忙时与 /send 一样返回 429 / 503（续传不占用并发）
     """
     try:
-        data = request.get_json()
+        last_event_id = request.headers.get('Last-Event-ID')
         
-        if not data or 'message' not in data:
-            return error_response("Missing 'message' in request body", 400)
+        if last_event_id:
+            data = request.get_json(silent=True) or {}
+            buffer, seq = streams.resolve(last_event_id)
+            if buffer is None:
+                return error_response(RESUME_UNAVAILABLE, 410)
+        else:
+            data = request.get_json()
+            
+            if not data or 'message' not in data:
+                return error_response("Missing 'message' in request body", 400)
+            
+            user_message = data['message']
+            session_id = data.get('sessionId') or str(uuid.uuid4())
+            use_cache = first_turn_cacheable(data, request.headers.get('Cache-Control'))
+            
+            bedrock_service = get_bedrock_service()
+            permit = bedrock_service.admission.acquire(admission_key(data))
+            try:
+                buffer = start_stream(
+                    bedrock_service, user_message, session_id, use_cache,
+                    lambda produce: threading.Thread(target=produce, name='chat-stream', daemon=True).start(),
+                    permit,
+                    data.get('userId')
+                )
+            except Exception:
+                # 上游没有启动，许可不会被释放
+                permit.release(False)
+                raise
+            seq = 0
         
-        user_message = data['message']
-        session_id = data.get('sessionId') or str(uuid.uuid4())
+        coalescer = ChunkCoalescer.from_config(data.get('coalesce', True) is not False)
         
         def generate():
-            try:
-                # 先发送 session_id
-                yield f"data: {json.dumps({'type': 'session', 'sessionId': session_id})}\n\n"
-                
-                # 流式返回内容
-                for chunk in bedrock_service.invoke_agent_stream(user_message, session_id):
-                    yield f"data: {json.dumps({'type': 'content', 'text': chunk})}\n\n"
-                
-                # 发送完成信号
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                
-            except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            for batch in iter_stream_batches(buffer, seq, coalescer):
+                yield encode_batch(batch)
         
         return Response(
             stream_with_context(generate()),
             mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no'
-            }
+            headers=SSE_HEADERS
         )
         
+    except AdmissionRejected as e:
+        return _busy_response(str(e), e.status, e.retry_after)
     except Exception as e:
         return error_response(f"Error in streaming: {str(e)}", 500)
 
@@ -109,4 +166,47 @@ def delete_session(session_id):
     """
     # 注意：Bedrock Agent 会自动管理会话，通常不需要手动清除
     # 这个端点主要是为了前端清理本地状态
-    return success_response(None, "Session cleared")
\ No newline at end of file
+    return success_response(None, "Session cleared")
+
+
+@chat_bp.route('/cache/stats', methods=['GET'])
+def chat_cache_stats():
+    """
+    第一轮回复缓存统计
+    
+    响应:
+    {
+        "success": true,
+        "data": {
+            "enabled": true,
+            "hits": 40,
+            "misses": 60,
+            "hit_rate": 0.4,
+            "tokens_saved": 52000,
+            ...
+        }
+    }
+    """
+    return success_response(get_bedrock_service().cache_stats(), "Chat cache stats")
+
+
+@chat_bp.route('/admission/stats', methods=['GET'])
+def chat_admission_stats():
+    """
+    Agent 调用准入控制的当前状态
+    
+    响应:
+    {
+        "success": true,
+        "data": {
+            "in_flight": 12,
+            "queue_depth": 3,
+            "concurrency_limit": 64,
+            "admitted": 1520,
+            "rejected_queue_full": 4,
+            "rejected_timeout": 9,
+            ...
+        }
+    }
+    """
+    return success_response(get_bedrock_service().admission.stats(), "Chat admission stats")
@@ -1,10 +1,17 @@
 # routes/locations.py
-from flask import Blueprint, request
-from services.google_maps_service import GoogleMapsService
+from flask import Blueprint, request, Response, stream_with_context
+from services.clients import get_dynamodb_service, get_maps_service, get_prefetcher
+from services.itinerary_enricher import ItineraryEnricher, ItineraryNotFound
+from services.prefetch import PrefetchRejected
 from utils.response import success_response, error_response
+from utils.sse import sse_event, SSE_HEADERS
 
 locations_bp = Blueprint('locations', __name__, url_prefix='/api/locations')
-maps_service = GoogleMapsService()
+
+
+def _itinerary_enricher() -> ItineraryEnricher:
+    return ItineraryEnricher(get_maps_service())
+
 
 @locations_bp.route('/enrich', methods=['POST'])
 def enrich_locations():
@@ -30,20 +37,13 @@ def enrich_locations():
         enriched_data = {}
         failed_locations = []
         
-        for location_name in locations:
-            try:
-                result = maps_service.geocode_location(location_name)
-                
-                if result:
-                    enriched_data[location_name] = result
-                else:
-                    failed_locations.append(location_name)
-                    enriched_data[location_name] = None
-                    
-            except Exception as e:
-                print(f"Error processing location '{location_name}': {str(e)}")
+        # 并发地理编码，结果与输入顺序一致
+        results = get_maps_service().geocode_many(locations)
+        
+        for location_name, result in zip(locations, results):
+            enriched_data[location_name] = result
+            if not result:
                 failed_locations.append(location_name)
-                enriched_data[location_name] = None
         
         response_data = {
             "locations": enriched_data,
@@ -87,25 +87,21 @@ def enrich_locations_batch():
         enriched_data = {}
         failed_locations = []
         
+        names = []
+        queries = []
         for location in locations:
             location_name = location.get('name') if isinstance(location, dict) else location
             context = location.get('context', '') if isinstance(location, dict) else ''
             
-            query = f"{location_name}, {context}" if context else location_name
-            
-            try:
-                result = maps_service.geocode_location(query)
-                
-                if result:
-                    enriched_data[location_name] = result
-                else:
-                    failed_locations.append(location_name)
-                    enriched_data[location_name] = None
-                    
-            except Exception as e:
-                print(f"Error processing location '{location_name}': {str(e)}")
+            names.append(location_name)
+            queries.append(f"{location_name}, {context}" if context else location_name)
+        
+        results = get_maps_service().geocode_many(queries)
+        
+        for location_name, result in zip(names, results):
+            enriched_data[location_name] = result
+            if not result:
                 failed_locations.append(location_name)
-                enriched_data[location_name] = None
         
         response_data = {
             "locations": enriched_data,
@@ -121,11 +117,57 @@ def enrich_locations_batch():
         return error_response(f"Error in batch enrichment: {str(e)}", 500)
 
 
+def _resolve_itinerary(data: dict):
+    """
+    从请求体中取得待增强的行程
+    
+    Returns:
+        (itinerary 数组, 行程记录或 None, DynamoDBService 或 None)
+    
+    Raises:
+        ValueError: 请求参数缺失
+        ItineraryNotFound: 行程不存在或格式无效
+    """
+    itinerary = data.get('itinerary')
+    
+    # 直接传入 itinerary 时不读写 DynamoDB
+    if itinerary:
+        return itinerary, None, None
+    
+    user_id = data.get('userId')
+    conversation_id = data.get('conversationId')
+    
+    if not user_id or not conversation_id:
+        raise ValueError("Missing 'itinerary' or ('userId' and 'conversationId')")
+    
+    dynamodb_service = get_dynamodb_service()
+    trip, itinerary = _itinerary_enricher().load_trip_itinerary(
+        dynamodb_service, user_id, conversation_id
+    )
+    return itinerary, trip, dynamodb_service
+
+
+def _persist_coords(dynamodb_service, trip: dict, coords: dict):
+    """坐标有变化时写回 DynamoDB，下次打开地图直接复用"""
+    if not trip or coords == trip.get('activityCoords'):
+        return
+    
+    try:
+        dynamodb_service.save_activity_coords(
+            trip['userId'], trip['conversationId'], coords
+        )
+    except Exception as e:
+        print(f"Error persisting coordinates: {str(e)}")
+
+
 @locations_bp.route('/enrich-itinerary', methods=['POST'])
 def enrich_itinerary():
     """
     从完整行程中提取并增强所有地点信息
     
+    从 DynamoDB 读取的行程会把坐标（按 activity 内容哈希）保存回行程记录，
+    之后只对内容变化或之前失败的 activity 重新地理编码
+    
     请求体:
     {
         "conversationId": "conv-xxx",
@@ -134,114 +176,168 @@ def enrich_itinerary():
     }
     """
     try:
-        from services.dynamodb_service import DynamoDBService
-        import json
+        data = request.get_json() or {}
         
-        data = request.get_json()
-        itinerary = data.get('itinerary')
+        try:
+            itinerary, trip, dynamodb_service = _resolve_itinerary(data)
+        except ValueError as e:
+            return error_response(str(e), 400)
+        except ItineraryNotFound as e:
+            return error_response(str(e), 404)
         
-        # 如果没有传 itinerary，从 DynamoDB 读取
-        if not itinerary:
-            user_id = data.get('userId')
-            conversation_id = data.get('conversationId')
-            
-            if not user_id or not conversation_id:
-                return error_response(
-                    "Missing 'itinerary' or ('userId' and 'conversationId')", 
-                    400
-                )
-            
-            dynamodb_service = DynamoDBService()
-            trip = dynamodb_service.get_trip_by_id(user_id, conversation_id)
-            
-            if not trip:
-                return error_response("Trip not found", 404)
-            
-            # 如果是 parameters 类型，尝试找对应的 itinerary
-            if trip.get('dataType') == 'parameters':
-                all_trips = dynamodb_service.get_user_trips(user_id, limit=50)
-                itinerary_trip = None
-                
-                for t in all_trips:
-                    if t.get('dataType') == 'itinerary':
-                        itinerary_trip = t
-                        break
-                
-                if itinerary_trip:
-                    trip = itinerary_trip
-                else:
-                    return error_response("No complete itinerary found for this user", 404)
-            
-            # 尝试从不同位置获取 itinerary（必须是数组格式）
-            itinerary = trip.get('itinerary')
-            
-            # 如果在外层有 itinerary，检查是否是嵌套的
-            if itinerary and isinstance(itinerary, dict) and 'itinerary' in itinerary:
-                itinerary = itinerary['itinerary']
-            
-            # 验证 itinerary 是数组格式
-            if not itinerary or not isinstance(itinerary, list):
-                return error_response("No valid itinerary array found in trip data", 404)
-        
-        # 提取并增强所有地点
-        enriched_itinerary = []
-        total_locations = 0
-        enriched_count = 0
-        failed_locations = []
+        known_coords = trip.get('activityCoords') if trip else None
+        result = _itinerary_enricher().enrich(itinerary, known_coords)
+        _persist_coords(dynamodb_service, trip, result.pop('coords'))
         
-        for day_plan in itinerary:
-            day_data = {
-                "day": day_plan.get('day'),
-                "date": day_plan.get('date'),
-                "theme": day_plan.get('theme'),
-                "activities": []
-            }
-            
-            for activity in day_plan.get('activities', []):
-                total_locations += 1
+        if not result['failed_locations']:
+            del result['failed_locations']
+        
+        summary = result['summary']
+        return success_response(
+            result,
+            f"Enriched {summary['enriched']}/{summary['total_locations']} locations"
+        )
+        
+    except Exception as e:
+        return error_response(f"Error enriching itinerary: {str(e)}", 500)
+
+
+@locations_bp.route('/enrich-itinerary/stream', methods=['POST'])
+def enrich_itinerary_stream():
+    """
+    流式增强行程：每个地点的坐标一确定就推送，前端可以边收边在地图上打点
+    
+    请求体: 同 /enrich-itinerary
+    
+    响应: Server-Sent Events (SSE) 流
+    data: {"type": "activity", "dayIndex": 0, "activityIndex": 1, "day": 1, "activity": {...}}
+    data: {"type": "day", "dayIndex": 0, "day": 1, "date": "...", "theme": "...", "activities": [...]}
+    data: {"type": "summary", "summary": {...}, "failed_locations": [...]}
+    data: {"type": "done"}
+    """
+    try:
+        data = request.get_json() or {}
+        
+        try:
+            itinerary, trip, dynamodb_service = _resolve_itinerary(data)
+        except ValueError as e:
+            return error_response(str(e), 400)
+        except ItineraryNotFound as e:
+            return error_response(str(e), 404)
+        
+        known_coords = trip.get('activityCoords') if trip else None
+        itinerary_enricher = _itinerary_enricher()
+        
+        def generate():
+            try:
+                for event in itinerary_enricher.iter_enrich(itinerary, known_coords):
+                    if event['type'] == 'summary':
+                        _persist_coords(dynamodb_service, trip, event.pop('coords'))
+                    
+                    yield sse_event(event)
                 
-                name = activity.get('name', '')
-                address = activity.get('address', '')
-                query = f"{name}, {address}" if address else name
+                yield sse_event({'type': 'done'})
                 
-                try:
-                    coords = maps_service.geocode_location(query)
-                    
-                    if coords:
-                        enriched_count += 1
-                    else:
-                        failed_locations.append(name)
-                    
-                    activity_with_coords = activity.copy()
-                    activity_with_coords['coordinates'] = coords
-                    
-                    day_data['activities'].append(activity_with_coords)
-                    
-                except Exception as e:
-                    print(f"Error processing '{name}': {str(e)}")
-                    failed_locations.append(name)
-                    activity_with_coords = activity.copy()
-                    activity_with_coords['coordinates'] = None
-                    day_data['activities'].append(activity_with_coords)
-            
-            enriched_itinerary.append(day_data)
+            except Exception as e:
+                yield sse_event({'type': 'error', 'message': str(e)})
         
-        response_data = {
-            "itinerary_with_coords": enriched_itinerary,
-            "summary": {
-                "total_locations": total_locations,
-                "enriched": enriched_count,
-                "failed": len(failed_locations)
-            }
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers=SSE_HEADERS
+        )
+        
+    except Exception as e:
+        return error_response(f"Error enriching itinerary: {str(e)}", 500)
+
+
+@locations_bp.route('/cache/stats', methods=['GET'])
+def geocode_cache_stats():
+    """
+    地理编码缓存统计
+    
+    响应:
+    {
+        "success": true,
+        "data": {
+            "enabled": true,
+            "hits": 120,
+            "misses": 30,
+            "hit_rate": 0.8,
+            ...
         }
+    }
+    """
+    return success_response(get_maps_service().cache_stats(), "Geocode cache stats")
+
+
+@locations_bp.route('/prefetch', methods=['POST'])
+def submit_prefetch():
+    """
+    提交后台预取任务（保存行程和 Agent 回复行程时会自动提交，一般不需要手动调用）
+    
+    请求体（二选一）:
+    {
+        "userId": "user-xxx",
+        "conversationId": "conv-xxx"  // 增强该行程并把坐标保存回记录
+    }
+    {
+        "locations": ["Tokyo Tower, Tokyo", "Senso-ji"]  // 预热这些查询的地理编码缓存
+    }
+    
+    响应: 202，data 为任务（相同任务排队或执行中时返回已有的任务）
+    """
+    try:
+        data = request.get_json() or {}
+        prefetcher = get_prefetcher()
         
-        if failed_locations:
-            response_data["failed_locations"] = failed_locations
+        if data.get('locations'):
+            locations = data['locations']
+            if not isinstance(locations, list) or not all(isinstance(name, str) for name in locations):
+                return error_response("'locations' must be an array of strings", 400)
+            job = prefetcher.submit_locations(locations)
+        elif data.get('userId') and data.get('conversationId'):
+            job = prefetcher.submit_trip(data['userId'], data['conversationId'])
+        else:
+            return error_response("Missing 'locations' or ('userId' and 'conversationId')", 400)
         
-        return success_response(
-            response_data,
-            f"Enriched {enriched_count}/{total_locations} locations"
-        )
+        return success_response(job.to_dict(), "Prefetch job accepted", 202)
         
+    except PrefetchRejected as e:
+        return error_response(str(e), 503)
     except Exception as e:
-        return error_response(f"Error enriching itinerary: {str(e)}", 500)
\ No newline at end of file
+        return error_response(f"Error submitting prefetch job: {str(e)}", 500)
+
+
+@locations_bp.route('/prefetch', methods=['GET'])
+def list_prefetch_jobs():
+    """
+    预取队列状态和最近的任务
+    
+    查询参数:
+        status: 可选，只返回该状态的任务（queued / running / done / failed / cancelled）
+    """
+    prefetcher = get_prefetcher()
+    jobs = prefetcher.jobs(request.args.get('status'))
+    return success_response({
+        "stats": prefetcher.stats(),
+        "jobs": [job.to_dict() for job in jobs]
+    }, f"Found {len(jobs)} prefetch jobs")
+
+
+@locations_bp.route('/prefetch/<job_id>', methods=['GET'])
+def get_prefetch_job(job_id):
+    """查询单个预取任务"""
+    job = get_prefetcher().get(job_id)
+    if not job:
+        return error_response("Prefetch job not found", 404)
+    return success_response(job.to_dict(), "Prefetch job retrieved")
+
+
+@locations_bp.route('/prefetch/<job_id>', methods=['DELETE'])
+def cancel_prefetch_job(job_id):
+    """取消预取任务（执行中的任务在当前这批地理编码完成后停止）"""
+    job = get_prefetcher().cancel(job_id)
+    if not job:
+        return error_response("Prefetch job not found", 404)
+    return success_response(job.to_dict(), "Prefetch job cancelled")
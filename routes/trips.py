@@ -1,9 +1,14 @@
-from flask import Blueprint, request
-from services.dynamodb_service import DynamoDBService
-from utils.response import success_response, error_response
+from flask import Blueprint, request, Response, stream_with_context
+from config import Config
+from services.clients import get_dynamodb_service
+from services.export import parse_export_date, iter_ndjson, gzip_chunks, accepts_gzip
+from services.pagination import InvalidCursor, LIST_VIEWS
+from services.trip_purge import TripPurge
+from utils.response import success_response, error_response, conditional_response
+import itertools
+import time
 
 trips_bp = Blueprint('trips', __name__, url_prefix='/api/trips')
-dynamodb_service = DynamoDBService()
 
 @trips_bp.route('/<user_id>', methods=['GET'])
 def get_trips(user_id):
@@ -12,6 +17,10 @@ def get_trips(user_id):
     
     Query 参数:
     - limit: 返回数量，默认 20
+    - cursor: 上一页响应中的 nextCursor（可选）
+    - view: full（默认，包含完整 itinerary）或 summary（只返回目的地、日期、天数、预算等摘要字段）
+    
+    响应带有 ETag，支持 If-None-Match → 304
     
     响应:
     {
@@ -24,14 +33,27 @@ def get_trips(user_id):
                 "days": 3,
                 "itinerary": {...}
             }
-        ]
+        ],
+        "nextCursor": "eyJ1c2VySWQiOi..."  // 没有更多数据时为 null
     }
     """
     try:
         limit = request.args.get('limit', 20, type=int)
-        trips = dynamodb_service.get_user_trips(user_id, limit)
-        return success_response(trips, f"Found {len(trips)} trips")
+        cursor = request.args.get('cursor')
+        view = request.args.get('view', 'full')
+        
+        if view not in LIST_VIEWS:
+            return error_response(f"'view' must be one of: {', '.join(LIST_VIEWS)}", 400)
         
+        trips, next_cursor, etag = get_dynamodb_service().get_user_trips_page_with_etag(
+            user_id, limit, cursor, view
+        )
+        return conditional_response(
+            trips, f"Found {len(trips)} trips", etag, extra={"nextCursor": next_cursor}
+        )
+        
+    except InvalidCursor as e:
+        return error_response(str(e), 400)
     except Exception as e:
         return error_response(f"Error fetching trips: {str(e)}", 500)
 
@@ -41,6 +63,8 @@ def get_trip(user_id, conversation_id):
     """
     获取特定行程详情
     
+    响应带有 ETag，客户端轮询时带上 If-None-Match，行程未变化则返回 304（无响应体）
+    
     响应:
     {
         "success": true,
@@ -52,17 +76,54 @@ def get_trip(user_id, conversation_id):
     }
     """
     try:
-        trip = dynamodb_service.get_trip_by_id(user_id, conversation_id)
+        trip, etag = get_dynamodb_service().get_trip_with_etag(user_id, conversation_id)
         
         if not trip:
             return error_response("Trip not found", 404)
         
-        return success_response(trip, "Trip found")
+        return conditional_response(trip, "Trip found", etag)
         
     except Exception as e:
         return error_response(f"Error fetching trip: {str(e)}", 500)
 
 
+@trips_bp.route('/<user_id>/batch', methods=['POST'])
+def get_trips_batch(user_id):
+    """
+    批量获取行程详情（对比视图、收藏夹等同时展示多个行程时使用）
+    
+    请求体:
+    {
+        "conversationIds": ["conv-xxx", "conv-yyy"]
+    }
+    
+    响应:
+    {
+        "success": true,
+        "data": [
+            {"conversationId": "conv-xxx", "destination": "Tokyo", "itinerary": {...}}
+        ],
+        "missing": ["conv-yyy"]  // 不存在的行程
+    }
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        conversation_ids = data.get('conversationIds')
+        
+        if not isinstance(conversation_ids, list) or not conversation_ids \
+                or not all(isinstance(conversation_id, str) and conversation_id
+                           for conversation_id in conversation_ids):
+            return error_response("'conversationIds' must be a non-empty array of strings", 400)
+        if len(conversation_ids) > Config.TRIP_BATCH_MAX_IDS:
+            return error_response(f"At most {Config.TRIP_BATCH_MAX_IDS} conversationIds per request", 400)
+        
+        trips, missing = get_dynamodb_service().get_trips_by_ids(user_id, conversation_ids)
+        return success_response(trips, f"Found {len(trips)} trips", extra={"missing": missing})
+        
+    except Exception as e:
+        return error_response(f"Error fetching trips: {str(e)}", 500)
+
+
 @trips_bp.route('/<user_id>/search', methods=['GET'])
 def search_trips(user_id):
     """
@@ -71,20 +132,36 @@ def search_trips(user_id):
     Query 参数:
     - destination: 目的地（可选）
     - budget_tier: 预算等级（可选）
+    - limit: 返回数量，默认 20
+    - cursor: 上一页响应中的 nextCursor（可选）
+    - view: full（默认）或 summary
     
     响应:
     {
         "success": true,
-        "data": [...]
+        "data": [...],
+        "nextCursor": "..."
     }
     """
     try:
         destination = request.args.get('destination')
         budget_tier = request.args.get('budget_tier')
+        limit = request.args.get('limit', 20, type=int)
+        cursor = request.args.get('cursor')
+        view = request.args.get('view', 'full')
+        
+        if view not in LIST_VIEWS:
+            return error_response(f"'view' must be one of: {', '.join(LIST_VIEWS)}", 400)
         
-        trips = dynamodb_service.search_trips(user_id, destination, budget_tier)
-        return success_response(trips, f"Found {len(trips)} matching trips")
+        trips, next_cursor = get_dynamodb_service().search_trips_page(
+            user_id, destination, budget_tier, limit, cursor, view
+        )
+        return success_response(
+            trips, f"Found {len(trips)} matching trips", extra={"nextCursor": next_cursor}
+        )
         
+    except InvalidCursor as e:
+        return error_response(str(e), 400)
     except Exception as e:
         return error_response(f"Error searching trips: {str(e)}", 500)
 
@@ -101,7 +178,7 @@ def delete_trip(user_id, conversation_id):
     }
     """
     try:
-        success = dynamodb_service.delete_trip(user_id, conversation_id)
+        success = get_dynamodb_service().delete_trip(user_id, conversation_id)
         
         if success:
             return success_response(None, "Trip deleted successfully")
@@ -112,6 +189,66 @@ def delete_trip(user_id, conversation_id):
         return error_response(f"Error deleting trip: {str(e)}", 500)
 
 
+@trips_bp.route('/<user_id>/purge', methods=['POST'])
+def purge_data(user_id):
+    """
+    批量删除用户的记录（注销账号、清理废弃的 parameters 记录）
+    
+    请求体（都是可选的，不带过滤条件时删除该用户的所有记录和搜索索引）:
+    {
+        "dataType": "parameters",  // 只删除该类型的记录
+        "olderThanDays": 30,  // 只删除创建时间早于 N 天前的记录
+        "dryRun": true,  // 只统计将被删除的记录
+        "confirm": true  // 实际删除时必须带上
+    }
+    
+    响应:
+    {
+        "success": true,
+        "data": {
+            "matched": 120,
+            "byType": {"itinerary": 80, "parameters": 40},
+            "deleted": 120,
+            "searchEntriesDeleted": 240,
+            "failed": 0,
+            ...
+        }
+    }
+    
+    部分批次删除失败时返回 500，error 中为同样格式的统计（重新执行即可删除剩余的记录）
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        data_type = data.get('dataType')
+        older_than_days = data.get('olderThanDays')
+        dry_run = data.get('dryRun') is True
+        
+        if data_type is not None and not isinstance(data_type, str):
+            return error_response("'dataType' must be a string", 400)
+        if older_than_days is not None and (isinstance(older_than_days, bool)
+                                            or not isinstance(older_than_days, (int, float))
+                                            or older_than_days < 0):
+            return error_response("'olderThanDays' must be a non-negative number", 400)
+        if not dry_run and data.get('confirm') is not True:
+            return error_response("Set 'confirm': true to delete, or 'dryRun': true to preview", 400)
+        
+        older_than_ms = None
+        if older_than_days is not None:
+            older_than_ms = int((time.time() - older_than_days * 86400) * 1000)
+        
+        report = TripPurge(get_dynamodb_service()).run(user_id, data_type, older_than_ms, dry_run)
+        
+        if not report['done']:
+            return error_response(f"Purge incomplete: {report['failed']} deletes failed", 500, report)
+        
+        message = f"Would delete {report['matched']} records" if dry_run \
+            else f"Deleted {report['deleted']} records"
+        return success_response(report, message)
+        
+    except Exception as e:
+        return error_response(f"Error purging data: {str(e)}", 500)
+
+
 @trips_bp.route('/<user_id>/parameters', methods=['GET'])
 def get_parameters(user_id):
     """
@@ -129,17 +266,78 @@ def get_parameters(user_id):
                     ...
                 }
             }
-        ]
+        ],
+        "nextCursor": "..."
     }
     """
     try:
         limit = request.args.get('limit', 10, type=int)
-        parameters = dynamodb_service.get_user_parameters(user_id, limit)
-        return success_response(parameters, f"Found {len(parameters)} parameter records")
+        cursor = request.args.get('cursor')
+        parameters, next_cursor = get_dynamodb_service().get_user_parameters_page(user_id, limit, cursor)
+        return success_response(
+            parameters, f"Found {len(parameters)} parameter records", extra={"nextCursor": next_cursor}
+        )
         
+    except InvalidCursor as e:
+        return error_response(str(e), 400)
     except Exception as e:
         return error_response(f"Error fetching parameters: {str(e)}", 500)
 
+@trips_bp.route('/<user_id>/export', methods=['GET'])
+def export_data(user_id):
+    """
+    导出用户的所有数据（NDJSON，每行一条记录，按创建时间正序）
+    
+    逐页读取整个分区并边读边写出，内存占用与记录数无关；
+    请求头 Accept-Encoding 包含 gzip 时以 gzip 压缩输出（Content-Encoding: gzip）
+    
+    Query 参数:
+    - dataType: 只导出该类型的记录（itinerary / parameters，可选）
+    - since: 只导出该日期（含）之后创建的记录，YYYY-MM-DD 或 ISO 8601 时间（UTC，可选）
+    - until: 只导出该日期（含）之前创建的记录（可选）
+    
+    响应:
+    {"userId": "...", "conversationId": "conv-xxx", "dataType": "parameters", "tripData": {...}}
+    {"userId": "...", "conversationId": "conv-yyy", "dataType": "itinerary", "itinerary": {...}}
+    
+    导出中途出错时最后一行为 {"error": "..."}
+    """
+    try:
+        data_type = request.args.get('dataType')
+        try:
+            since_ms = parse_export_date(request.args.get('since'))
+            until_ms = parse_export_date(request.args.get('until'), end=True)
+        except ValueError:
+            return error_response("'since' / 'until' must be YYYY-MM-DD or ISO 8601 datetimes", 400)
+        
+        items = get_dynamodb_service().iter_user_data(user_id, data_type, since_ms, until_ms)
+        
+        # 先读取第一条：查询本身失败时还能返回 500，而不是一个中断的 200 响应
+        first = next(items, None)
+        if first is not None:
+            items = itertools.chain([first], items)
+        
+        body = iter_ndjson(items, Config.EXPORT_CHUNK_BYTES)
+        headers = {
+            'Content-Disposition': f'attachment; filename="{user_id}.ndjson"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no',
+            'Vary': 'Accept-Encoding'
+        }
+        if accepts_gzip(request.headers.get('Accept-Encoding')):
+            body = gzip_chunks(body)
+            headers['Content-Encoding'] = 'gzip'
+        
+        return Response(
+            stream_with_context(body),
+            mimetype='application/x-ndjson',
+            headers=headers
+        )
+        
+    except Exception as e:
+        return error_response(f"Error exporting data: {str(e)}", 500)
+
+
 @trips_bp.route('/<user_id>/all', methods=['GET'])
 def get_all_data(user_id):
     """
@@ -155,8 +353,11 @@ def get_all_data(user_id):
     """
     try:
         limit = request.args.get('limit', 50, type=int)
-        all_data = dynamodb_service.get_all_user_data(user_id, limit)
-        return success_response(all_data, f"Found {len(all_data)} records")
+        cursor = request.args.get('cursor')
+        all_data, next_cursor = get_dynamodb_service().get_all_user_data_page(user_id, limit, cursor)
+        return success_response(all_data, f"Found {len(all_data)} records", extra={"nextCursor": next_cursor})
         
+    except InvalidCursor as e:
+        return error_response(str(e), 400)
     except Exception as e:
         return error_response(f"Error fetching data: {str(e)}", 500)
\ No newline at end of file
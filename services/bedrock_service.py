@@ -1,26 +1,90 @@
-import boto3
 import json
+import time
+from typing import List
 from config import Config
-from botocore.config import Config as BotoConfig 
+from services import clients
+from services.response_cache import FirstTurnCache, ReplayStore
+from services.trace_analyzer import TraceAnalyzer
+from utils.admission import AdmissionController, is_throttling
+from utils.metrics import StreamTimer
 
 #  这段代码定义了一个叫 BedrockService 的类，用来初始化 AWS 客户端，以便后续向 Bedrock 发送请求。
 class BedrockService:
     def __init__(self):
-        boto_config = BotoConfig(
-        read_timeout=300,  
-        connect_timeout=60
-        )
-        self.client = boto3.client(
-            'bedrock-agent-runtime',
-            region_name=Config.AWS_REGION,
-            aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY,
-            config=boto_config
-        )
+        # 共享客户端（连接池、keep-alive、重试配置见 services/clients.py）
+        self.client = clients.bedrock_agent_runtime()
         self.agent_id = Config.BEDROCK_AGENT_ID
         self.agent_alias_id = Config.BEDROCK_AGENT_ALIAS_ID
+        
+        # 新会话第一轮的回复缓存（可选，只用于没有写入类 Action Group 的别名）
+        self.response_cache = None
+        self.replayed_turns = None
+        if Config.CHAT_CACHE_ENABLED:
+            if self.agent_alias_id in Config.CHAT_CACHE_READONLY_ALIASES:
+                self.response_cache = FirstTurnCache()
+                # 由缓存回复开始的会话：Agent 端没有这一轮，下一轮调用时需要补上
+                replay_table = None
+                if Config.CHAT_CACHE_REPLAY_TABLE_NAME:
+                    replay_table = clients.dynamodb().Table(Config.CHAT_CACHE_REPLAY_TABLE_NAME)
+                    if not ReplayStore.table_exists(replay_table):
+                        print(f"Chat replay table {Config.CHAT_CACHE_REPLAY_TABLE_NAME} does not exist "
+                              f"(run: flask --app app create-chat-replay-table); "
+                              f"keeping replayed turns in this process only")
+                        replay_table = None
+                self.replayed_turns = ReplayStore(replay_table)
+            else:
+                print(f"Chat cache disabled: agent alias {self.agent_alias_id} "
+                      f"is not listed in CHAT_CACHE_READONLY_ALIASES")
+        
+        # 准入控制（由路由在调用前申请，见 utils/admission.py）；收到限流错误时下调并发上限
+        self.admission = AdmissionController(
+            Config.CHAT_MAX_CONCURRENCY,
+            per_user=Config.CHAT_MAX_CONCURRENCY_PER_USER,
+            queue_size=Config.CHAT_QUEUE_SIZE,
+            max_wait=Config.CHAT_QUEUE_TIMEOUT
+        )
+    
+    def _cache_key(self, user_message: str) -> str:
+        return FirstTurnCache.make_key(self.agent_id, self.agent_alias_id, user_message)
+    
+    def _cached_first_turn(self, user_message: str, session_id: str):
+        """查询第一轮缓存；命中时记下这一轮，供该会话的下一轮补上上下文"""
+        chunks = self.response_cache.get(self._cache_key(user_message), user_message)
+        if chunks is not None:
+            self.replayed_turns.set(session_id, user_message, ''.join(chunks))
+        return chunks
+    
+    def _agent_input(self, user_message: str, session_id: str) -> str:
+        """
+        发给 Agent 的输入文本
+        
+        会话的第一轮来自缓存时，Agent 的会话里没有这一轮，
+        把它和本轮消息一起发送，保证 Agent 能接上之前的对话
+        """
+        if self.replayed_turns is None:
+            return user_message
+        replayed = self.replayed_turns.get(session_id)
+        if replayed is None:
+            return user_message
+        
+        previous_message, previous_response = replayed
+        return (
+            f"Earlier in this conversation the user said:\n{previous_message}\n\n"
+            f"You replied:\n{previous_response}\n\n"
+            f"Continue the conversation. The user now says:\n{user_message}"
+        )
+    
+    def cache_stats(self) -> dict:
+        """第一轮回复缓存的命中率和节省的 token（估算）"""
+        if not self.response_cache:
+            return {"enabled": False}
+        
+        stats = self.response_cache.stats()
+        stats["enabled"] = True
+        return stats
     
-    def invoke_agent(self, user_message: str, session_id: str, enable_trace: bool = False):
+    def invoke_agent(self, user_message: str, session_id: str, enable_trace: bool = False,
+                     use_cache: bool = False):
         """
         调用 Bedrock Agent
         
@@ -28,36 +92,61 @@ class BedrockService:
             user_message: 用户消息
             session_id: 会话 ID
             enable_trace: 是否启用追踪（调试用）
+            use_cache: 是否使用第一轮回复缓存（仅适用于新会话的第一条消息）
         
         Returns:
             dict: {
                 "response": str,  # Agent 的回复
                 "session_id": str,
-                "trace": list  # 如果 enable_trace=True
+                "trace": list,  # 如果 enable_trace=True
+                "trace_summary": dict,  # 如果 enable_trace=True，见 TraceAnalyzer.analyze
+                "cached": true  # 仅在命中缓存时出现
             }
         """
+        use_cache = use_cache and self.response_cache is not None and not enable_trace
+        timer = None
+        
         try:
+            if use_cache:
+                chunks = self._cached_first_turn(user_message, session_id)
+                if chunks is not None:
+                    return {
+                        "response": ''.join(chunks),
+                        "session_id": session_id,
+                        "cached": True
+                    }
+            
+            input_text = self._agent_input(user_message, session_id)
+            timer = StreamTimer('invoke_agent')
             response = self.client.invoke_agent(
                 agentId=self.agent_id,
                 agentAliasId=self.agent_alias_id,
                 sessionId=session_id,
-                inputText=user_message,
+                inputText=input_text,
                 enableTrace=enable_trace
             )
+            if input_text != user_message:
+                self.replayed_turns.delete(session_id)
             
             # 解析流式响应
             event_stream = response['completion']
             agent_response = ""
             trace_data = []
+            trace_arrivals = []  # 每个 trace 事件的到达时间（相对于调用开始）
+            first_chunk = None
             
             for event in event_stream:
                 if 'chunk' in event:
                     chunk = event['chunk']
                     if 'bytes' in chunk:
+                        timer.chunk()
+                        if first_chunk is None:
+                            first_chunk = time.perf_counter() - timer.start
                         agent_response += chunk['bytes'].decode('utf-8')
                 
                 if enable_trace and 'trace' in event:
                     trace_data.append(event['trace'])
+                    trace_arrivals.append(time.perf_counter() - timer.start)
             
             result = {
                 "response": agent_response,
@@ -66,37 +155,89 @@ class BedrockService:
             
             if enable_trace:
                 result["trace"] = trace_data
+                result["trace_summary"] = TraceAnalyzer().analyze(
+                    trace_data, trace_arrivals,
+                    total=time.perf_counter() - timer.start,
+                    first_chunk=first_chunk
+                )
+            
+            timer.finish('success')
+            
+            if use_cache:
+                self.response_cache.set(self._cache_key(user_message), [agent_response])
             
             return result
             
         except Exception as e:
+            if timer:
+                timer.finish('error')
+            if is_throttling(e):
+                self.admission.throttled()
             print(f"Error invoking Bedrock Agent: {str(e)}")
             raise
     
-    def invoke_agent_stream(self, user_message: str, session_id: str):
+    def invoke_agent_stream(self, user_message: str, session_id: str, use_cache: bool = False):
         """
         流式调用 Bedrock Agent（用于实时响应）
         
+        Args:
+            use_cache: 是否使用第一轮回复缓存；命中时按原分片重放，
+                       未命中时完整收到回复后写入缓存
+        
         Yields:
             str: 逐步返回的文本片段
         """
+        use_cache = use_cache and self.response_cache is not None
+        timer = None
+        
         try:
+            if use_cache:
+                chunks = self._cached_first_turn(user_message, session_id)
+                if chunks is not None:
+                    yield from chunks
+                    return
+            
+            input_text = self._agent_input(user_message, session_id)
+            timer = StreamTimer('invoke_agent_stream')
             response = self.client.invoke_agent(
                 agentId=self.agent_id,
                 agentAliasId=self.agent_alias_id,
                 sessionId=session_id,
-                inputText=user_message,
+                inputText=input_text,
                 enableTrace=False
             )
+            if input_text != user_message:
+                self.replayed_turns.delete(session_id)
             
             event_stream = response['completion']
+            collected: List[str] = []
             
-            for event in event_stream:
-                if 'chunk' in event:
-                    chunk = event['chunk']
-                    if 'bytes' in chunk:
-                        yield chunk['bytes'].decode('utf-8')
+            try:
+                for event in event_stream:
+                    if 'chunk' in event:
+                        chunk = event['chunk']
+                        if 'bytes' in chunk:
+                            timer.chunk()
+                            text = chunk['bytes'].decode('utf-8')
+                            collected.append(text)
+                            yield text
+                
+                timer.finish('success')
+                
+                # 只缓存完整收到的回复
+                if use_cache:
+                    self.response_cache.set(self._cache_key(user_message), collected)
+            except GeneratorExit:
+                timer.finish('cancelled')
+                raise
+            finally:
+                # 调用方提前停止（如客户端断开）时立即释放 HTTP 连接
+                event_stream.close()
                         
         except Exception as e:
+            if timer:
+                timer.finish('error')
+            if is_throttling(e):
+                self.admission.throttled()
             print(f"Error in streaming: {str(e)}")
             raise
\ No newline at end of file
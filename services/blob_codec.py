@@ -0,0 +1,47 @@
+# services/blob_codec.py
+import json
+import zlib
+from typing import Any, Dict
+
+from config import Config
+
+# 格式版本（编码结果的第一个字节），以后换用其他压缩算法时新增版本号
+VERSION_ZLIB_JSON = 1
+
+# 旧的 JSON 字符串字段 → 压缩后的二进制字段
+BLOB_ATTRIBUTES = {
+    'fullItinerary': 'fullItineraryZ',
+    'tripJson': 'tripJsonZ'
+}
+
+
+def encode_blob(value: Any) -> bytes:
+    """
+    把 JSON 文本（或可序列化的对象）编码为带版本号的压缩二进制
+
+    格式: [版本号 1 字节][zlib 压缩的 UTF-8 JSON]
+    """
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    return bytes([VERSION_ZLIB_JSON]) + zlib.compress(text.encode('utf-8'), Config.BLOB_COMPRESSION_LEVEL)
+
+
+def decode_blob(data: Any) -> Any:
+    """解码 encode_blob 的结果（也接受 boto3 返回的 Binary 对象）"""
+    raw = bytes(data.value if hasattr(data, 'value') else data)
+
+    if not raw:
+        raise ValueError("Empty blob")
+
+    version = raw[0]
+    if version == VERSION_ZLIB_JSON:
+        return json.loads(zlib.decompress(raw[1:]).decode('utf-8'))
+
+    raise ValueError(f"Unsupported blob version: {version}")
+
+
+def compress_item(item: Dict) -> Dict:
+    """把记录中的 JSON 字符串字段替换为压缩字段（原地修改）"""
+    for text_attr, blob_attr in BLOB_ATTRIBUTES.items():
+        if text_attr in item:
+            item[blob_attr] = encode_blob(item.pop(text_attr))
+    return item
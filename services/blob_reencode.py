@@ -0,0 +1,152 @@
+# services/blob_reencode.py
+import time
+from typing import Callable, Dict, Optional
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from services.blob_codec import BLOB_ATTRIBUTES, encode_blob
+from utils.checkpoint import load_checkpoint, save_checkpoint
+
+
+class BlobReencode:
+    """
+    在线把旧记录的 fullItinerary / tripJson 字符串重新编码为压缩字段
+
+    - 分批扫描仍有字符串字段的记录，逐条条件更新（字段内容未变化才写入）
+    - 默认保留原来的字符串字段（还不支持压缩字段的读取方照常读取）；
+      drop_legacy=True 时才删除字符串字段，只应在所有读取方都支持压缩字段之后使用
+    - 每批处理完写一次检查点文件，中断后从检查点继续
+    """
+
+    def __init__(self, table, checkpoint_path: Optional[str] = None,
+                 batch_size: int = 50, pause: float = 0.0, drop_legacy: bool = False):
+        self.table = table
+        self.drop_legacy = drop_legacy
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def run(self, max_batches: Optional[int] = None,
+            progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        执行重新编码（从检查点继续）
+
+        Args:
+            max_batches: 最多处理的批次数（可选）
+            progress: 每批结束后的回调，参数为当前统计
+
+        Returns:
+            {"last_key", "scanned", "updated", "skipped", "bytes_before", "bytes_after", "done", "drop_legacy"}
+        """
+        initial = {
+            "last_key": None, "scanned": 0, "updated": 0, "skipped": 0,
+            "bytes_before": 0, "bytes_after": 0, "done": False, "drop_legacy": self.drop_legacy
+        }
+        state = load_checkpoint(self.checkpoint_path, initial)
+        if state.get('done'):
+            # 已经以另一种模式完成过（如先保留字符串字段，之后再删除）：重新扫描
+            if state.get('drop_legacy', True) == self.drop_legacy:
+                return state
+            state = initial
+
+        names = ('userId', 'conversationId') + tuple(BLOB_ATTRIBUTES)
+        filter_expression = None
+        for text_attr, blob_attr in BLOB_ATTRIBUTES.items():
+            # 保留字符串字段时，已经有压缩字段的记录不需要再处理
+            condition = Attr(text_attr).exists() if self.drop_legacy \
+                else Attr(text_attr).exists() & Attr(blob_attr).not_exists()
+            filter_expression = condition if filter_expression is None else filter_expression | condition
+
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            kwargs = {
+                'ProjectionExpression': ', '.join(f"#p{i}" for i in range(len(names))),
+                'ExpressionAttributeNames': {f"#p{i}": name for i, name in enumerate(names)},
+                'FilterExpression': filter_expression,
+                'Limit': self.batch_size
+            }
+            if state['last_key']:
+                kwargs['ExclusiveStartKey'] = state['last_key']
+
+            response = self.table.scan(**kwargs)
+            state['scanned'] += response.get('ScannedCount', 0)
+
+            for item in response.get('Items', []):
+                sizes = self._reencode_item(item)
+                if sizes:
+                    state['updated'] += 1
+                    state['bytes_before'] += sizes[0]
+                    state['bytes_after'] += sizes[1]
+                else:
+                    state['skipped'] += 1
+
+            state['last_key'] = response.get('LastEvaluatedKey')
+            state['done'] = state['last_key'] is None
+            save_checkpoint(self.checkpoint_path, state)
+            batches += 1
+
+            if progress:
+                progress(state)
+
+            if state['done']:
+                break
+
+            if self.pause:
+                time.sleep(self.pause)
+
+        return state
+
+    def _reencode_item(self, item: Dict):
+        """
+        重新编码单条记录
+
+        Returns:
+            (原大小, 压缩后大小)；记录在此期间被修改或删除时返回 None
+        """
+        sets = []
+        removes = []
+        condition = None
+        values = {}
+        before = after = 0
+
+        for i, (text_attr, blob_attr) in enumerate(BLOB_ATTRIBUTES.items()):
+            if text_attr not in item:
+                continue
+
+            text = item[text_attr]
+            blob = encode_blob(text)
+            before += len(text.encode('utf-8'))
+            after += len(blob)
+
+            sets.append(f"{blob_attr} = :b{i}")
+            if self.drop_legacy:
+                removes.append(text_attr)
+            values[f":b{i}"] = blob
+
+            unchanged = Attr(text_attr).eq(text)
+            condition = unchanged if condition is None else condition & unchanged
+
+        if not sets:
+            return None
+
+        update_expression = f"SET {', '.join(sets)}"
+        if removes:
+            update_expression += f" REMOVE {', '.join(removes)}"
+
+        try:
+            self.table.update_item(
+                Key={
+                    'userId': item['userId'],
+                    'conversationId': item['conversationId']
+                },
+                UpdateExpression=update_expression,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+            return before, after
+
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
@@ -0,0 +1,294 @@
+# services/chat_stream.py
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from services import clients
+from services.clients import get_prefetcher
+from services.search_index import schedule_catch_up
+from services.stream_buffer import StreamBuffer, StreamRegistry
+from utils.sse import sse_comment, sse_event
+
+# 心跳（编码为 SSE 注释帧，EventSource 会忽略）
+HEARTBEAT = object()
+
+RESUME_UNAVAILABLE = "Stream can no longer be resumed, please resend the message"
+
+# 进行中和最近结束的流（按 sessionId + turnId），用于 Last-Event-ID 续传
+streams = StreamRegistry(
+    maxsize=Config.CHAT_STREAM_MAX_BUFFERS,
+    ttl=Config.CHAT_STREAM_BUFFER_TTL,
+    buffer_events=Config.CHAT_STREAM_BUFFER_EVENTS,
+    grace=Config.CHAT_STREAM_RESUME_GRACE
+)
+
+
+def first_turn_cacheable(data: Dict, cache_control: Optional[str] = None) -> bool:
+    """
+    请求是否可以使用第一轮回复缓存
+
+    只有不带 sessionId 的新会话可以使用；请求体 "cache": false
+    或请求头 Cache-Control: no-cache 时跳过缓存
+    """
+    if data.get('sessionId') or data.get('cache', True) is False:
+        return False
+    return 'no-cache' not in (cache_control or '').lower()
+
+
+def admission_key(data: Dict) -> Optional[str]:
+    """
+    准入控制中每个用户并发上限使用的标识（请求体中的 userId）
+
+    没有 userId 时返回 None，只受全局并发上限约束（不按客户端地址区分，避免同一出口 IP 的用户互相影响）
+    """
+    return data.get('userId') or None
+
+
+# /api/chat/send 的 trace 查询参数（None 表示不收集 trace）
+TRACE_MODES = (None, 'summary', 'full')
+
+
+def format_trace(result: Dict, trace: Optional[str]) -> Dict:
+    """
+    按 trace 参数整理 invoke_agent 的结果
+
+    summary 只返回耗时分解 traceSummary；full 同时保留原始 trace 事件
+    """
+    if trace is None:
+        return result
+
+    result = dict(result)
+    result['traceSummary'] = result.pop('trace_summary', None)
+    if trace == 'summary':
+        result.pop('trace', None)
+    return result
+
+
+def finish_agent_turn(reply: str, user_id: Optional[str] = None, session_id: Optional[str] = None):
+    """
+    一轮对话结束后的处理，不影响响应
+
+    - Agent 在这一轮中可能直接写入了行程（不经过 save_trip）：清除该用户在本进程中的行程读缓存
+    - 开启搜索索引时，在后台为该用户补写索引（见 services/search_index.py）
+    - 在后台预取回复中行程的坐标（见 services/prefetch.py）
+
+    请求体没有 userId 时使用会话 ID（Agent 保存行程时 userId 通常就是 sessionId）
+    """
+    user_id = user_id or session_id
+    # 本进程还没有创建 DynamoDBService 时缓存为空，不需要清除
+    dynamodb_service = clients.existing('dynamodb_service')
+    if user_id and dynamodb_service is not None:
+        dynamodb_service.invalidate_cache(user_id)
+    if user_id and Config.SEARCH_USE_INDEX:
+        schedule_catch_up(lambda: clients.get_dynamodb_service().search_index, user_id, force=True)
+    if Config.PREFETCH_ENABLED:
+        get_prefetcher().chat_reply(reply, user_id)
+
+
+def iter_chat_events(bedrock_service, user_message: str, session_id: str,
+                     use_cache: bool = False, user_id: Optional[str] = None) -> Iterator[Dict]:
+    """
+    一轮流式对话产生的事件序列（与传输方式无关，Flask 和 ASGI 两条路径共用）
+
+    命中第一轮回复缓存时，事件格式与实际调用 Agent 完全相同；完整收到回复后执行 finish_agent_turn
+
+    Yields:
+        {"type": "session", "sessionId": "..."}
+        {"type": "content", "text": "..."}  # 若干个
+        {"type": "done"}
+        出错时以 {"type": "error", "message": "..."} 结束
+    """
+    try:
+        # 先发送 session_id
+        yield {'type': 'session', 'sessionId': session_id}
+
+        # 流式返回内容
+        chunks = []
+        for chunk in bedrock_service.invoke_agent_stream(user_message, session_id, use_cache):
+            chunks.append(chunk)
+            yield {'type': 'content', 'text': chunk}
+
+        finish_agent_turn(''.join(chunks), user_id, session_id)
+
+        # 发送完成信号
+        yield {'type': 'done'}
+
+    except Exception as e:
+        yield {'type': 'error', 'message': str(e)}
+
+
+class ChunkCoalescer:
+    """
+    把时间窗口或字节窗口内的 content 事件合并为一个，并在长时间没有输出时产生心跳
+
+    与传输方式无关：调用方收到事件时调用 push，等待 wait_timeout() 秒仍没有新事件时调用 poll，
+    上游结束后调用 finish；三者都返回需要立即发送的事件列表（可能包含 HEARTBEAT）。
+    事件的 id 字段（SSE 事件 id）原样保留，合并后的 content 事件使用其中最后一个分片的 id
+
+    Args:
+        window: 合并窗口（秒），从缓冲区中第一个分片到达时开始计算；0 表示不合并
+        max_bytes: 缓冲的文本达到这个字节数时立即发送；0 表示不限
+        heartbeat: 超过这个秒数没有任何输出时发送心跳；0 表示不发送
+    """
+
+    def __init__(self, window: float, max_bytes: int, heartbeat: float):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.heartbeat = heartbeat
+        self._parts: List[str] = []
+        self._size = 0
+        self._since = 0.0
+        self._last_id: Optional[str] = None
+        self._last_output = time.monotonic()
+
+    @classmethod
+    def from_config(cls, coalesce: bool = True) -> 'ChunkCoalescer':
+        """
+        Args:
+            coalesce: False 时不合并（每个分片单独发送），仍然发送心跳
+        """
+        return cls(
+            Config.CHAT_STREAM_COALESCE_MS / 1000 if coalesce else 0,
+            Config.CHAT_STREAM_COALESCE_BYTES,
+            Config.CHAT_STREAM_HEARTBEAT_SECONDS
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 or self.heartbeat > 0
+
+    def push(self, event: Dict) -> List:
+        if event.get('type') == 'content' and self.window > 0:
+            if not self._parts:
+                self._since = time.monotonic()
+            self._parts.append(event['text'])
+            self._last_id = event.get('id')
+            self._size += len(event['text'].encode('utf-8'))
+            if self.max_bytes and self._size >= self.max_bytes:
+                return self._output(self._flush())
+            return []
+
+        # 其他事件（session / done / error）之前先发送缓冲的内容，保持顺序
+        return self._output(self._flush() + [event])
+
+    def poll(self) -> List:
+        now = time.monotonic()
+        if self._parts:
+            if now - self._since >= self.window:
+                return self._output(self._flush())
+        elif self.heartbeat and now - self._last_output >= self.heartbeat:
+            return self._output([HEARTBEAT])
+        return []
+
+    def finish(self) -> List:
+        return self._output(self._flush())
+
+    def wait_timeout(self) -> Optional[float]:
+        """距离下一次需要 poll 的秒数；None 表示一直等到下一个事件"""
+        if self._parts:
+            deadline = self._since + self.window
+        elif self.heartbeat:
+            deadline = self._last_output + self.heartbeat
+        else:
+            return None
+        return max(deadline - time.monotonic(), 0.0)
+
+    def _flush(self) -> List[Dict]:
+        if not self._parts:
+            return []
+        event = {'type': 'content', 'text': ''.join(self._parts)}
+        if self._last_id is not None:
+            event['id'] = self._last_id
+        self._parts = []
+        self._size = 0
+        return [event]
+
+    def _output(self, events: List) -> List:
+        if events:
+            self._last_output = time.monotonic()
+        return events
+
+
+def start_stream(bedrock_service, user_message: str, session_id: str, use_cache: bool,
+                 spawn: Callable[[Callable[[], None]], Any], permit=None,
+                 user_id: Optional[str] = None) -> StreamBuffer:
+    """
+    开始一轮流式对话：创建缓冲区，由 spawn 在后台执行上游调用并写入缓冲区
+
+    Args:
+        spawn: 在后台执行一个函数（Flask 为新线程，ASGI 为线程池）
+        permit: 准入控制的许可，上游结束时释放（以 done 事件结束才算调用成功）
+        user_id: 请求体中的 userId（用于回复后的坐标预取）
+    """
+    buffer = streams.create(session_id)
+    events = iter_chat_events(bedrock_service, user_message, session_id, use_cache, user_id)
+
+    def produce():
+        try:
+            buffer.produce(events)
+        finally:
+            if permit:
+                last = buffer.last_event()
+                permit.release(last is not None and last['type'] == 'done')
+
+    spawn(produce)
+    return buffer
+
+
+def next_batch(buffer: StreamBuffer, seq: int, coalescer: ChunkCoalescer) -> Tuple[int, List, bool]:
+    """
+    读取缓冲区中 seq 之后的新事件并交给 coalescer（Flask 和 ASGI 的发送循环共用）
+
+    Returns:
+        (已读取的最后一个序号, 需要发送的事件, 是否已发送完毕)
+    """
+    events, finished = buffer.since(seq)
+    if events is None:
+        # 读取太慢，未发送的事件已被环形缓冲区丢弃
+        error = {'type': 'error', 'message': 'Stream buffer overflowed, please resend the message'}
+        return seq, coalescer.push(error), True
+
+    batch = []
+    for seq, event in events:
+        batch += coalescer.push(dict(event, id=buffer.event_id(seq)))
+
+    if finished:
+        return seq, batch + coalescer.finish(), True
+    return seq, batch + coalescer.poll(), False
+
+
+def iter_stream_batches(buffer: StreamBuffer, seq: int, coalescer: ChunkCoalescer) -> Iterator[List]:
+    """
+    同步版本（Flask）：从缓冲区中第 seq 个事件之后开始发送，按 coalescer 合并并插入心跳
+
+    调用方停止迭代（客户端断开）时取消订阅，上游继续写入缓冲区，等待客户端用 Last-Event-ID 重连
+
+    Yields:
+        list: 一批需要一次写出的事件（可能包含 HEARTBEAT）
+    """
+    wakeup = threading.Event()
+    buffer.subscribe(wakeup.set)
+    try:
+        while True:
+            wakeup.clear()
+            seq, batch, done = next_batch(buffer, seq, coalescer)
+            if batch:
+                yield batch
+            if done:
+                return
+            wakeup.wait(coalescer.wait_timeout())
+    finally:
+        buffer.unsubscribe(wakeup.set)
+
+
+def encode_batch(batch: List) -> str:
+    """把一批事件编码为 SSE 数据（一次写出）；事件的 id 字段作为 SSE 的 id 行输出"""
+    frames = []
+    for event in batch:
+        if event is HEARTBEAT:
+            frames.append(sse_comment('keepalive'))
+        else:
+            payload = {key: value for key, value in event.items() if key != 'id'}
+            frames.append(sse_event(payload, event.get('id')))
+    return ''.join(frames)
@@ -0,0 +1,241 @@
+# services/clients.py
+"""
+客户端注册表
+
+- AWS / Google Maps 客户端和各个 Service 在进程内各只创建一个，首次使用时创建（线程安全）
+- boto 客户端统一配置：连接池大小、TCP keep-alive、adaptive 重试
+- fork 之后子进程会重新创建，不会复用父进程的连接
+- boto3 / googlemaps 在首次创建客户端时才导入，不影响应用启动时间；
+  需要提前准备好时调用 warmup()
+"""
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from config import Config
+
+_lock = threading.RLock()
+_instances: Dict[str, Any] = {}
+_pid = os.getpid()
+
+
+def _reset():
+    global _lock, _instances, _pid
+    _lock = threading.RLock()
+    _instances = {}
+    _pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset)
+
+
+def shared(name: str, factory: Callable[[], Any]) -> Any:
+    """
+    返回名为 name 的共享实例，不存在时调用 factory 创建
+
+    多个线程同时首次访问时只会创建一次；factory 在注册表的锁内执行（可重入），
+    因此也可以在其中安全地使用 boto3 Session
+    """
+    # 兜底：没有 register_at_fork 的平台上按 PID 判断是否发生过 fork
+    if _pid != os.getpid():
+        _reset()
+
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = factory()
+                _instances[name] = instance
+    return instance
+
+
+def existing(name: str) -> Optional[Any]:
+    """返回已经创建的共享实例，还没有创建时返回 None（不会创建）"""
+    if _pid != os.getpid():
+        return None
+    return _instances.get(name)
+
+
+def override(name: str, instance: Any):
+    """替换共享实例（压测 / 本地调试用假实现时使用）"""
+    with _lock:
+        _instances[name] = instance
+
+
+def reset():
+    """清除所有共享实例，下次使用时重新创建"""
+    with _lock:
+        _instances.clear()
+
+
+def boto_config(**overrides):
+    """所有 boto 客户端共用的配置（botocore Config），overrides 可覆盖个别选项"""
+    from botocore.config import Config as BotoConfig
+
+    options = {
+        'max_pool_connections': Config.AWS_MAX_POOL_CONNECTIONS,
+        'tcp_keepalive': Config.AWS_TCP_KEEPALIVE,
+        'retries': {
+            'mode': Config.AWS_RETRY_MODE,
+            'max_attempts': Config.AWS_MAX_ATTEMPTS
+        }
+    }
+    options.update(overrides)
+    return BotoConfig(**options)
+
+
+def _session():
+    """
+    进程内共用的 boto3 Session（Session 本身不是线程安全的，只在各 factory 中使用）
+
+    智能选择凭证来源：优先使用环境变量中的凭证，否则使用 AWS CLI 默认配置
+    """
+    def create():
+        import boto3
+
+        if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
+            print("使用环境变量中的 AWS 凭证")
+            return boto3.session.Session(
+                region_name=Config.AWS_REGION,
+                aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY
+            )
+
+        print("使用 AWS CLI 默认配置")
+        return boto3.session.Session(region_name=Config.AWS_REGION)
+
+    return shared('boto3_session', create)
+
+
+def bedrock_agent_runtime():
+    """Bedrock Agent Runtime 客户端（连接池至少与异步网关的线程池一样大）"""
+    def create():
+        return _session().client(
+            'bedrock-agent-runtime',
+            config=boto_config(
+                read_timeout=300,
+                connect_timeout=60,
+                max_pool_connections=max(Config.AWS_MAX_POOL_CONNECTIONS,
+                                         Config.CHAT_ASYNC_MAX_WORKERS)
+            )
+        )
+
+    return shared('bedrock_agent_runtime', create)
+
+
+def dynamodb():
+    """
+    DynamoDB resource
+
+    Table 的各个操作可以在多个线程中共用；需要在自建线程池中并发调用时，
+    使用线程安全的底层客户端 table.meta.client
+    """
+    def create():
+        from utils.metrics import instrument_dynamodb
+
+        resource = _session().resource('dynamodb', config=boto_config())
+        # 记录每次请求消耗的容量（/metrics）
+        instrument_dynamodb(resource.meta.client)
+        return resource
+
+    return shared('dynamodb', create)
+
+
+def google_maps():
+    """Google Maps 客户端（HTTP 连接池与地理编码线程池一样大）"""
+    def create():
+        import googlemaps
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        pool_size = max(10, Config.GEOCODE_MAX_WORKERS)
+        session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+        return googlemaps.Client(key=Config.GOOGLE_MAPS_API_KEY, requests_session=session)
+
+    return shared('google_maps', create)
+
+
+def get_bedrock_service():
+    from services.bedrock_service import BedrockService
+    return shared('bedrock_service', BedrockService)
+
+
+def _dynamodb_service():
+    from services.dynamodb_service import DynamoDBService
+
+    service = DynamoDBService()
+    if Config.PREFETCH_ENABLED:
+        # 通过 save_trip 保存行程后在后台预取坐标。目前没有接口调用 save_trip（行程由 Agent 直接写入），
+        # 实际生效的是 finish_agent_turn 提交的 latest_trip 任务（见 services/chat_stream.py）
+        service.save_listeners.append(lambda item: get_prefetcher().trip_saved(item))
+    return service
+
+
+def get_dynamodb_service():
+    return shared('dynamodb_service', _dynamodb_service)
+
+
+def get_maps_service():
+    from services.google_maps_service import GoogleMapsService
+    return shared('maps_service', GoogleMapsService)
+
+
+def _prefetcher():
+    import atexit
+    from services.prefetch import PrefetchQueue
+
+    prefetcher = PrefetchQueue(
+        get_maps_service,
+        get_dynamodb_service,
+        workers=Config.PREFETCH_WORKERS,
+        queue_size=Config.PREFETCH_QUEUE_SIZE
+    )
+    # 进程退出前执行完已排队的任务（超时后取消）
+    atexit.register(prefetcher.shutdown, Config.PREFETCH_DRAIN_TIMEOUT)
+    return prefetcher
+
+
+def get_prefetcher():
+    return shared('prefetcher', _prefetcher)
+
+
+SERVICES = {
+    'bedrock': get_bedrock_service,
+    'dynamodb': get_dynamodb_service,
+    'maps': get_maps_service,
+}
+
+
+def warmup(names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """
+    提前创建客户端和 Service（导入依赖、读取凭证、建立连接池）
+
+    Args:
+        names: 要准备的 Service（bedrock / dynamodb / maps），默认全部
+
+    Returns:
+        {名称: 耗时（秒）}，创建失败的不计入（错误会打印出来，首次使用时会再试）
+    """
+    import time
+
+    timings = {}
+    for name in names or SERVICES:
+        start = time.perf_counter()
+        try:
+            SERVICES[name]()
+        except Exception as e:
+            print(f"Warmup of {name} failed: {str(e)}")
+            continue
+        timings[name] = round(time.perf_counter() - start, 4)
+    return timings
+
+
+def warmup_in_background(names: Optional[Iterable[str]] = None) -> threading.Thread:
+    """在后台线程中执行 warmup()，不阻塞应用启动"""
+    thread = threading.Thread(target=warmup, args=(names,), name='warmup', daemon=True)
+    thread.start()
+    return thread
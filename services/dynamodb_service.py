@@ -1,33 +1,246 @@
-import boto3
 from boto3.dynamodb.conditions import Key, Attr
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Dict, Optional, Tuple
 from config import Config
+from services import clients
+from services.blob_codec import compress_item, decode_blob
+from services.pagination import InvalidCursor, SUMMARY_ATTRIBUTES
+from services.search_index import TripSearchIndex
+from utils.cache import TTLCache, MISSING, content_etag
+from utils.metrics import DYNAMODB_CALLS, DYNAMODB_SECONDS, timed
+import base64
+import contextvars
 import json
+import random
+import threading
+import time
+
+
+# 进程内读缓存（所有 DynamoDBService 实例共享，保证任何实例的写入都能使其失效）
+# 行程详情按 (userId, conversationId)，行程列表按 userId 分组
+# 缓存中的对象会被多个请求共享，调用方不要修改返回的数据
+_trip_cache = TTLCache(maxsize=Config.TRIP_CACHE_SIZE, ttl=Config.TRIP_CACHE_TTL)
+_trip_list_cache = TTLCache(maxsize=Config.TRIP_CACHE_SIZE, ttl=Config.TRIP_CACHE_TTL)
+# 保护行程列表缓存中各用户的 UserPages
+_trip_list_lock = threading.Lock()
+
+
+class UserPages:
+    """
+    行程列表缓存中一个用户的分页，键为 (limit, cursor, view)
+    
+    每个对象相当于一代缓存：用户的缓存被清除（写入 / 删除）后，查询前取到的旧对象不再在缓存中，
+    查询结果（分页和行程详情）只在对象仍是当前这一代时写入，避免把查询期间已经过期的数据放回缓存
+    """
+    
+    def __init__(self):
+        self.entries = {}  # page_key -> ((行程列表, 下一页游标, ETag), 字节数)
+        self.size = 0
+    
+    def put(self, page_key, entry, size: int):
+        """加入一页，超过每页数上限或 TRIP_CACHE_BYTES_PER_USER 时先淘汰最早的分页"""
+        if page_key in self.entries:
+            self.size -= self.entries.pop(page_key)[1]
+        while self.entries and (len(self.entries) >= Config.TRIP_CACHE_PAGES_PER_USER
+                                or self.size + size > Config.TRIP_CACHE_BYTES_PER_USER):
+            oldest = next(iter(self.entries))
+            self.size -= self.entries.pop(oldest)[1]
+        self.entries[page_key] = (entry, size)
+        self.size += size
+
 
 class DynamoDBService:
     def __init__(self):
-        # 智能选择凭证来源
-        if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
-            print("使用环境变量中的 AWS 凭证")
-            self.dynamodb = boto3.resource(
-                'dynamodb',
-                region_name=Config.AWS_REGION,
-                aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY
-            )
-        else:
-            print("使用 AWS CLI 默认配置")
-            self.dynamodb = boto3.resource(
-                'dynamodb',
-                region_name=Config.AWS_REGION
-            )
+        # 共享的 DynamoDB resource（凭证、连接池、重试配置见 services/clients.py）
+        self.dynamodb = clients.dynamodb()
         
         self.table = self.dynamodb.Table(Config.DYNAMODB_TABLE_NAME)
         print(f"DynamoDB Table: {Config.DYNAMODB_TABLE_NAME}")
+        
+        self.search_index = TripSearchIndex(self.dynamodb.Table(Config.SEARCH_INDEX_TABLE_NAME), self.table)
+        
+        self.trip_cache = _trip_cache
+        self.trip_list_cache = _trip_list_cache
+        
+        # BatchGetItem 分块并发读取用的线程池（所有请求共享，限制对 DynamoDB 的并发）
+        self.batch_executor = ThreadPoolExecutor(
+            max_workers=Config.DYNAMODB_BATCH_WORKERS,
+            thread_name_prefix='dynamodb-batch'
+        )
+        
+        # 写入行程后的回调 fn(item)（如后台预取坐标，见 services/clients.py）
+        self.save_listeners = []
+    
+    def invalidate_cache(self, user_id: str, conversation_id: Optional[str] = None):
+        """行程被修改或删除后清除相关缓存（同时开始该用户的新一代缓存，见 UserPages）"""
+        with _trip_list_lock:
+            if conversation_id:
+                self.trip_cache.delete((user_id, conversation_id))
+            self.trip_list_cache.delete(user_id)
+    
+    def _cache_generation(self, user_id: str) -> UserPages:
+        """
+        用户当前这一代缓存（调用方须持有 _trip_list_lock）
+        
+        行程详情缓存也以此为准：查询前取得的对象在写入缓存时已不是当前这一代，
+        说明查询期间该用户的缓存被清除过，查询结果可能已经过期
+        """
+        pages = self.trip_list_cache.get(user_id)
+        if pages is MISSING:
+            pages = UserPages()
+            self.trip_list_cache.set(user_id, pages)
+        return pages
+    
+    def _cache_trip(self, user_id: str, generation: UserPages, entry: Tuple[Dict, str]):
+        """把查询到的行程详情写入缓存（查询期间缓存被清除时不写入）"""
+        with _trip_list_lock:
+            if self.trip_list_cache.get(user_id) is generation:
+                self.trip_cache.set((user_id, entry[0]['conversationId']), entry)
+    
+    @staticmethod
+    def _decode_item(item: Dict) -> Dict:
+        """
+        把存储用的 JSON 字符串 / 压缩字段解析为对象（原地修改）
+        
+        - fullItineraryZ / fullItinerary → itinerary
+        - tripJsonZ / tripJson → tripData
+        - activityCoords → activityCoords（dict）
+        """
+        if 'fullItineraryZ' in item:
+            item['itinerary'] = decode_blob(item.pop('fullItineraryZ'))
+            item.pop('fullItinerary', None)
+        elif 'fullItinerary' in item:
+            item['itinerary'] = json.loads(item['fullItinerary'])
+            del item['fullItinerary']
+        if 'tripJsonZ' in item:
+            item['tripData'] = decode_blob(item.pop('tripJsonZ'))
+            item.pop('tripJson', None)
+        elif 'tripJson' in item:
+            item['tripData'] = json.loads(item['tripJson'])
+            del item['tripJson']
+        if isinstance(item.get('activityCoords'), str):
+            item['activityCoords'] = json.loads(item['activityCoords'])
+        return item
+    
+    @staticmethod
+    def type_index_key(user_id: str, data_type: str) -> str:
+        """
+        类型索引（GSI）的分区键：userId#dataType
+        
+        写入新记录时应同时写入 userDataType 字段，这样无需过滤就能直接按类型查询
+        """
+        return f"{user_id}#{data_type}"
+    
+    @staticmethod
+    def _encode_cursor(key: Dict) -> str:
+        """把 DynamoDB 主键编码为不透明的分页游标"""
+        raw = json.dumps(key, separators=(',', ':'), default=str).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str, user_id: str, key_attrs: Tuple[str, ...]) -> Dict:
+        """解析分页游标，并确认它属于当前用户和当前的查询方式"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        except Exception:
+            raise InvalidCursor("Invalid cursor")
+        
+        if not isinstance(key, dict) or set(key) != set(key_attrs) \
+                or key.get('userId') != user_id \
+                or not all(isinstance(value, str) for value in key.values()):
+            raise InvalidCursor("Invalid cursor")
+        
+        if 'userDataType' in key and not key['userDataType'].startswith(f"{user_id}#"):
+            raise InvalidCursor("Invalid cursor")
+        
+        return key
+    
+    def _query_page(self, user_id: str, limit: int, cursor: Optional[str] = None,
+                    data_type: Optional[str] = None, filter_expression=None,
+                    attributes: Optional[Tuple[str, ...]] = None,
+                    **query_kwargs) -> Tuple[List[Dict], Optional[str]]:
+        """
+        按页查询用户分区（按时间倒序）
+        
+        DynamoDB 的 Limit 是在 FilterExpression 之前生效的，所以这里会连续查询，
+        直到凑满 limit 条、分区读完，或者用完读取预算（DYNAMODB_MAX_PAGE_READS 次查询）
+        
+        指定 data_type 且开启 DYNAMODB_USE_TYPE_INDEX 时直接查询类型索引（GSI），
+        不再读取后丢弃其他类型的记录
+        
+        Args:
+            user_id: 用户ID
+            limit: 本页最多返回的条数
+            cursor: 上一页返回的游标（可选）
+            data_type: 只返回该类型的记录（可选）
+            filter_expression: 其他过滤条件（可选）
+            attributes: 只读取这些字段（ProjectionExpression，主键字段会自动加上）
+            **query_kwargs: 其他 query 参数
+        
+        Returns:
+            (本页数据, 下一页游标；没有更多数据时为 None)
+        """
+        limit = max(1, min(limit, Config.DYNAMODB_MAX_PAGE_SIZE))
+        
+        kwargs = {'ScanIndexForward': False, **query_kwargs}
+        key_attrs = ('userId', 'conversationId')
+        
+        if data_type and Config.DYNAMODB_USE_TYPE_INDEX:
+            kwargs['IndexName'] = Config.DYNAMODB_TYPE_INDEX_NAME
+            kwargs['KeyConditionExpression'] = Key('userDataType').eq(
+                self.type_index_key(user_id, data_type)
+            )
+            key_attrs = ('userDataType', 'conversationId', 'userId')
+        else:
+            kwargs['KeyConditionExpression'] = Key('userId').eq(user_id)
+            if data_type:
+                type_filter = Attr('dataType').eq(data_type)
+                filter_expression = type_filter if filter_expression is None \
+                    else type_filter & filter_expression
+        
+        if filter_expression is not None:
+            kwargs['FilterExpression'] = filter_expression
+        if attributes:
+            # 字段名统一用占位符，避免与 DynamoDB 保留字冲突
+            names = list(dict.fromkeys(attributes + key_attrs))
+            kwargs['ProjectionExpression'] = ', '.join(f"#p{i}" for i in range(len(names)))
+            kwargs['ExpressionAttributeNames'] = {f"#p{i}": name for i, name in enumerate(names)}
+        if cursor:
+            kwargs['ExclusiveStartKey'] = self._decode_cursor(cursor, user_id, key_attrs)
+        
+        items = []
+        last_key = None
+        
+        for _ in range(Config.DYNAMODB_MAX_PAGE_READS):
+            remaining = limit - len(items)
+            # 有过滤条件时多读一些，减少往返次数
+            kwargs['Limit'] = remaining if filter_expression is None \
+                else max(remaining, Config.DYNAMODB_PAGE_READ_SIZE)
+            
+            response = self.table.query(**kwargs)
+            page = response.get('Items', [])
+            last_key = response.get('LastEvaluatedKey')
+            
+            if len(page) > remaining:
+                # 本次读多了：下一页从最后一条返回的数据之后开始
+                items.extend(page[:remaining])
+                last = items[-1]
+                last_key = {attr: last[attr] for attr in key_attrs}
+                break
+            
+            items.extend(page)
+            
+            if not last_key or len(items) >= limit:
+                break
+            
+            kwargs['ExclusiveStartKey'] = last_key
+        
+        return items, self._encode_cursor(last_key) if last_key else None
     
     def get_user_trips(self, user_id: str, limit: int = 20) -> List[Dict]:
         """
-        获取用户的所有行程
+        获取用户的所有行程（第一页）
         
         Args:
             user_id: 用户ID（session_id）
@@ -36,28 +249,67 @@ class DynamoDBService:
         Returns:
             List[Dict]: 行程列表
         """
+        return self.get_user_trips_page(user_id, limit)[0]
+    
+    def get_user_trips_page(self, user_id: str, limit: int = 20, cursor: Optional[str] = None,
+                            view: str = 'full') -> Tuple[List[Dict], Optional[str]]:
+        """
+        分页获取用户的行程
+        
+        Args:
+            user_id: 用户ID（session_id）
+            limit: 每页数量
+            cursor: 上一页返回的游标（可选）
+            view: full 返回完整行程；summary 只读取列表展示用的字段，不解析 JSON
+        
+        Returns:
+            (行程列表, 下一页游标)
+        """
+        items, next_cursor, _ = self.get_user_trips_page_with_etag(user_id, limit, cursor, view)
+        return items, next_cursor
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'get_user_trips_page_with_etag')
+    def get_user_trips_page_with_etag(self, user_id: str, limit: int = 20,
+                                      cursor: Optional[str] = None,
+                                      view: str = 'full') -> Tuple[List[Dict], Optional[str], str]:
+        """
+        分页获取用户的行程（读缓存），同时返回该页内容的 ETag
+        
+        Returns:
+            (行程列表, 下一页游标, ETag)
+        """
+        page_key = (limit, cursor, view)
+        with _trip_list_lock:
+            pages = self._cache_generation(user_id)
+            if page_key in pages.entries:
+                return pages.entries[page_key][0]
+        
         try:
-            # 修复：使用 FilterExpression 替代 ScanIndexFilter
-            response = self.table.query(
-                KeyConditionExpression=Key('userId').eq(user_id),
-                FilterExpression=Attr('dataType').eq('itinerary'),  # 修复这里
-                Limit=limit,
-                ScanIndexForward=False  # 按时间倒序
+            summary = view == 'summary'
+            items, next_cursor = self._query_page(
+                user_id, limit, cursor, data_type='itinerary',
+                attributes=SUMMARY_ATTRIBUTES if summary else None
             )
             
-            items = response.get('Items', [])
-            
             # 解析 JSON 字符串
-            for item in items:
-                if 'fullItinerary' in item:
-                    item['itinerary'] = json.loads(item['fullItinerary'])
-                    del item['fullItinerary']
-                if 'tripJson' in item:
-                    item['tripData'] = json.loads(item['tripJson'])
-                    del item['tripJson']
+            if not summary:
+                for item in items:
+                    self._decode_item(item)
             
-            return items
+            entry = (items, next_cursor, content_etag([items, next_cursor]))
             
+            # 单页超过每个用户的字节上限时不缓存
+            size = len(json.dumps([items, next_cursor], default=str))
+            if size <= Config.TRIP_CACHE_BYTES_PER_USER:
+                with _trip_list_lock:
+                    # 查询期间缓存被清除时 pages 已经不是当前这一代，不写入
+                    if self.trip_list_cache.get(user_id) is pages:
+                        pages.put(page_key, entry, size)
+            
+            return entry
+            
+        except InvalidCursor:
+            raise
         except Exception as e:
             print(f"Error querying trips: {str(e)}")
             raise
@@ -73,6 +325,23 @@ class DynamoDBService:
         Returns:
             Dict: 行程详情
         """
+        return self.get_trip_with_etag(user_id, conversation_id)[0]
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'get_trip_with_etag')
+    def get_trip_with_etag(self, user_id: str, conversation_id: str) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        获取特定行程详情（读缓存），同时返回内容的 ETag
+        
+        Returns:
+            (行程详情, ETag)；行程不存在时为 (None, None)
+        """
+        cached = self.trip_cache.get((user_id, conversation_id))
+        if cached is not MISSING:
+            return cached
+        
+        with _trip_list_lock:
+            generation = self._cache_generation(user_id)
+        
         try:
             response = self.table.get_item(
                 Key={
@@ -83,28 +352,24 @@ class DynamoDBService:
             
             item = response.get('Item')
             
-            if item:
-                # 解析 JSON（不管是 parameters 还是 itinerary）
-                if 'fullItinerary' in item:
-                    item['itinerary'] = json.loads(item['fullItinerary'])
-                    del item['fullItinerary']
-                if 'tripJson' in item:
-                    item['tripData'] = json.loads(item['tripJson'])
-                    del item['tripJson']
-                
-                return item
+            if not item:
+                return None, None
+            
+            # 解析 JSON（不管是 parameters 还是 itinerary）
+            self._decode_item(item)
             
-            return None
+            entry = (item, content_etag(item))
+            self._cache_trip(user_id, generation, entry)
+            return entry
             
         except Exception as e:
             print(f"Error getting trip: {str(e)}")
             raise
-            
-
+    
     
     def get_user_parameters(self, user_id: str, limit: int = 10) -> List[Dict]:
         """
-        获取用户的初始旅行参数记录
+        获取用户的初始旅行参数记录（第一页）
         
         Args:
             user_id: 用户ID
@@ -113,24 +378,34 @@ class DynamoDBService:
         Returns:
             List[Dict]: 参数列表
         """
+        return self.get_user_parameters_page(user_id, limit)[0]
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'get_user_parameters_page')
+    def get_user_parameters_page(self, user_id: str, limit: int = 10,
+                                 cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        分页获取用户的初始旅行参数记录
+        
+        Args:
+            user_id: 用户ID
+            limit: 每页数量
+            cursor: 上一页返回的游标（可选）
+        
+        Returns:
+            (参数列表, 下一页游标)
+        """
         try:
-            # 修复：使用 FilterExpression
-            response = self.table.query(
-                KeyConditionExpression=Key('userId').eq(user_id),
-                FilterExpression=Attr('dataType').eq('parameters'),  # 修复这里
-                Limit=limit,
-                ScanIndexForward=False
+            items, next_cursor = self._query_page(
+                user_id, limit, cursor, data_type='parameters'
             )
             
-            items = response.get('Items', [])
-            
             for item in items:
-                if 'tripJson' in item:
-                    item['tripData'] = json.loads(item['tripJson'])
-                    del item['tripJson']
+                self._decode_item(item)
             
-            return items
+            return items, next_cursor
             
+        except InvalidCursor:
+            raise
         except Exception as e:
             print(f"Error querying parameters: {str(e)}")
             raise
@@ -138,7 +413,7 @@ class DynamoDBService:
     def search_trips(self, user_id: str, destination: Optional[str] = None, 
                      budget_tier: Optional[str] = None) -> List[Dict]:
         """
-        搜索行程
+        搜索行程（返回所有匹配的行程，按页读取直到没有下一页）
         
         Args:
             user_id: 用户ID
@@ -148,36 +423,220 @@ class DynamoDBService:
         Returns:
             List[Dict]: 匹配的行程列表
         """
+        trips = []
+        cursor = None
+        while True:
+            items, cursor = self.search_trips_page(
+                user_id, destination, budget_tier, Config.DYNAMODB_MAX_PAGE_SIZE, cursor
+            )
+            trips.extend(items)
+            if not cursor:
+                return trips
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'search_trips_page')
+    def search_trips_page(self, user_id: str, destination: Optional[str] = None,
+                          budget_tier: Optional[str] = None, limit: int = 20,
+                          cursor: Optional[str] = None,
+                          view: str = 'full') -> Tuple[List[Dict], Optional[str]]:
+        """
+        分页搜索行程
+        
+        Args:
+            user_id: 用户ID
+            destination: 目的地（可选）
+            budget_tier: 预算等级（可选）
+            limit: 每页数量
+            cursor: 上一页返回的游标（可选）
+            view: full 返回完整行程；summary 只读取列表展示用的字段
+        
+        Returns:
+            (匹配的行程列表, 下一页游标)
+        """
         try:
+            # 有搜索条件时直接查询搜索索引
+            if Config.SEARCH_USE_INDEX and (destination or budget_tier):
+                return self._search_trips_indexed(
+                    user_id, destination, budget_tier, limit, cursor, view
+                )
+            
             # 构建过滤表达式
-            filter_expression = Attr('dataType').eq('itinerary')
+            filter_expression = None
             
             if destination:
-                filter_expression = filter_expression & Attr('destination').contains(destination)
+                filter_expression = Attr('destination').contains(destination)
             
             if budget_tier:
-                filter_expression = filter_expression & Attr('budget_tier').eq(budget_tier)
+                budget_filter = Attr('budget_tier').eq(budget_tier)
+                filter_expression = budget_filter if filter_expression is None \
+                    else filter_expression & budget_filter
             
-            # 使用 FilterExpression
-            response = self.table.query(
-                KeyConditionExpression=Key('userId').eq(user_id),
-                FilterExpression=filter_expression,  # 这里是对的
-                ScanIndexForward=False
+            summary = view == 'summary'
+            items, next_cursor = self._query_page(
+                user_id, limit, cursor, data_type='itinerary',
+                filter_expression=filter_expression,
+                attributes=SUMMARY_ATTRIBUTES if summary else None
             )
             
-            items = response.get('Items', [])
+            if not summary:
+                for item in items:
+                    self._decode_item(item)
             
-            for item in items:
-                if 'fullItinerary' in item:
-                    item['itinerary'] = json.loads(item['fullItinerary'])
-                    del item['fullItinerary']
-            
-            return items
+            return items, next_cursor
             
+        except InvalidCursor:
+            raise
         except Exception as e:
             print(f"Error searching trips: {str(e)}")
             raise
     
+    def _search_trips_indexed(self, user_id: str, destination: Optional[str],
+                              budget_tier: Optional[str], limit: int, cursor: Optional[str],
+                              view: str) -> Tuple[List[Dict], Optional[str]]:
+        """通过搜索索引分页查询（目的地前缀匹配，忽略大小写和全半角），游标为索引表的主键"""
+        limit = max(1, min(limit, Config.DYNAMODB_MAX_PAGE_SIZE))
+        start_key = self._decode_cursor(cursor, user_id, ('userId', 'indexKey')) if cursor else None
+        
+        page, last_key = self.search_index.search_page(user_id, destination, budget_tier, limit, start_key)
+        next_cursor = self._encode_cursor(last_key) if last_key else None
+        
+        if view == 'summary':
+            return page, next_cursor
+        
+        items = self._batch_get_items(user_id, [trip['conversationId'] for trip in page])
+        return [self._decode_item(item) for item in items], next_cursor
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'get_trips_by_ids')
+    def get_trips_by_ids(self, user_id: str, conversation_ids: List[str]) -> Tuple[List[Dict], List[str]]:
+        """
+        批量获取行程详情（读缓存，与 get_trip_by_id 相同的解析方式，不检查 dataType）
+        
+        缓存未命中的记录通过分块并发的 BatchGetItem 读取，读取后写入缓存
+        
+        Args:
+            user_id: 用户ID
+            conversation_ids: 对话ID列表（重复的 ID 只返回一次）
+        
+        Returns:
+            (按传入顺序排列的行程列表, 不存在的对话ID列表)
+        """
+        conversation_ids = list(dict.fromkeys(conversation_ids))
+        found = {}
+        misses = []
+        
+        for conversation_id in conversation_ids:
+            cached = self.trip_cache.get((user_id, conversation_id))
+            if cached is not MISSING:
+                found[conversation_id] = cached[0]
+            else:
+                misses.append(conversation_id)
+        
+        with _trip_list_lock:
+            generation = self._cache_generation(user_id)
+        
+        try:
+            for item in self._batch_get_items(user_id, misses):
+                self._decode_item(item)
+                self._cache_trip(user_id, generation, (item, content_etag(item)))
+                found[item['conversationId']] = item
+        except Exception as e:
+            print(f"Error batch getting trips: {str(e)}")
+            raise
+        
+        trips = [found[conversation_id] for conversation_id in conversation_ids if conversation_id in found]
+        missing = [conversation_id for conversation_id in conversation_ids if conversation_id not in found]
+        return trips, missing
+    
+    def _batch_get_items(self, user_id: str, conversation_ids: List[str]) -> List[Dict]:
+        """
+        批量读取同一用户的多条记录（BatchGetItem），按传入顺序返回，不存在的记录会被跳过
+        
+        每 DYNAMODB_BATCH_GET_SIZE 个键一块，多块时在共享线程池中并发读取
+        """
+        conversation_ids = list(dict.fromkeys(conversation_ids))
+        size = max(1, min(Config.DYNAMODB_BATCH_GET_SIZE, 100))
+        chunks = [conversation_ids[start:start + size] for start in range(0, len(conversation_ids), size)]
+        
+        if len(chunks) <= 1:
+            results = [self._batch_get_chunk(user_id, chunk) for chunk in chunks]
+        else:
+            # 线程池中的线程不继承 contextvars：带上调用方的上下文，消耗的容量仍记到当前方法上（见 utils/metrics.py）
+            context = contextvars.copy_context()
+            results = list(self.batch_executor.map(
+                lambda chunk: context.copy().run(self._batch_get_chunk, user_id, chunk), chunks
+            ))
+        
+        found = {item['conversationId']: item for items in results for item in items}
+        return [found[conversation_id] for conversation_id in conversation_ids if conversation_id in found]
+    
+    def _batch_get_chunk(self, user_id: str, conversation_ids: List[str]) -> List[Dict]:
+        """读取一块记录（一次 BatchGetItem），UnprocessedKeys 退避后重试"""
+        table_name = self.table.name
+        request = {table_name: {'Keys': [
+            {'userId': user_id, 'conversationId': conversation_id}
+            for conversation_id in conversation_ids
+        ]}}
+        items = []
+        
+        for attempt in range(1, Config.DYNAMODB_BATCH_MAX_ATTEMPTS + 1):
+            response = self.dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get('Responses', {}).get(table_name, []))
+            
+            request = response.get('UnprocessedKeys') or None
+            if not request:
+                return items
+            
+            # 被限流（或超出单次响应大小）的键退避后重试
+            if attempt < Config.DYNAMODB_BATCH_MAX_ATTEMPTS:
+                time.sleep(min(2 ** attempt * 0.05, 2) * random.uniform(0.5, 1))
+        
+        remaining = len(request.get(table_name, {}).get('Keys', []))
+        raise RuntimeError(f"BatchGetItem left {remaining} keys unprocessed after "
+                           f"{Config.DYNAMODB_BATCH_MAX_ATTEMPTS} attempts")
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'save_trip')
+    def save_trip(self, item: Dict) -> Dict:
+        """
+        写入行程记录，同时维护类型索引字段和搜索索引
+        
+        Args:
+            item: 行程记录（至少包含 userId、conversationId、dataType）
+        
+        Returns:
+            Dict: 实际写入的记录
+        """
+        try:
+            item = dict(item)
+            item['userDataType'] = self.type_index_key(item['userId'], item['dataType'])
+            
+            # fullItinerary / tripJson 写成压缩的二进制字段
+            if Config.DYNAMODB_COMPRESS_BLOBS:
+                compress_item(item)
+            
+            previous = self.table.get_item(
+                Key={'userId': item['userId'], 'conversationId': item['conversationId']},
+                ProjectionExpression='searchKeys'
+            ).get('Item', {})
+            previous_keys = previous.get('searchKeys')
+            
+            if item['dataType'] == 'itinerary':
+                item['searchKeys'] = self.search_index.index_trip(item, previous_keys)
+            else:
+                item.pop('searchKeys', None)
+                if previous_keys:
+                    self.search_index.remove_trip(item['userId'], previous_keys)
+            
+            self.table.put_item(Item=item)
+            self.invalidate_cache(item['userId'], item['conversationId'])
+            
+            for listener in self.save_listeners:
+                listener(item)
+            return item
+            
+        except Exception as e:
+            print(f"Error saving trip: {str(e)}")
+            raise
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'delete_trip')
     def delete_trip(self, user_id: str, conversation_id: str) -> bool:
         """
         删除行程
@@ -190,12 +649,23 @@ class DynamoDBService:
             bool: 是否删除成功
         """
         try:
-            self.table.delete_item(
+            response = self.table.delete_item(
                 Key={
                     'userId': user_id,
                     'conversationId': conversation_id
-                }
+                },
+                ReturnValues='ALL_OLD'
             )
+            
+            # 同时删除搜索索引条目
+            deleted = response.get('Attributes', {})
+            search_keys = deleted.get('searchKeys')
+            if search_keys is None and deleted.get('dataType') == 'itinerary':
+                search_keys = self.search_index.index_keys(deleted)
+            if search_keys:
+                self.search_index.remove_trip(user_id, search_keys)
+            
+            self.invalidate_cache(user_id, conversation_id)
             return True
             
         except Exception as e:
@@ -204,7 +674,7 @@ class DynamoDBService:
     
     def get_all_user_data(self, user_id: str, limit: int = 50) -> List[Dict]:
         """
-        获取用户的所有数据（包括参数和行程）
+        获取用户的所有数据（包括参数和行程，第一页）
         
         Args:
             user_id: 用户ID
@@ -213,27 +683,126 @@ class DynamoDBService:
         Returns:
             List[Dict]: 所有数据列表
         """
+        return self.get_all_user_data_page(user_id, limit)[0]
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'get_all_user_data_page')
+    def get_all_user_data_page(self, user_id: str, limit: int = 50,
+                               cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        分页获取用户的所有数据（包括参数和行程）
+        
+        Args:
+            user_id: 用户ID
+            limit: 每页数量
+            cursor: 上一页返回的游标（可选）
+        
+        Returns:
+            (所有数据列表, 下一页游标)
+        """
         try:
             # 不使用 FilterExpression，获取所有数据
-            response = self.table.query(
-                KeyConditionExpression=Key('userId').eq(user_id),
-                Limit=limit,
-                ScanIndexForward=False
-            )
-            
-            items = response.get('Items', [])
+            items, next_cursor = self._query_page(user_id, limit, cursor)
             
             # 解析 JSON
             for item in items:
-                if 'fullItinerary' in item:
-                    item['itinerary'] = json.loads(item['fullItinerary'])
-                    del item['fullItinerary']
-                if 'tripJson' in item:
-                    item['tripData'] = json.loads(item['tripJson'])
-                    del item['tripJson']
+                self._decode_item(item)
             
-            return items
+            return items, next_cursor
             
+        except InvalidCursor:
+            raise
         except Exception as e:
             print(f"Error getting all user data: {str(e)}")
+            raise
+    
+    def iter_user_data(self, user_id: str, data_type: Optional[str] = None,
+                       since_ms: Optional[int] = None, until_ms: Optional[int] = None,
+                       page_size: Optional[int] = None) -> Iterator[Dict]:
+        """
+        逐条读取用户的所有数据（按时间正序，用于导出）
+        
+        按 LastEvaluatedKey 连续查询整个分区，每次只在内存中保留一页，
+        每条记录解析后立即交给调用方；不经过读缓存
+        
+        时间过滤直接作用于排序键 conversationId（conv-<毫秒时间戳>），
+        不符合这种格式的记录在指定时间范围时不会被导出
+        
+        Args:
+            user_id: 用户ID
+            data_type: 只导出该类型的记录（可选）
+            since_ms: 只导出该时间（毫秒时间戳，含）之后创建的记录（可选）
+            until_ms: 只导出该时间（毫秒时间戳，含）之前创建的记录（可选）
+            page_size: 每次查询读取的条数，默认 DYNAMODB_EXPORT_PAGE_SIZE
+        
+        Yields:
+            Dict: 解析后的记录
+        """
+        kwargs = {
+            'ScanIndexForward': True,
+            'Limit': page_size or Config.DYNAMODB_EXPORT_PAGE_SIZE
+        }
+        
+        if data_type and Config.DYNAMODB_USE_TYPE_INDEX:
+            kwargs['IndexName'] = Config.DYNAMODB_TYPE_INDEX_NAME
+            key_condition = Key('userDataType').eq(self.type_index_key(user_id, data_type))
+        else:
+            key_condition = Key('userId').eq(user_id)
+            if data_type:
+                kwargs['FilterExpression'] = Attr('dataType').eq(data_type)
+        
+        # 时间戳补齐到 13 位后字符串顺序与时间顺序一致（':' 排在所有数字之后）
+        if since_ms is not None or until_ms is not None:
+            lower = f"conv-{since_ms:013d}" if since_ms is not None else "conv-"
+            upper = f"conv-{until_ms:013d}" if until_ms is not None else "conv-:"
+            key_condition &= Key('conversationId').between(lower, upper)
+        kwargs['KeyConditionExpression'] = key_condition
+        
+        try:
+            while True:
+                response = self.table.query(**kwargs)
+                for item in response.get('Items', []):
+                    yield self._decode_item(item)
+                
+                last_key = response.get('LastEvaluatedKey')
+                if not last_key:
+                    return
+                kwargs['ExclusiveStartKey'] = last_key
+        
+        except Exception as e:
+            print(f"Error exporting user data: {str(e)}")
+            raise
+    
+    @timed(DYNAMODB_SECONDS, DYNAMODB_CALLS, 'save_activity_coords')
+    def save_activity_coords(self, user_id: str, conversation_id: str, coords: Dict) -> bool:
+        """
+        保存行程中各 activity 的坐标（按内容哈希索引）
+        
+        坐标单独存放在 activityCoords 字段，不改写 fullItinerary，
+        因此不会覆盖 Agent 同时写入的新行程
+        
+        Args:
+            user_id: 用户ID
+            conversation_id: 对话ID
+            coords: {activity 哈希: 坐标或 None}
+        
+        Returns:
+            bool: 是否保存成功
+        """
+        try:
+            self.table.update_item(
+                Key={
+                    'userId': user_id,
+                    'conversationId': conversation_id
+                },
+                UpdateExpression='SET activityCoords = :coords',
+                ConditionExpression=Attr('userId').exists(),
+                ExpressionAttributeValues={
+                    ':coords': json.dumps(coords, ensure_ascii=False)
+                }
+            )
+            self.invalidate_cache(user_id, conversation_id)
+            return True
+            
+        except Exception as e:
+            print(f"Error saving activity coordinates: {str(e)}")
             raise
\ No newline at end of file
@@ -0,0 +1,93 @@
+# services/export.py
+# 用户数据导出：NDJSON 编码 + 可选 gzip，全部以生成器的方式逐块输出，内存占用与数据量无关
+import json
+import zlib
+from datetime import datetime, time, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+
+def parse_export_date(value: Optional[str], end: bool = False) -> Optional[int]:
+    """
+    把 YYYY-MM-DD 或 ISO 8601 时间解析为毫秒时间戳（未带时区时按 UTC）
+
+    Args:
+        value: 日期 / 时间字符串，为空时返回 None
+        end: 只有日期时取当天的最后一毫秒（用于 until）
+
+    Raises:
+        ValueError: 格式不正确
+    """
+    if not value:
+        return None
+
+    parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    if len(value) == 10 and end:
+        parsed = datetime.combine(parsed.date(), time.max)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def json_default(value: Any):
+    """DynamoDB 返回的数字是 Decimal，集合是 set，二进制是 Binary / bytes"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, set):
+        return sorted(value, key=str)
+    return str(value)
+
+
+def iter_ndjson(items: Iterable[Dict], chunk_bytes: int) -> Iterator[bytes]:
+    """
+    每条记录编码为一行 JSON，凑满 chunk_bytes 字节后输出一块（减少小块写出的次数）
+
+    读取中途出错时（响应头已经发出，无法再返回错误状态码），最后输出一行
+    {"error": "..."} 后结束，客户端据此判断导出不完整
+    """
+    buffer = []
+    size = 0
+
+    try:
+        for item in items:
+            line = (json.dumps(item, ensure_ascii=False, default=json_default) + '\n').encode('utf-8')
+            buffer.append(line)
+            size += len(line)
+            if size >= chunk_bytes:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+    except Exception as e:
+        print(f"Error during export: {str(e)}")
+        buffer.append((json.dumps({"error": f"Export interrupted: {str(e)}"}) + '\n').encode('utf-8'))
+
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    把输出流压缩为 gzip 格式（流式压缩，不需要先拿到完整数据）
+
+    每块输入之后做一次 Z_SYNC_FLUSH，客户端可以边收边解压
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Accept-Encoding 是否允许 gzip（q=0 表示拒绝）"""
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.strip().replace(' ', '')
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        return quality > 0
+    return False
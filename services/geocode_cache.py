@@ -0,0 +1,226 @@
+# services/geocode_cache.py
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from config import Config
+from utils.cache import TTLCache, MISSING
+from utils.text import normalize_query
+
+
+class SQLiteGeocodeStore:
+    """
+    地理编码结果的持久化存储（本地 SQLite 文件）
+
+    进程重启后依然有效，多个进程可以共享同一个文件（WAL 模式）
+
+    打开时和之后每 purge_every 次写入删除已过期的记录；记录数超过 max_rows 时
+    再删除最早过期的记录，文件大小不会无限增长
+
+    Args:
+        path: SQLite 文件路径
+        max_rows: 最多保留的记录数，<= 0 表示不限制
+        purge_every: 每多少次写入清理一次
+    """
+
+    def __init__(self, path: str, max_rows: int = Config.GEOCODE_CACHE_DB_MAX_ROWS,
+                 purge_every: int = Config.GEOCODE_CACHE_DB_PURGE_EVERY):
+        self.path = path
+        self.max_rows = max_rows
+        self.purge_every = max(purge_every, 1)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                query TEXT PRIMARY KEY,
+                payload TEXT,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS geocode_cache_expires_at ON geocode_cache (expires_at)"
+        )
+        self._conn.commit()
+        self.purge()
+
+    def get(self, key: str) -> Tuple[bool, Optional[Dict], float]:
+        """
+        Returns:
+            (是否命中, 结果（未找到的地点为 None）, 过期时间戳)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, expires_at FROM geocode_cache WHERE query = ?",
+                (key,)
+            ).fetchone()
+
+        if not row:
+            return False, None, 0
+
+        payload, expires_at = row
+        if expires_at <= time.time():
+            return False, None, 0
+
+        return True, json.loads(payload) if payload is not None else None, expires_at
+
+    def set(self, key: str, value: Optional[Dict], ttl: float):
+        payload = json.dumps(value, ensure_ascii=False) if value is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache (query, payload, expires_at) VALUES (?, ?, ?)",
+                (key, payload, time.time() + ttl)
+            )
+            self._conn.commit()
+            self._writes += 1
+            due = self._writes % self.purge_every == 0
+
+        if due:
+            self.purge()
+
+    def purge(self) -> int:
+        """
+        删除已过期的记录，超过 max_rows 时再删除最早过期的记录
+
+        Returns:
+            int: 删除的记录数
+        """
+        try:
+            with self._lock:
+                deleted = self._conn.execute(
+                    "DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),)
+                ).rowcount
+                if self.max_rows > 0:
+                    count = self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+                    if count > self.max_rows:
+                        deleted += self._conn.execute(
+                            """
+                            DELETE FROM geocode_cache WHERE query IN (
+                                SELECT query FROM geocode_cache ORDER BY expires_at LIMIT ?
+                            )
+                            """,
+                            (count - self.max_rows,)
+                        ).rowcount
+                self._conn.commit()
+            return deleted
+        except Exception as e:
+            # 其他进程正在写入等情况，下次再清理
+            print(f"Error purging geocode cache store: {str(e)}")
+            return 0
+
+
+class GeocodeCache:
+    """
+    两级地理编码缓存：进程内 LRU（带 TTL）→ 持久化存储
+
+    - 键为规范化后的查询（NFKC + casefold + 合并空白）
+    - 找不到的地点同样缓存，但 TTL 更短
+    """
+
+    def __init__(self, store: Optional[SQLiteGeocodeStore] = None,
+                 maxsize: int = Config.GEOCODE_CACHE_SIZE,
+                 ttl: float = Config.GEOCODE_CACHE_TTL,
+                 negative_ttl: float = Config.GEOCODE_NEGATIVE_TTL):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.store = store
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "store_hits": 0,
+            "negative_hits": 0,
+            "misses": 0
+        }
+
+    @staticmethod
+    def make_key(query: str) -> str:
+        return normalize_query(query)
+
+    def _count(self, name: str, record: bool = True):
+        if not record:
+            return
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get(self, query: str, record: bool = True) -> Tuple[bool, Optional[Dict]]:
+        """
+        查询缓存
+
+        Args:
+            query: 原始查询
+            record: 是否计入命中/未命中统计
+
+        Returns:
+            (是否命中, 结果)；命中但结果为 None 表示该地点之前查不到
+        """
+        key = self.make_key(query)
+
+        value = self.memory.get(key)
+        if value is not MISSING:
+            self._count("memory_hits", record)
+            if value is None:
+                self._count("negative_hits", record)
+            return True, value
+
+        if self.store:
+            try:
+                found, value, expires_at = self.store.get(key)
+            except Exception as e:
+                print(f"Error reading geocode cache store: {str(e)}")
+                found = False
+
+            if found:
+                # 回填内存层，沿用持久层剩余的有效期
+                self.memory.set(key, value, ttl=expires_at - time.time())
+                self._count("store_hits", record)
+                if value is None:
+                    self._count("negative_hits", record)
+                return True, value
+
+        self._count("misses", record)
+        return False, None
+
+    def set(self, query: str, value: Optional[Dict]):
+        key = self.make_key(query)
+        ttl = self.ttl if value is not None else self.negative_ttl
+
+        self.memory.set(key, value, ttl=ttl)
+
+        if self.store:
+            try:
+                self.store.set(key, value, ttl)
+            except Exception as e:
+                print(f"Error writing geocode cache store: {str(e)}")
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        hits = stats["memory_hits"] + stats["store_hits"]
+        total = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+        stats["memory_size"] = len(self.memory)
+        return stats
+
+
+def create_geocode_cache() -> Optional[GeocodeCache]:
+    """根据配置创建地理编码缓存，关闭时返回 None"""
+    if not Config.GEOCODE_CACHE_ENABLED:
+        return None
+
+    store = None
+    if Config.GEOCODE_CACHE_DB:
+        try:
+            store = SQLiteGeocodeStore(Config.GEOCODE_CACHE_DB)
+        except Exception as e:
+            print(f"Geocode cache store unavailable, using memory only: {str(e)}")
+
+    return GeocodeCache(store=store)
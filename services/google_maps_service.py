@@ -1,12 +1,30 @@
 # services/google_maps_service.py
-import googlemaps
-from typing import Optional, Dict
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, List, Iterator, Tuple
 from config import Config
+from services import clients
+from services.geocode_cache import create_geocode_cache
+from utils.metrics import GEOCODE_CALLS, GEOCODE_SECONDS
+from utils.rate_limit import TokenBucket
+from utils.singleflight import SingleFlight
+from utils.text import normalize_query
 
 class GoogleMapsService:
     def __init__(self):
         """初始化 Google Maps 客户端"""
-        self.client = googlemaps.Client(key=Config.GOOGLE_MAPS_API_KEY)
+        self.client = clients.google_maps()
+        self.cache = create_geocode_cache()
+        
+        # 批量地理编码共用的线程池和限流器（所有请求共享，保证总 QPS 不超配额）
+        self.executor = ThreadPoolExecutor(
+            max_workers=Config.GEOCODE_MAX_WORKERS,
+            thread_name_prefix='geocode'
+        )
+        self.rate_limiter = TokenBucket(Config.GEOCODE_QPS, Config.GEOCODE_BURST)
+        
+        # 相同查询（规范化后）同时只发一次 API 请求
+        self.inflight = SingleFlight()
     
     def geocode_location(self, location_name: str) -> Optional[Dict]:
         """
@@ -24,29 +42,79 @@ class GoogleMapsService:
             }
             如果找不到则返回 None
         """
+        if self.cache:
+            found, cached = self.cache.get(location_name)
+            if found:
+                return cached
+        
         try:
-            # 调用 Geocoding API
-            results = self.client.geocode(location_name)
-            
-            if not results:
-                print(f"No results found for: {location_name}")
-                return None
-            
-            # 取第一个结果（通常是最匹配的）
-            first_result = results[0]
-            geometry = first_result['geometry']['location']
-            
-            return {
-                "lat": geometry['lat'],
-                "lng": geometry['lng'],
-                "formatted_address": first_result.get('formatted_address', ''),
-                "place_id": first_result.get('place_id', '')
-            }
-            
+            return self.inflight.do(
+                normalize_query(location_name),
+                lambda: self._geocode_and_store(location_name)
+            )
         except Exception as e:
+            # 临时错误（网络、配额等）不写缓存
             print(f"Error geocoding '{location_name}': {str(e)}")
             return None
     
+    def _geocode_and_store(self, location_name: str) -> Optional[Dict]:
+        """请求 API 并写入缓存（由 single-flight 的首个调用者执行）"""
+        if self.cache:
+            # 等待期间可能已有其他调用写入了缓存
+            found, cached = self.cache.get(location_name, record=False)
+            if found:
+                return cached
+        
+        result = self._geocode_uncached(location_name)
+        
+        if self.cache:
+            self.cache.set(location_name, result)
+        
+        return result
+    
+    def _geocode_uncached(self, location_name: str) -> Optional[Dict]:
+        """直接调用 Geocoding API；找不到返回 None，请求失败抛出异常"""
+        self.rate_limiter.acquire()
+        
+        start = time.perf_counter()
+        try:
+            results = self.client.geocode(location_name)
+        except Exception:
+            GEOCODE_CALLS.labels('error').inc()
+            raise
+        finally:
+            GEOCODE_SECONDS.observe(time.perf_counter() - start)
+        
+        if not results:
+            GEOCODE_CALLS.labels('not_found').inc()
+            print(f"No results found for: {location_name}")
+            return None
+        
+        GEOCODE_CALLS.labels('success').inc()
+        
+        # 取第一个结果（通常是最匹配的）
+        first_result = results[0]
+        geometry = first_result['geometry']['location']
+        
+        return {
+            "lat": geometry['lat'],
+            "lng": geometry['lng'],
+            "formatted_address": first_result.get('formatted_address', ''),
+            "place_id": first_result.get('place_id', '')
+        }
+    
+    def cache_stats(self) -> Dict:
+        """地理编码缓存的命中/未命中统计，以及合并掉的重复请求数"""
+        if not self.cache:
+            stats = {"enabled": False}
+        else:
+            stats = self.cache.stats()
+            stats["enabled"] = True
+        
+        # 被合并掉（未实际发出）的重复请求数
+        stats["coalesced"] = self.inflight.coalesced
+        return stats
+    
     def get_place_details(self, place_id: str) -> Optional[Dict]:
         """
         获取地点的详细信息（可选功能，如果需要更多信息）
@@ -87,9 +155,62 @@ class GoogleMapsService:
         Returns:
             {地点名: 地理信息} 的字典
         """
-        results = {}
+        return dict(zip(locations, self.geocode_many(locations)))
+    
+    def geocode_many(self, queries: List[str]) -> List[Optional[Dict]]:
+        """
+        并发地理编码（受线程池大小和 QPS 限流约束）
+        
+        Args:
+            queries: 查询字符串列表
+        
+        Returns:
+            与输入顺序一一对应的结果列表，失败的项为 None
+        """
+        if not queries:
+            return []
         
-        for location in locations:
-            results[location] = self.geocode_location(location)
+        # 同一批次内的重复地点只查询一次
+        unique = {}
+        for query in queries:
+            unique.setdefault(normalize_query(query), query)
+        self.inflight.add_coalesced(len(queries) - len(unique))
         
-        return results
\ No newline at end of file
+        if len(unique) == 1:
+            results = [self.geocode_location(next(iter(unique.values())))]
+        else:
+            results = list(self.executor.map(self.geocode_location, unique.values()))
+        
+        by_key = dict(zip(unique.keys(), results))
+        return [by_key[normalize_query(query)] for query in queries]
+    
+    def geocode_iter(self, queries: List[str]) -> Iterator[Tuple[int, Optional[Dict]]]:
+        """
+        并发地理编码，按完成顺序逐个返回结果（用于流式响应）
+        
+        Args:
+            queries: 查询字符串列表
+        
+        Yields:
+            (输入下标, 结果)，每个下标恰好出现一次，失败的项结果为 None
+        """
+        # 同一批次内的重复地点只查询一次，完成后一起返回
+        positions = {}
+        for index, query in enumerate(queries):
+            positions.setdefault(normalize_query(query), []).append(index)
+        self.inflight.add_coalesced(len(queries) - len(positions))
+        
+        futures = {
+            self.executor.submit(self.geocode_location, queries[indexes[0]]): indexes
+            for indexes in positions.values()
+        }
+        
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                for index in futures[future]:
+                    yield index, result
+        finally:
+            # 调用方提前停止（如客户端断开）时，取消尚未开始的查询
+            for future in futures:
+                future.cancel()
\ No newline at end of file
@@ -0,0 +1,211 @@
+# services/itinerary_enricher.py
+import hashlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.text import normalize_query
+
+
+class ItineraryNotFound(Exception):
+    """找不到可用于增强的行程"""
+    pass
+
+
+class ItineraryEnricher:
+    """
+    为行程中的每个 activity 添加坐标
+
+    坐标按 activity 内容哈希（name + address）保存在行程记录的 activityCoords 中，
+    再次增强时只对哈希变化或之前失败的 activity 重新地理编码
+    """
+
+    def __init__(self, maps_service):
+        self.maps_service = maps_service
+
+    @staticmethod
+    def activity_hash(activity: Dict) -> str:
+        """activity 的内容哈希（name + address，规范化后）"""
+        name = normalize_query(activity.get('name', ''))
+        address = normalize_query(activity.get('address', ''))
+        return hashlib.sha1(f"{name}|{address}".encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def activity_query(activity: Dict) -> str:
+        name = activity.get('name', '')
+        address = activity.get('address', '')
+        return f"{name}, {address}" if address else name
+
+    def load_trip_itinerary(self, dynamodb_service, user_id: str,
+                            conversation_id: str) -> Tuple[Dict, List]:
+        """
+        从 DynamoDB 读取行程
+
+        Returns:
+            (行程记录, itinerary 数组)
+
+        Raises:
+            ItineraryNotFound: 行程不存在或没有有效的 itinerary 数组
+        """
+        trip = dynamodb_service.get_trip_by_id(user_id, conversation_id)
+
+        if not trip:
+            raise ItineraryNotFound("Trip not found")
+
+        # 如果是 parameters 类型，尝试找对应的 itinerary
+        if trip.get('dataType') == 'parameters':
+            all_trips = dynamodb_service.get_user_trips(user_id, limit=50)
+            itinerary_trip = None
+
+            for t in all_trips:
+                if t.get('dataType') == 'itinerary':
+                    itinerary_trip = t
+                    break
+
+            if itinerary_trip:
+                trip = itinerary_trip
+            else:
+                raise ItineraryNotFound("No complete itinerary found for this user")
+
+        # 尝试从不同位置获取 itinerary（必须是数组格式）
+        itinerary = trip.get('itinerary')
+
+        # 如果在外层有 itinerary，检查是否是嵌套的
+        if itinerary and isinstance(itinerary, dict) and 'itinerary' in itinerary:
+            itinerary = itinerary['itinerary']
+
+        # 验证 itinerary 是数组格式
+        if not itinerary or not isinstance(itinerary, list):
+            raise ItineraryNotFound("No valid itinerary array found in trip data")
+
+        return trip, itinerary
+
+    def iter_enrich(self, itinerary: List, known_coords: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        逐步增强行程：坐标一确定就产出事件（用于流式响应）
+
+        已保存过坐标的 activity 立即产出，其余的按地理编码完成顺序产出
+
+        Args:
+            itinerary: 按天组织的行程数组
+            known_coords: 之前保存的 {activity 哈希: 坐标或 None}
+
+        Yields:
+            {"type": "activity", "dayIndex", "activityIndex", "day", "activity"}
+            {"type": "day", "dayIndex", "day", "date", "theme", "activities"}  # 当天全部完成
+            {"type": "summary", "summary", "failed_locations", "coords"}       # 最后一个事件
+        """
+        known_coords = known_coords or {}
+
+        days = []
+        remaining = []
+        positions = {}  # 待地理编码的 activity 哈希 -> [(天下标, activity 下标)]
+        hashes = {}  # (天下标, activity 下标) -> activity 哈希（不放进返回的 activity）
+        pending_queries = []
+
+        for day_plan in itinerary:
+            activities = [activity.copy() for activity in day_plan.get('activities', [])]
+            days.append({
+                "day": day_plan.get('day'),
+                "date": day_plan.get('date'),
+                "theme": day_plan.get('theme'),
+                "activities": activities
+            })
+            remaining.append(len(activities))
+
+        cached_count = 0
+        fresh_count = 0
+        coords_by_hash = {}
+
+        def resolve(day_index: int, activity_index: int, coords: Optional[Dict]):
+            activity = days[day_index]['activities'][activity_index]
+            activity['coordinates'] = coords
+            coords_by_hash[hashes[(day_index, activity_index)]] = coords
+            remaining[day_index] -= 1
+
+            yield {
+                "type": "activity",
+                "dayIndex": day_index,
+                "activityIndex": activity_index,
+                "day": days[day_index]['day'],
+                "activity": activity
+            }
+
+            if remaining[day_index] == 0:
+                yield dict(type="day", dayIndex=day_index, **days[day_index])
+
+        # 先产出没有 activity 的天，以及可以直接复用已保存坐标的 activity
+        for day_index, day_data in enumerate(days):
+            if not day_data['activities']:
+                yield dict(type="day", dayIndex=day_index, **day_data)
+
+            for activity_index, activity in enumerate(day_data['activities']):
+                key = self.activity_hash(activity)
+                hashes[(day_index, activity_index)] = key
+
+                # 只对新的、内容变化的或之前失败的 activity 发起地理编码
+                if known_coords.get(key) is None:
+                    if key not in positions:
+                        positions[key] = []
+                        pending_queries.append(self.activity_query(activity))
+                    positions[key].append((day_index, activity_index))
+                else:
+                    cached_count += 1
+                    yield from resolve(day_index, activity_index, known_coords[key])
+
+        pending_keys = list(positions.keys())
+        for index, coords in self.maps_service.geocode_iter(pending_queries):
+            for day_index, activity_index in positions[pending_keys[index]]:
+                if coords:
+                    fresh_count += 1
+                yield from resolve(day_index, activity_index, coords)
+
+        failed_locations = [
+            activity.get('name', '')
+            for day_data in days
+            for activity in day_data['activities']
+            if not activity['coordinates']
+        ]
+        total_locations = sum(len(day_data['activities']) for day_data in days)
+
+        yield {
+            "type": "summary",
+            "summary": {
+                "total_locations": total_locations,
+                "enriched": cached_count + fresh_count,
+                "failed": len(failed_locations),
+                "cached": cached_count,
+                "fresh": fresh_count
+            },
+            "failed_locations": failed_locations,
+            "coords": coords_by_hash
+        }
+
+    def enrich(self, itinerary: List, known_coords: Optional[Dict] = None) -> Dict:
+        """
+        增强整个行程
+
+        Args:
+            itinerary: 按天组织的行程数组
+            known_coords: 之前保存的 {activity 哈希: 坐标或 None}
+
+        Returns:
+            {
+                "itinerary_with_coords": [...],
+                "summary": {"total_locations", "enriched", "failed", "cached", "fresh"},
+                "failed_locations": [...],
+                "coords": {activity 哈希: 坐标或 None}  # 应保存回行程记录
+            }
+        """
+        days = {}
+        result = {}
+
+        for event in self.iter_enrich(itinerary, known_coords):
+            if event['type'] == 'day':
+                day_index = event.pop('dayIndex')
+                event.pop('type')
+                days[day_index] = event
+            elif event['type'] == 'summary':
+                event.pop('type')
+                result = event
+
+        result['itinerary_with_coords'] = [days[i] for i in sorted(days)]
+        return result
@@ -0,0 +1,16 @@
+# services/pagination.py
+# 分页和列表视图的公共定义（不依赖 boto3，路由模块可以直接导入而不拖慢启动）
+
+
+class InvalidCursor(ValueError):
+    """分页游标无效（被篡改或属于其他用户）"""
+    pass
+
+
+# 列表摘要视图（?view=summary）返回的字段，不包含 fullItinerary / tripJson 大字段
+SUMMARY_ATTRIBUTES = (
+    'userId', 'conversationId', 'dataType', 'destination', 'start_date',
+    'days', 'travelers', 'budget_tier', 'totalCost'
+)
+
+LIST_VIEWS = ('full', 'summary')
@@ -0,0 +1,405 @@
+# services/prefetch.py
+import json
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from boto3.dynamodb.conditions import Attr
+
+from services.itinerary_enricher import ItineraryEnricher, ItineraryNotFound
+from utils.metrics import PREFETCH_JOB_SECONDS, PREFETCH_JOBS, PREFETCH_QUEUE_DEPTH
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+_FINISHED = (DONE, FAILED, CANCELLED)
+
+# Agent 回复中的 JSON 代码块
+_JSON_BLOCK = re.compile(r"```(?:json)?\s*(\{.*?\}|\[.*?\])\s*```", re.DOTALL)
+
+
+class PrefetchRejected(Exception):
+    """队列已满或已停止接收任务"""
+    pass
+
+
+def activity_queries_from_reply(text: str) -> List[str]:
+    """
+    从 Agent 回复中提取 activity 的地理编码查询
+
+    只解析回复中的 JSON（代码块或整段回复），其中带 name 的 activities 数组视为行程；
+    自由文本不做猜测，避免对无关词语发起地理编码
+
+    Returns:
+        去重后的查询列表（与 /enrich-itinerary 使用的查询相同，命中同一份缓存）
+    """
+    candidates = _JSON_BLOCK.findall(text or '')
+    stripped = (text or '').strip()
+    if stripped.startswith(('{', '[')):
+        candidates.append(stripped)
+
+    queries = []
+    seen = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            activities = node.get('activities')
+            if isinstance(activities, list):
+                for activity in activities:
+                    if isinstance(activity, dict) and activity.get('name'):
+                        query = ItineraryEnricher.activity_query(activity)
+                        if query not in seen:
+                            seen.add(query)
+                            queries.append(query)
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    for candidate in candidates:
+        try:
+            walk(json.loads(candidate))
+        except ValueError:
+            continue
+    return queries
+
+
+class PrefetchJob:
+    """一个预取任务（trip: 增强一条行程记录并保存坐标；locations: 预热一组查询的地理编码缓存）"""
+
+    def __init__(self, kind: str, key: str, source: str, params: Dict):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.key = key
+        self.source = source
+        self.params = params
+        self.status = QUEUED
+        self.total = 0
+        self.completed = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in _FINISHED
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "source": self.source,
+            "status": self.status,
+            "params": self.params,
+            "total": self.total,
+            "completed": self.completed,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at
+        }
+
+
+class PrefetchQueue:
+    """
+    进程内的后台预取队列：在用户打开地图之前提前地理编码，打开时直接命中缓存
+
+    - 固定数量的工作线程（首次提交时启动），有界队列，队列满时拒绝新任务
+    - 相同的任务（同一行程 / 同一组查询）排队或执行中时不会重复提交
+    - 任务可以取消：排队中的直接跳过，执行中的在下一批地理编码前停止
+    - shutdown() 停止接收新任务，在超时时间内执行完已排队的任务，之后取消剩余任务
+
+    Args:
+        maps_service / dynamodb_service: 返回对应 Service 的函数（执行任务时才创建）
+        workers: 工作线程数
+        queue_size: 最多排队的任务数
+        chunk_size: 每批地理编码的查询数（取消检查的粒度）
+        history: 保留的已结束任务数（用于查询）
+    """
+
+    def __init__(self, maps_service: Callable, dynamodb_service: Callable, workers: int = 2,
+                 queue_size: int = 256, chunk_size: int = 8, history: int = 200):
+        self._maps_service = maps_service
+        self._dynamodb_service = dynamodb_service
+        self.workers = workers
+        self.chunk_size = max(chunk_size, 1)
+        self.history = history
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._jobs: 'OrderedDict[str, PrefetchJob]' = OrderedDict()
+        self._active: Dict[str, PrefetchJob] = {}  # 去重键 -> 排队中 / 执行中的任务
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._accepting = True
+
+        self._stats = {"submitted": 0, "deduplicated": 0, "rejected": 0}
+
+    # ------------------------------------------------------------ 提交
+
+    def submit_trip(self, user_id: str, conversation_id: str, source: str = 'api') -> PrefetchJob:
+        """增强一条行程记录（地理编码未知的 activity 并把坐标保存回记录）"""
+        return self._submit(
+            'trip', f"trip:{user_id}:{conversation_id}", source,
+            {"userId": user_id, "conversationId": conversation_id}
+        )
+
+    def submit_locations(self, queries: List[str], source: str = 'api') -> PrefetchJob:
+        """预热一组地理编码查询"""
+        queries = list(dict.fromkeys(query for query in queries if query))
+        key = "locations:" + "|".join(sorted(queries))
+        return self._submit('locations', key, source, {"locations": queries})
+
+    def trip_saved(self, item: Dict):
+        """DynamoDBService.save_trip 写入行程后的回调"""
+        if item.get('dataType') != 'itinerary':
+            return
+        self._try_submit(lambda: self.submit_trip(item['userId'], item['conversationId'], 'save_trip'))
+
+    def chat_reply(self, reply: str, user_id: Optional[str] = None):
+        """
+        一轮对话结束后的回调
+
+        - 回复中带有 JSON 行程时，预取其中的 activity
+        - 带 userId 时，预取该用户最新的行程记录（Agent 在这一轮中可能刚保存了新行程）
+        """
+        queries = activity_queries_from_reply(reply)
+        if queries:
+            self._try_submit(lambda: self.submit_locations(queries, 'chat_reply'))
+        if user_id:
+            self._try_submit(lambda: self._submit(
+                'latest_trip', f"latest_trip:{user_id}", 'chat_reply', {"userId": user_id}
+            ))
+
+    def _try_submit(self, submit: Callable[[], PrefetchJob]):
+        # 预取失败不影响触发它的请求
+        try:
+            submit()
+        except PrefetchRejected as e:
+            print(f"Prefetch skipped: {str(e)}")
+        except Exception as e:
+            print(f"Error submitting prefetch job: {str(e)}")
+
+    def _submit(self, kind: str, key: str, source: str, params: Dict) -> PrefetchJob:
+        """
+        Raises:
+            PrefetchRejected: 队列已满或正在关闭
+        """
+        with self._lock:
+            existing = self._active.get(key)
+            if existing and not existing.finished:
+                self._stats["deduplicated"] += 1
+                PREFETCH_JOBS.labels('deduplicated').inc()
+                return existing
+
+            if not self._accepting:
+                raise PrefetchRejected("Prefetch queue is shutting down")
+
+            job = PrefetchJob(kind, key, source, params)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._stats["rejected"] += 1
+                PREFETCH_JOBS.labels('rejected').inc()
+                raise PrefetchRejected("Prefetch queue is full")
+
+            self._active[key] = job
+            self._remember(job)
+            self._stats["submitted"] += 1
+            PREFETCH_QUEUE_DEPTH.set(self._queue.qsize())
+            self._start_workers()
+            return job
+
+    def _remember(self, job: PrefetchJob):
+        self._jobs[job.id] = job
+        # 只淘汰已结束的任务
+        while len(self._jobs) > self.history:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if not oldest.finished:
+                break
+            del self._jobs[oldest_id]
+
+    def _start_workers(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'prefetch-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # ------------------------------------------------------------ 查询 / 取消
+
+    def get(self, job_id: str) -> Optional[PrefetchJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, status: Optional[str] = None) -> List[PrefetchJob]:
+        """最近的任务（新的在前）"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        jobs.reverse()
+        return [job for job in jobs if status is None or job.status == status]
+
+    def cancel(self, job_id: str) -> Optional[PrefetchJob]:
+        """取消任务；已结束的任务保持原状态。任务不存在时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if not job.finished:
+                job.cancel_event.set()
+                if job.status == QUEUED:
+                    self._finish(job, CANCELLED)
+        return job
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {
+                "accepting": self._accepting,
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                **self._stats,
+                "jobs": counts
+            }
+
+    # ------------------------------------------------------------ 执行
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            PREFETCH_QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                if job is None:
+                    return
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: PrefetchJob):
+        with self._lock:
+            if job.finished:  # 排队时已被取消
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+
+        try:
+            if job.kind == 'locations':
+                self._geocode(job, job.params['locations'])
+            else:
+                self._enrich_trip(job)
+        except Exception as e:
+            job.error = str(e)
+            print(f"Prefetch job {job.id} failed: {str(e)}")
+            with self._lock:
+                self._finish(job, FAILED)
+            return
+
+        with self._lock:
+            self._finish(job, CANCELLED if job.cancel_event.is_set() else DONE)
+
+    def _finish(self, job: PrefetchJob, status: str):
+        """在 self._lock 内调用"""
+        job.status = status
+        job.finished_at = time.time()
+        if self._active.get(job.key) is job:
+            del self._active[job.key]
+        PREFETCH_JOBS.labels(status).inc()
+        if job.started_at:
+            PREFETCH_JOB_SECONDS.observe(job.finished_at - job.started_at)
+
+    def _geocode(self, job: PrefetchJob, queries: List[str]):
+        """分批地理编码（结果写入缓存），每批之前检查是否已取消"""
+        maps_service = self._maps_service()
+        job.total = len(queries)
+        for start in range(0, len(queries), self.chunk_size):
+            if job.cancel_event.is_set():
+                return
+            maps_service.geocode_many(queries[start:start + self.chunk_size])
+            job.completed = min(start + self.chunk_size, len(queries))
+
+    def _enrich_trip(self, job: PrefetchJob):
+        dynamodb_service = self._dynamodb_service()
+        user_id = job.params['userId']
+
+        if job.kind == 'latest_trip':
+            # Agent 在这一轮中可能刚写入行程：直接查询（不经过行程列表缓存），只读取主键和类型；
+            # 按 dataType 过滤而不是查询类型索引，Agent 写入的记录不带 userDataType
+            latest, _ = dynamodb_service._query_page(
+                user_id, 1, filter_expression=Attr('dataType').eq('itinerary'), attributes=('dataType',)
+            )
+            if not latest:
+                return
+            job.params['conversationId'] = latest[0]['conversationId']
+            dynamodb_service.invalidate_cache(user_id, job.params['conversationId'])
+
+        enricher = ItineraryEnricher(self._maps_service())
+        try:
+            trip, itinerary = enricher.load_trip_itinerary(
+                dynamodb_service, user_id, job.params['conversationId']
+            )
+        except ItineraryNotFound:
+            return
+
+        known_coords = trip.get('activityCoords') or {}
+        pending = list(dict.fromkeys(
+            enricher.activity_query(activity)
+            for day_plan in itinerary
+            for activity in day_plan.get('activities', [])
+            if known_coords.get(enricher.activity_hash(activity)) is None
+        ))
+        self._geocode(job, pending)
+
+        if job.cancel_event.is_set() or not pending:
+            return
+
+        # 缓存已预热：这里的增强只读缓存，把坐标保存回行程记录后打开地图无需再地理编码
+        coords = enricher.enrich(itinerary, known_coords)['coords']
+        if coords != trip.get('activityCoords'):
+            dynamodb_service.save_activity_coords(trip['userId'], trip['conversationId'], coords)
+
+    # ------------------------------------------------------------ 关闭
+
+    def shutdown(self, timeout: float = 10) -> Dict:
+        """
+        停止接收新任务，等待已排队的任务在 timeout 秒内执行完，之后取消剩余任务
+
+        Returns:
+            {"drained": 执行完的任务数, "cancelled": 被取消的任务数}
+        """
+        with self._lock:
+            self._accepting = False
+            pending = [job for job in self._jobs.values() if not job.finished]
+
+        deadline = time.monotonic() + timeout
+        for job in pending:
+            while not job.finished and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        cancelled = 0
+        for job in pending:
+            if not job.finished:
+                self.cancel(job.id)
+                cancelled += 1
+
+        # 通知工作线程退出
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+        return {"drained": len(pending) - cancelled, "cancelled": cancelled}
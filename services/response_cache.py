@@ -0,0 +1,166 @@
+# services/response_cache.py
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from config import Config
+from utils.cache import TTLCache, MISSING
+from utils.text import normalize_query
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数（约 4 个字符一个 token）"""
+    return (len(text) + 3) // 4
+
+
+class FirstTurnCache:
+    """
+    新会话第一轮对话的回复缓存
+
+    - 键为 Agent ID + 别名 + 规范化后的消息（NFKC + casefold + 合并空白）
+    - 值为回复的文本分片列表，流式接口命中时按原分片重放
+    - 超过 maxsize 时淘汰最久未使用的条目，每个条目 ttl 秒后过期
+    """
+
+    def __init__(self, maxsize: int = Config.CHAT_CACHE_SIZE,
+                 ttl: float = Config.CHAT_CACHE_TTL):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stored": 0,
+            "tokens_saved": 0
+        }
+
+    @staticmethod
+    def make_key(agent_id: str, agent_alias_id: str, user_message: str) -> str:
+        return f"{agent_id}|{agent_alias_id}|{normalize_query(user_message)}"
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def get(self, key: str, user_message: str) -> Optional[List[str]]:
+        """命中时返回回复分片并计入节省的 token（输入 + 输出），未命中返回 None"""
+        chunks = self.entries.get(key)
+        if chunks is MISSING:
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        self._count("tokens_saved", estimate_tokens(user_message) + estimate_tokens(''.join(chunks)))
+        return chunks
+
+    def set(self, key: str, chunks: List[str]):
+        # 空回复多半是异常情况，不缓存
+        if not ''.join(chunks).strip():
+            return
+        self.entries.set(key, list(chunks))
+        self._count("stored")
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+        stats["size"] = len(self.entries)
+        return stats
+
+
+class ReplayStore:
+    """
+    由缓存回复开始的会话：Agent 端没有第一轮，下一轮调用时需要把这一轮补上
+
+    会话的下一轮可能由另一个进程 / 实例处理，所以保存在共享的 DynamoDB 表中
+    （CHAT_CACHE_REPLAY_TABLE_NAME，分区键 sessionId，expiresAt 为 TTL 字段）；
+    不传 table 时退回进程内缓存（最多 CHAT_CACHE_REPLAY_SIZE 个会话，只适用于单进程部署）
+
+    Args:
+        table: 共享的 DynamoDB 表（可选）
+        maxsize: 进程内缓存最多保存的会话数
+        ttl: 有效期（秒）
+    """
+
+    def __init__(self, table=None, maxsize: int = Config.CHAT_CACHE_REPLAY_SIZE,
+                 ttl: float = Config.CHAT_CACHE_TTL):
+        self.table = table
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl) if table is None else None
+
+    @staticmethod
+    def table_exists(table) -> bool:
+        """共享表是否存在（没有 DescribeTable 权限等无法确认时按存在处理）"""
+        try:
+            table.meta.client.describe_table(TableName=table.name)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                return False
+            print(f"Error checking chat replay table {table.name}: {str(e)}")
+            return True
+
+    def ensure_table(self, wait: bool = True) -> str:
+        """
+        如果共享表不存在则创建（按需计费，开启 TTL）
+
+        Returns:
+            str: 表状态（CREATING / ACTIVE ...）
+        """
+        client = self.table.meta.client
+        try:
+            status = client.describe_table(TableName=self.table.name)['Table']['TableStatus']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            print(f"Creating chat replay table {self.table.name}")
+            client.create_table(
+                TableName=self.table.name,
+                KeySchema=[{'AttributeName': 'sessionId', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'sessionId', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+            client.get_waiter('table_exists').wait(TableName=self.table.name)
+            client.update_time_to_live(
+                TableName=self.table.name,
+                TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expiresAt'}
+            )
+            return 'ACTIVE'
+
+        if wait and status != 'ACTIVE':
+            client.get_waiter('table_exists').wait(TableName=self.table.name)
+            status = 'ACTIVE'
+        return status
+
+    def set(self, session_id: str, user_message: str, response: str):
+        if self.local is not None:
+            self.local.set(session_id, (user_message, response))
+            return
+        self.table.put_item(Item={
+            'sessionId': session_id,
+            'message': user_message,
+            'response': response,
+            'expiresAt': int(time.time() + self.ttl)
+        })
+
+    def get(self, session_id: str) -> Optional[Tuple[str, str]]:
+        """返回 (第一轮消息, 缓存的回复)，没有需要补上的一轮时返回 None"""
+        if self.local is not None:
+            replayed = self.local.get(session_id)
+            return None if replayed is MISSING else replayed
+
+        item = self.table.get_item(Key={'sessionId': session_id}, ConsistentRead=True).get('Item')
+        # DynamoDB 的 TTL 删除有延迟，过期的条目在这里忽略
+        if not item or item['expiresAt'] <= time.time():
+            return None
+        return item['message'], item['response']
+
+    def delete(self, session_id: str):
+        if self.local is not None:
+            self.local.delete(session_id)
+            return
+        self.table.delete_item(Key={'sessionId': session_id})
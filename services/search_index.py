@@ -0,0 +1,413 @@
+# services/search_index.py
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+
+from config import Config
+from services.pagination import InvalidCursor
+from utils.cache import TTLCache, MISSING
+from utils.text import normalize_query
+
+_WORD_RE = re.compile(r'\w+')
+
+# 索引条目中冗余保存的摘要字段，搜索时无需再读取行程本身
+INDEXED_ATTRIBUTES = (
+    'destination', 'start_date', 'days', 'travelers', 'budget_tier', 'totalCost'
+)
+
+
+def destination_tokens(destination: str) -> Set[str]:
+    """
+    目的地的搜索词：规范化后的每个单词，以及多个单词组成的完整短语
+    
+    "Tokyo, Japan" → {"tokyo", "japan", "tokyo japan"}
+    """
+    words = _WORD_RE.findall(normalize_query(destination))
+    tokens = set(words)
+    if len(words) > 1:
+        tokens.add(' '.join(words))
+    return tokens
+
+
+def query_prefix(destination: str) -> str:
+    """把用户输入的目的地规范化为前缀匹配用的查询词（最多 SEARCH_INDEX_MAX_PREFIX 个字符）"""
+    return ' '.join(_WORD_RE.findall(normalize_query(destination)))[:Config.SEARCH_INDEX_MAX_PREFIX]
+
+
+def token_prefixes(tokens: Set[str]) -> Set[str]:
+    """搜索词的所有前缀（最长 SEARCH_INDEX_MAX_PREFIX 个字符），每个前缀对应一个索引条目"""
+    return {
+        token[:length]
+        for token in tokens
+        for length in range(1, min(len(token), Config.SEARCH_INDEX_MAX_PREFIX) + 1)
+        if not token[:length].endswith(' ')
+    }
+
+
+# 旧版本把索引条目放在行程表的 search#{userId} 分区中，全表重建时清理
+LEGACY_PARTITION_PREFIX = 'search#'
+
+# 索引表中保存追赶进度的条目（排序键不以 d# / b# 开头，不会被搜索命中）
+WATERMARK_KEY = 'm#watermark'
+
+_CONVERSATION_TS_RE = re.compile(r'^conv-(\d+)$')
+
+# 后台追赶（不在搜索请求中执行）：同一用户排队中的追赶只保留一个，
+# 搜索触发的追赶每个用户 SEARCH_INDEX_CATCHUP_INTERVAL 秒内最多一次
+_catch_up_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='search-catch-up')
+_catch_up_lock = threading.Lock()
+_catch_up_pending: Set[str] = set()
+_catch_up_recent = TTLCache(maxsize=10000, ttl=Config.SEARCH_INDEX_CATCHUP_INTERVAL)
+
+
+def schedule_catch_up(search_index: Callable[[], 'TripSearchIndex'], user_id: str,
+                      force: bool = False) -> bool:
+    """
+    在后台为用户执行一次 catch_up
+    
+    Args:
+        search_index: 返回 TripSearchIndex 的函数（在后台线程中调用，可以延迟创建 Service）
+        user_id: 用户ID
+        force: 忽略 SEARCH_INDEX_CATCHUP_INTERVAL（Agent 刚结束一轮对话，可能写入了行程）
+    
+    Returns:
+        bool: 是否提交了新的追赶任务
+    """
+    with _catch_up_lock:
+        if user_id in _catch_up_pending:
+            return False
+        if not force and _catch_up_recent.get(user_id) is not MISSING:
+            return False
+        _catch_up_pending.add(user_id)
+        _catch_up_recent.set(user_id, True)
+    
+    def run():
+        with _catch_up_lock:
+            _catch_up_pending.discard(user_id)
+        try:
+            search_index().catch_up(user_id)
+        except Exception as e:
+            print(f"Error catching up search index for {user_id}: {str(e)}")
+    
+    try:
+        _catch_up_executor.submit(run)
+    except RuntimeError:
+        # 进程退出中
+        with _catch_up_lock:
+            _catch_up_pending.discard(user_id)
+        return False
+    return True
+
+
+class TripSearchIndex:
+    """
+    行程搜索索引（独立的索引表 SEARCH_INDEX_TABLE_NAME，不占用行程表的 userId 键空间）
+    
+    索引表的分区键为 userId，排序键 indexKey 为：
+    - d#{目的地词的前缀}#{conversationId}（每个词的每个前缀一条）
+    - b#{预算等级}#{conversationId}
+    
+    搜索时对 d#{查询词}# 或 b#{预算等级}# 倒序查询，条目按 conversationId 即时间倒序排列，
+    每页只读取需要的条目（Limit + ExclusiveStartKey），耗时与用户的行程总数无关
+    
+    行程主要由 Bedrock Agent 直接写入 DynamoDB，不经过 save_trip，因此在后台追赶（catch_up）：
+    按排序键读取上次追赶之后（往前多看 SEARCH_INDEX_CATCHUP_WINDOW 秒）新写入或索引键已变化的行程
+    并补写索引。每轮对话结束后和搜索时（每个用户 SEARCH_INDEX_CATCHUP_INTERVAL 秒内最多一次）提交，
+    搜索请求本身不等待追赶完成。更早的行程被外部修改后需要执行 rebuild-search-index
+    
+    Args:
+        table: 索引表
+        trips_table: 行程表
+    """
+    
+    def __init__(self, table, trips_table):
+        self.table = table
+        self.trips_table = trips_table
+    
+    def ensure_table(self, wait: bool = True) -> str:
+        """
+        如果索引表不存在则创建（按需计费）
+        
+        Returns:
+            str: 表状态（CREATING / ACTIVE ...）
+        """
+        client = self.table.meta.client
+        try:
+            status = client.describe_table(TableName=self.table.name)['Table']['TableStatus']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            print(f"Creating search index table {self.table.name}")
+            client.create_table(
+                TableName=self.table.name,
+                KeySchema=[
+                    {'AttributeName': 'userId', 'KeyType': 'HASH'},
+                    {'AttributeName': 'indexKey', 'KeyType': 'RANGE'}
+                ],
+                AttributeDefinitions=[
+                    {'AttributeName': 'userId', 'AttributeType': 'S'},
+                    {'AttributeName': 'indexKey', 'AttributeType': 'S'}
+                ],
+                BillingMode='PAY_PER_REQUEST'
+            )
+            status = 'CREATING'
+        
+        if wait and status != 'ACTIVE':
+            client.get_waiter('table_exists').wait(TableName=self.table.name)
+            status = 'ACTIVE'
+        return status
+    
+    @staticmethod
+    def index_keys(item: Dict) -> List[str]:
+        """行程对应的所有索引排序键"""
+        conversation_id = item['conversationId']
+        keys = [
+            f"d#{prefix}#{conversation_id}"
+            for prefix in sorted(token_prefixes(destination_tokens(item.get('destination') or '')))
+        ]
+        
+        budget_tier = normalize_query(item.get('budget_tier') or '')
+        if budget_tier:
+            keys.append(f"b#{budget_tier}#{conversation_id}")
+        
+        return keys
+    
+    def index_trip(self, item: Dict, previous_keys: Optional[List[str]] = None) -> List[str]:
+        """
+        写入（或更新）一个行程的索引条目，并删除不再需要的旧条目
+        
+        Args:
+            item: 行程记录（至少包含 userId、conversationId、destination、budget_tier）
+            previous_keys: 上次写入的索引键（行程记录的 searchKeys 字段）
+        
+        Returns:
+            List[str]: 本次写入的索引键，应保存到行程记录的 searchKeys 字段
+        """
+        user_id = item['userId']
+        keys = self.index_keys(item)
+        summary = {attr: item[attr] for attr in INDEXED_ATTRIBUTES if attr in item}
+        budget_key = normalize_query(item.get('budget_tier') or '')
+        
+        with self.table.batch_writer() as batch:
+            for key in set(previous_keys or []) - set(keys):
+                batch.delete_item(Key={'userId': user_id, 'indexKey': key})
+            
+            for key in keys:
+                entry = {
+                    'userId': user_id,
+                    'indexKey': key,
+                    'tripId': item['conversationId'],
+                    **summary
+                }
+                if budget_key:
+                    entry['budgetKey'] = budget_key
+                batch.put_item(Item=entry)
+        
+        return keys
+    
+    def remove_trip(self, user_id: str, keys: List[str]):
+        """删除一个行程的所有索引条目"""
+        with self.table.batch_writer() as batch:
+            for key in keys:
+                batch.delete_item(Key={'userId': user_id, 'indexKey': key})
+    
+    def catch_up(self, user_id: str) -> int:
+        """
+        为上次追赶之后新写入的行程补写索引
+        
+        第一次对某个用户执行时读取整个用户分区（相当于只为该用户 rebuild）
+        
+        Returns:
+            int: 补写索引的行程数
+        """
+        watermark = self.table.get_item(
+            Key={'userId': user_id, 'indexKey': WATERMARK_KEY}
+        ).get('Item', {}).get('latest')
+        
+        key_condition = Key('userId').eq(user_id)
+        if watermark:
+            key_condition &= Key('conversationId').gt(self._catch_up_start(watermark))
+        
+        names = ('userId', 'conversationId', 'dataType', 'searchKeys') + INDEXED_ATTRIBUTES
+        kwargs = {
+            'KeyConditionExpression': key_condition,
+            'ProjectionExpression': ', '.join(f"#p{i}" for i in range(len(names))),
+            'ExpressionAttributeNames': {f"#p{i}": name for i, name in enumerate(names)}
+        }
+        
+        latest = watermark
+        count = 0
+        while True:
+            response = self.trips_table.query(**kwargs)
+            
+            for item in response.get('Items', []):
+                if latest is None or item['conversationId'] > latest:
+                    latest = item['conversationId']
+                # 第一次追赶时重新写入所有行程（searchKeys 可能指向旧版本的索引位置）；
+                # 之后只处理没有索引或目的地 / 预算已被修改的行程
+                if item.get('dataType') == 'itinerary' and \
+                        (watermark is None or item.get('searchKeys') != self.index_keys(item)):
+                    self._index_existing(item)
+                    count += 1
+            
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        
+        if latest and latest != watermark:
+            self.table.put_item(Item={'userId': user_id, 'indexKey': WATERMARK_KEY, 'latest': latest})
+        return count
+    
+    @staticmethod
+    def _catch_up_start(watermark: str) -> str:
+        """追赶的起点：比水位早 SEARCH_INDEX_CATCHUP_WINDOW 秒（Agent 可能稍后才写入同一对话的行程）"""
+        match = _CONVERSATION_TS_RE.match(watermark)
+        if not match:
+            return watermark
+        start_ms = max(int(match.group(1)) - Config.SEARCH_INDEX_CATCHUP_WINDOW * 1000, 0)
+        return f"conv-{start_ms:013d}"
+    
+    def _index_existing(self, item: Dict):
+        """为行程表中已有的行程写入索引，并把索引键保存到 searchKeys"""
+        keys = self.index_trip(item, item.get('searchKeys'))
+        if keys == item.get('searchKeys'):
+            return
+        try:
+            self.trips_table.update_item(
+                Key={'userId': item['userId'], 'conversationId': item['conversationId']},
+                UpdateExpression='SET searchKeys = :keys',
+                ConditionExpression=Attr('userId').exists(),
+                ExpressionAttributeValues={':keys': keys}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # 写索引期间行程被删除，清理刚写入的索引
+            self.remove_trip(item['userId'], keys)
+    
+    @staticmethod
+    def key_prefix(destination: Optional[str] = None, budget_tier: Optional[str] = None) -> str:
+        """查询用的排序键前缀（有目的地时按目的地，否则按预算等级）"""
+        prefix = query_prefix(destination) if destination else ''
+        if prefix:
+            return f"d#{prefix}#"
+        return f"b#{normalize_query(budget_tier or '')}#"
+    
+    def search_page(self, user_id: str, destination: Optional[str] = None,
+                    budget_tier: Optional[str] = None, limit: int = 20,
+                    start_key: Optional[Dict] = None) -> Tuple[List[Dict], Optional[Dict]]:
+        """
+        按目的地前缀和/或预算等级分页搜索（按 conversationId 倒序，即时间倒序）
+        
+        与 DynamoDBService._query_page 相同：同时按目的地和预算过滤时连续查询，
+        直到凑满 limit 条、读完，或者用完读取预算（DYNAMODB_MAX_PAGE_READS 次查询）
+        
+        Args:
+            start_key: 上一页返回的索引键（可选）
+        
+        Returns:
+            (匹配行程的摘要, 下一页的索引键；没有更多数据时为 None)
+        
+        Raises:
+            InvalidCursor: start_key 不属于这个用户或这次查询
+        """
+        schedule_catch_up(lambda: self, user_id)
+        
+        key_prefix = self.key_prefix(destination, budget_tier)
+        if start_key is not None and (start_key.get('userId') != user_id
+                                      or not start_key.get('indexKey', '').startswith(key_prefix)):
+            raise InvalidCursor("Invalid cursor")
+        
+        kwargs = {
+            'KeyConditionExpression': Key('userId').eq(user_id) & Key('indexKey').begins_with(key_prefix),
+            'ScanIndexForward': False
+        }
+        budget_tier = normalize_query(budget_tier) if budget_tier else ''
+        filtered = key_prefix.startswith('d#') and bool(budget_tier)
+        if filtered:
+            kwargs['FilterExpression'] = Attr('budgetKey').eq(budget_tier)
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        
+        entries = []
+        last_key = None
+        for _ in range(Config.DYNAMODB_MAX_PAGE_READS):
+            remaining = limit - len(entries)
+            kwargs['Limit'] = max(remaining, Config.DYNAMODB_PAGE_READ_SIZE) if filtered else remaining
+            
+            response = self.table.query(**kwargs)
+            page = response.get('Items', [])
+            last_key = response.get('LastEvaluatedKey')
+            
+            if len(page) > remaining:
+                # 本次读多了：下一页从最后一条返回的条目之后开始
+                entries.extend(page[:remaining])
+                last_key = {'userId': user_id, 'indexKey': entries[-1]['indexKey']}
+                break
+            
+            entries.extend(page)
+            if not last_key or len(entries) >= limit:
+                break
+            kwargs['ExclusiveStartKey'] = last_key
+        
+        trips = []
+        for entry in entries:
+            entry['conversationId'] = entry.pop('tripId')
+            entry.pop('budgetKey', None)
+            entry.pop('indexKey', None)
+            entry['dataType'] = 'itinerary'
+            trips.append(entry)
+        return trips, last_key
+    
+    def rebuild(self, user_id: Optional[str] = None,
+                progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        为已有行程重建索引（全表或单个用户）
+        
+        全表重建时同时删除旧版本留在行程表 search#{userId} 分区中的索引条目
+        
+        Returns:
+            int: 处理的行程数
+        """
+        names = ('userId', 'conversationId', 'searchKeys') + INDEXED_ATTRIBUTES
+        kwargs = {
+            'ProjectionExpression': ', '.join(f"#p{i}" for i in range(len(names))),
+            'ExpressionAttributeNames': {f"#p{i}": name for i, name in enumerate(names)}
+        }
+        
+        if user_id:
+            kwargs['KeyConditionExpression'] = Key('userId').eq(user_id)
+            kwargs['FilterExpression'] = Attr('dataType').eq('itinerary')
+            read = self.trips_table.query
+        else:
+            kwargs['FilterExpression'] = Attr('dataType').eq('itinerary') | \
+                Attr('userId').begins_with(LEGACY_PARTITION_PREFIX)
+            read = self.trips_table.scan
+        
+        count = 0
+        while True:
+            response = read(**kwargs)
+            
+            legacy = []
+            for item in response.get('Items', []):
+                if item['userId'].startswith(LEGACY_PARTITION_PREFIX):
+                    legacy.append(item)
+                    continue
+                self._index_existing(item)
+                count += 1
+            
+            if legacy:
+                with self.trips_table.batch_writer() as batch:
+                    for item in legacy:
+                        batch.delete_item(Key={'userId': item['userId'], 'conversationId': item['conversationId']})
+            
+            if progress:
+                progress(count)
+            
+            if 'LastEvaluatedKey' not in response:
+                return count
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -0,0 +1,154 @@
+# services/stream_buffer.py
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.cache import TTLCache
+
+
+class StreamBuffer:
+    """
+    一轮流式对话的事件缓冲（有界环形缓冲）
+
+    上游（Bedrock）由一个生产线程写入，与客户端连接无关；每个连接是一个订阅者，
+    按事件序号从缓冲区读取。连接断开后重连的客户端可以从断开的位置继续读取，
+    上游仍在运行时直接接上，不需要再次调用 Agent。
+
+    Args:
+        session_id: 会话 ID
+        turn_id: 这一轮的 ID
+        maxlen: 最多保留的事件数（超出后丢弃最早的事件，这些事件之前的位置无法续传）
+        grace: 最后一个订阅者断开后，上游继续运行的秒数；超时仍没有客户端重连时停止上游
+    """
+
+    def __init__(self, session_id: str, turn_id: str, maxlen: int = 1024, grace: float = 30):
+        self.session_id = session_id
+        self.turn_id = turn_id
+        self.grace = grace
+        self._events: deque = deque(maxlen=maxlen)  # (seq, event)
+        self._next_seq = 1
+        self._finished = False
+        self._subscribers: List[Callable[[], None]] = []
+        self._detached_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def event_id(self, seq: int) -> str:
+        """SSE 事件的 id：<sessionId>:<turnId>:<序号>"""
+        return f"{self.session_id}:{self.turn_id}:{seq}"
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def last_event(self) -> Optional[Dict]:
+        """最后写入的事件（还没有事件时为 None）"""
+        with self._lock:
+            return self._events[-1][1] if self._events else None
+
+    def append(self, event: Dict):
+        with self._lock:
+            self._events.append((self._next_seq, event))
+            self._next_seq += 1
+            subscribers = list(self._subscribers)
+        for notify in subscribers:
+            notify()
+
+    def finish(self):
+        with self._lock:
+            self._finished = True
+            subscribers = list(self._subscribers)
+        for notify in subscribers:
+            notify()
+
+    def since(self, seq: int) -> Tuple[Optional[List[Tuple[int, Dict]]], bool]:
+        """
+        读取序号大于 seq 的事件
+
+        Returns:
+            (事件列表, 上游是否已结束)；seq 之后的事件已被丢弃时事件列表为 None
+        """
+        with self._lock:
+            if self._events and self._events[0][0] > seq + 1:
+                return None, self._finished
+            return [(s, e) for s, e in self._events if s > seq], self._finished
+
+    def can_resume(self, seq: int) -> bool:
+        with self._lock:
+            if seq >= self._next_seq:
+                return False
+            return not self._events or self._events[0][0] <= seq + 1
+
+    def subscribe(self, notify: Callable[[], None]):
+        """notify 在有新事件或上游结束时被调用（在生产线程中，必须立即返回）"""
+        with self._lock:
+            self._subscribers.append(notify)
+
+    def unsubscribe(self, notify: Callable[[], None]):
+        with self._lock:
+            if notify in self._subscribers:
+                self._subscribers.remove(notify)
+            if not self._subscribers:
+                self._detached_at = time.monotonic()
+
+    def abandoned(self) -> bool:
+        """没有订阅者且已超过 grace 秒"""
+        with self._lock:
+            return not self._subscribers and time.monotonic() - self._detached_at >= self.grace
+
+    def produce(self, events: Iterator[Dict]):
+        """
+        在生产线程中执行：把上游事件写入缓冲区，直到上游结束或被放弃
+
+        客户端全部断开且超过 grace 秒后，在收到下一个事件时停止并关闭上游（释放 Bedrock 连接）
+        """
+        try:
+            for event in events:
+                self.append(event)
+                if self.abandoned():
+                    print(f"Chat stream {self.session_id}:{self.turn_id} abandoned, closing upstream")
+                    break
+        finally:
+            events.close()
+            self.finish()
+
+
+class StreamRegistry:
+    """
+    按 (sessionId, turnId) 保存进行中和最近结束的 StreamBuffer
+
+    条目在创建 ttl 秒后过期；超过 maxsize 时淘汰最久未访问的条目
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600,
+                 buffer_events: int = 1024, grace: float = 30):
+        self.buffer_events = buffer_events
+        self.grace = grace
+        self._buffers = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def create(self, session_id: str) -> StreamBuffer:
+        buffer = StreamBuffer(session_id, uuid.uuid4().hex[:12], self.buffer_events, self.grace)
+        self._buffers.set((session_id, buffer.turn_id), buffer)
+        return buffer
+
+    def get(self, session_id: str, turn_id: str) -> Optional[StreamBuffer]:
+        return self._buffers.get((session_id, turn_id), None)
+
+    def resolve(self, last_event_id: str) -> Tuple[Optional[StreamBuffer], int]:
+        """
+        解析 Last-Event-ID，返回对应的缓冲区和已收到的最后一个序号
+
+        Returns:
+            (buffer, seq)；格式不正确、已过期或无法从该位置续传时 buffer 为 None
+        """
+        try:
+            session_id, turn_id, seq = last_event_id.rsplit(':', 2)
+            seq = int(seq)
+        except ValueError:
+            return None, 0
+
+        buffer = self.get(session_id, turn_id)
+        if buffer is None or not buffer.can_resume(seq):
+            return None, seq
+        return buffer, seq
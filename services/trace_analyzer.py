@@ -0,0 +1,157 @@
+# services/trace_analyzer.py
+from typing import Dict, List, Optional, Tuple
+
+from utils.metrics import Histogram, STREAM_BUCKETS
+
+TRACE_SPAN_SECONDS = Histogram(
+    'bedrock_trace_span_seconds', 'Agent turn time broken down by trace phase and span kind',
+    ('phase', 'kind'), buckets=STREAM_BUCKETS
+)
+
+# 汇总时的类别
+SPAN_KINDS = ('model', 'action_group', 'knowledge_base', 'response', 'other')
+
+_PHASES = {
+    'preProcessingTrace': 'preprocessing',
+    'orchestrationTrace': 'orchestration',
+    'postProcessingTrace': 'postprocessing',
+    'failureTrace': 'failure',
+    'guardrailTrace': 'guardrail'
+}
+
+
+def _trace_part(event: Dict) -> Tuple[str, Dict]:
+    """取出 trace 事件中的阶段名和内容（兼容带外层 trace 包装和不带的两种格式）"""
+    inner = event.get('trace', event)
+    for key, phase in _PHASES.items():
+        if key in inner:
+            return phase, inner[key] or {}
+    return 'other', {}
+
+
+def _classify(phase: str, part: Dict) -> Tuple[str, Optional[str]]:
+    """
+    从某个 trace 事件开始、到下一个事件到达为止的这段时间属于什么
+
+    Returns:
+        (类别, 目标)；目标为 action group / 知识库等的名称
+    """
+    if 'modelInvocationInput' in part or 'rationale' in part:
+        return 'model', None
+
+    invocation = part.get('invocationInput')
+    if invocation:
+        if 'actionGroupInvocationInput' in invocation:
+            action = invocation['actionGroupInvocationInput']
+            target = action.get('actionGroupName', '')
+            detail = action.get('function') or action.get('apiPath')
+            return 'action_group', f"{target}::{detail}" if detail else target
+        if 'knowledgeBaseLookupInput' in invocation:
+            return 'knowledge_base', invocation['knowledgeBaseLookupInput'].get('knowledgeBaseId')
+        if invocation.get('invocationType') == 'FINISH':
+            return 'response', None
+
+    observation = part.get('observation')
+    if observation and observation.get('type') == 'FINISH':
+        return 'response', None
+
+    # 模型输出 / 观察结果之后，Agent 马上进入下一步推理
+    if 'modelInvocationOutput' in part or observation:
+        return 'model', None
+
+    return 'other', None
+
+
+def _step_id(part: Dict) -> Optional[str]:
+    for value in part.values():
+        if isinstance(value, dict) and value.get('traceId'):
+            return value['traceId']
+    return None
+
+
+class TraceAnalyzer:
+    """
+    把 Bedrock Agent 的 trace 事件转换为带时间的 span
+
+    trace 事件本身不带耗时，这里用每个事件的到达时间（相对于调用开始）切分整轮对话：
+    从一个事件到达到下一个事件到达之间的时间，归到开始它的那个事件所代表的工作上，
+    例如 invocationInput（action group）→ observation 之间的时间就是 action group 的执行时间
+    """
+
+    def analyze(self, events: List[Dict], arrivals: List[float], total: float,
+                first_chunk: Optional[float] = None, record: bool = True) -> Dict:
+        """
+        Args:
+            events: trace 事件（invoke_agent 返回的 trace 列表）
+            arrivals: 每个事件的到达时间（秒，相对于调用开始）
+            total: 整轮对话的耗时（秒）
+            first_chunk: 第一个回复分片的到达时间（秒，可选）
+            record: 是否计入 /metrics 的 bedrock_trace_span_seconds
+
+        Returns:
+            {
+                "total_ms": 5230.1,
+                "steps": 2,  # 编排步骤数
+                "spans": [{"phase", "kind", "target", "start_ms", "duration_ms"}, ...],
+                "totals_ms": {"model": ..., "action_group": ..., "knowledge_base": ..., "response": ..., "other": ...},
+                "by_target_ms": {"WeatherActions::getWeather": ...}
+            }
+        """
+        spans = []
+        steps = set()
+
+        def add(phase: str, kind: str, target: Optional[str], start: float, end: float):
+            if end <= start:
+                return
+            # 连续的同类时间段（如 rationale 紧跟在模型调用之后）合并为一个 span
+            if spans and spans[-1]['phase'] == phase and spans[-1]['kind'] == kind \
+                    and spans[-1]['target'] == target:
+                spans[-1]['end'] = end
+                return
+            spans.append({'phase': phase, 'kind': kind, 'target': target, 'start': start, 'end': end})
+
+        # 调用开始到第一个 trace 事件之前：请求排队 / Agent 初始化
+        first = arrivals[0] if arrivals else (first_chunk if first_chunk is not None else total)
+        add('startup', 'other', None, 0.0, first)
+
+        for index, event in enumerate(events):
+            phase, part = _trace_part(event)
+            kind, target = _classify(phase, part)
+
+            step = _step_id(part)
+            if phase == 'orchestration' and step:
+                # traceId 形如 "<uuid>-0"，同一步骤共用前缀
+                steps.add(step.rsplit('-', 1)[0])
+
+            start = arrivals[index]
+            end = arrivals[index + 1] if index + 1 < len(arrivals) else total
+            add(phase, kind, target, start, end)
+
+        totals = {kind: 0.0 for kind in SPAN_KINDS}
+        by_target: Dict[str, float] = {}
+        result_spans = []
+
+        for span in spans:
+            duration = span['end'] - span['start']
+            totals[span['kind']] += duration
+            if span['target']:
+                by_target[span['target']] = by_target.get(span['target'], 0.0) + duration
+
+            if record:
+                TRACE_SPAN_SECONDS.labels(span['phase'], span['kind']).observe(duration)
+
+            result_spans.append({
+                'phase': span['phase'],
+                'kind': span['kind'],
+                'target': span['target'],
+                'start_ms': round(span['start'] * 1000, 1),
+                'duration_ms': round(duration * 1000, 1)
+            })
+
+        return {
+            'total_ms': round(total * 1000, 1),
+            'steps': len(steps),
+            'spans': result_spans,
+            'totals_ms': {kind: round(value * 1000, 1) for kind, value in totals.items()},
+            'by_target_ms': {target: round(value * 1000, 1) for target, value in by_target.items()}
+        }
@@ -0,0 +1,229 @@
+# services/trip_purge.py
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import Key, Attr
+
+from config import Config
+
+# BatchWriteItem 单次最多 25 个请求
+BATCH_WRITE_SIZE = 25
+
+# 删除时只读取这些字段：主键、类型，以及清理搜索索引需要的字段（没有 searchKeys 的旧行程按目的地/预算重新计算）
+PURGE_ATTRIBUTES = ('userId', 'conversationId', 'dataType', 'searchKeys', 'destination', 'budget_tier')
+
+
+class TripPurge:
+    """
+    批量删除一个用户的记录（注销账号、清理废弃的 parameters 记录）
+
+    - 查询时只读取主键等少量字段（ProjectionExpression），不读取行程大字段
+    - 每 25 个键一次 BatchWriteItem，多个批次并发执行，UnprocessedItems 退避后重试
+    - 同时删除搜索索引表中对应的条目；不带过滤条件时删除该用户在索引表中的整个分区（包括残留的条目）
+    - 删除后清除行程读缓存
+    - dry_run 只统计将被删除的记录，不做任何修改
+
+    Args:
+        dynamodb_service: DynamoDBService
+        workers: 并发执行的 BatchWriteItem 数，默认 PURGE_WORKERS
+        max_attempts: 每批最多请求次数，默认 DYNAMODB_BATCH_MAX_ATTEMPTS
+        page_size: 每次查询读取的条数，默认 PURGE_PAGE_SIZE
+    """
+
+    def __init__(self, dynamodb_service, workers: Optional[int] = None,
+                 max_attempts: Optional[int] = None, page_size: Optional[int] = None):
+        self.dynamodb_service = dynamodb_service
+        self.dynamodb = dynamodb_service.dynamodb
+        self.table = dynamodb_service.table
+        self.search_index = dynamodb_service.search_index
+        self.index_table = self.search_index.table
+        self.workers = max(1, workers or Config.PURGE_WORKERS)
+        self.max_attempts = max(1, max_attempts or Config.DYNAMODB_BATCH_MAX_ATTEMPTS)
+        self.page_size = max(1, page_size or Config.PURGE_PAGE_SIZE)
+
+    def run(self, user_id: str, data_type: Optional[str] = None,
+            older_than_ms: Optional[int] = None, dry_run: bool = False,
+            progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        执行删除
+
+        时间过滤直接作用于排序键 conversationId（conv-<毫秒时间戳>），
+        指定 older_than_ms 时不符合这种格式的记录不会被删除
+
+        Args:
+            user_id: 用户ID
+            data_type: 只删除该类型的记录（可选）
+            older_than_ms: 只删除该时间（毫秒时间戳）之前创建的记录（可选）
+            dry_run: 只统计，不删除
+            progress: 每批完成后的回调（dry_run 时为每页），参数为当前统计
+
+        Returns:
+            {"userId", "dryRun", "matched", "byType", "searchEntries", "deleted",
+             "searchEntriesDeleted", "failed", "batches", "errors", "done"}
+        """
+        state = {
+            "userId": user_id,
+            "dryRun": dry_run,
+            "matched": 0,
+            "byType": {},
+            "searchEntries": 0,
+            "deleted": 0,
+            "searchEntriesDeleted": 0,
+            "failed": 0,
+            "batches": 0,
+            "errors": [],
+            "done": False
+        }
+        whole_user = data_type is None and older_than_ms is None
+
+        chunk = []
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='purge') as executor:
+            for request in self._delete_requests(user_id, data_type, older_than_ms, whole_user, state):
+                if dry_run:
+                    continue
+
+                chunk.append(request)
+                if len(chunk) < BATCH_WRITE_SIZE:
+                    continue
+
+                # 限制进行中的批次数，键在查询的同时陆续删除，内存占用与记录数无关
+                if len(pending) >= self.workers * 2:
+                    self._collect(user_id, pending, state, progress, FIRST_COMPLETED)
+                pending[executor.submit(self._delete_chunk, chunk)] = chunk
+                chunk = []
+
+            if chunk:
+                pending[executor.submit(self._delete_chunk, chunk)] = chunk
+            while pending:
+                self._collect(user_id, pending, state, progress, FIRST_COMPLETED)
+
+        if not dry_run:
+            self.dynamodb_service.invalidate_cache(user_id)
+
+        state['done'] = state['failed'] == 0
+        if progress and dry_run:
+            progress(state)
+        return state
+
+    def _delete_requests(self, user_id: str, data_type: Optional[str], older_than_ms: Optional[int],
+                         whole_user: bool, state: Dict) -> Iterator[Tuple[str, str, Dict, Optional[str]]]:
+        """
+        逐页查询要删除的记录，依次产出 (类别, 表名, 主键, 对话ID)
+
+        类别为 trip（行程表中的记录本身）或 search（索引表中的搜索索引条目）
+        """
+        for item in self._query_keys(user_id, data_type, older_than_ms):
+            conversation_id = item['conversationId']
+            item_type = item.get('dataType', 'unknown')
+            state['matched'] += 1
+            state['byType'][item_type] = state['byType'].get(item_type, 0) + 1
+            yield 'trip', self.table.name, {'userId': item['userId'], 'conversationId': conversation_id}, conversation_id
+
+            if whole_user:
+                continue
+            search_keys = item.get('searchKeys')
+            if search_keys is None and item_type == 'itinerary':
+                search_keys = self.search_index.index_keys(item)
+            for key in search_keys or []:
+                state['searchEntries'] += 1
+                yield 'search', self.index_table.name, {'userId': user_id, 'indexKey': key}, None
+
+        if whole_user:
+            # 索引表中该用户的所有条目（包括追赶进度）
+            for item in self._paginate(Key('userId').eq(user_id), table=self.index_table,
+                                       attributes=('userId', 'indexKey')):
+                state['searchEntries'] += 1
+                yield 'search', self.index_table.name, {'userId': user_id, 'indexKey': item['indexKey']}, None
+
+    def _query_keys(self, user_id: str, data_type: Optional[str],
+                    older_than_ms: Optional[int]) -> Iterator[Dict]:
+        """只读取 PURGE_ATTRIBUTES 的分页查询（类型过滤优先使用类型索引，时间过滤用排序键范围）"""
+        index_name = None
+        filter_expression = None
+
+        if data_type and Config.DYNAMODB_USE_TYPE_INDEX:
+            index_name = Config.DYNAMODB_TYPE_INDEX_NAME
+            key_condition = Key('userDataType').eq(self.dynamodb_service.type_index_key(user_id, data_type))
+        else:
+            key_condition = Key('userId').eq(user_id)
+            if data_type:
+                filter_expression = Attr('dataType').eq(data_type)
+
+        if older_than_ms is not None:
+            key_condition &= Key('conversationId').between("conv-", f"conv-{max(older_than_ms - 1, 0):013d}")
+
+        return self._paginate(key_condition, index_name, filter_expression, PURGE_ATTRIBUTES)
+
+    def _paginate(self, key_condition, index_name: Optional[str] = None, filter_expression=None,
+                  attributes: Tuple[str, ...] = ('userId', 'conversationId'), table=None) -> Iterator[Dict]:
+        table = table if table is not None else self.table
+        kwargs = {
+            'KeyConditionExpression': key_condition,
+            'ProjectionExpression': ', '.join(f"#p{i}" for i in range(len(attributes))),
+            'ExpressionAttributeNames': {f"#p{i}": name for i, name in enumerate(attributes)},
+            'Limit': self.page_size
+        }
+        if index_name:
+            kwargs['IndexName'] = index_name
+        if filter_expression is not None:
+            kwargs['FilterExpression'] = filter_expression
+
+        while True:
+            response = table.query(**kwargs)
+            yield from response.get('Items', [])
+
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                return
+            kwargs['ExclusiveStartKey'] = last_key
+
+    def _delete_chunk(self, chunk: List[Tuple[str, str, Dict, Optional[str]]]):
+        """一次 BatchWriteItem 删除一批键（可能跨行程表和索引表），UnprocessedItems 退避后重试"""
+        request = {}
+        for _, table_name, key, _ in chunk:
+            request.setdefault(table_name, []).append({'DeleteRequest': {'Key': key}})
+
+        for attempt in range(1, self.max_attempts + 1):
+            response = self.dynamodb.batch_write_item(RequestItems=request)
+
+            request = response.get('UnprocessedItems') or None
+            if not request:
+                return
+
+            # 被限流的请求退避后重试
+            if attempt < self.max_attempts:
+                time.sleep(min(2 ** attempt * 0.05, 2) * random.uniform(0.5, 1))
+
+        remaining = sum(len(requests) for requests in request.values())
+        raise RuntimeError(f"BatchWriteItem left {remaining} deletes unprocessed after "
+                           f"{self.max_attempts} attempts")
+
+    def _collect(self, user_id: str, pending: Dict, state: Dict,
+                 progress: Optional[Callable[[Dict], None]], return_when):
+        """等待进行中的批次完成，更新统计并清除缓存（在调用 run 的线程中执行）"""
+        done, _ = wait(list(pending), return_when=return_when)
+
+        for future in done:
+            chunk = pending.pop(future)
+            trips = [conversation_id for kind, _, _, conversation_id in chunk if kind == 'trip']
+            state['batches'] += 1
+
+            try:
+                future.result()
+                state['deleted'] += len(trips)
+                state['searchEntriesDeleted'] += len(chunk) - len(trips)
+            except Exception as e:
+                print(f"Error purging user data: {str(e)}")
+                state['failed'] += len(chunk)
+                if len(state['errors']) < 10:
+                    state['errors'].append(str(e))
+
+            for conversation_id in trips:
+                self.dynamodb_service.invalidate_cache(user_id, conversation_id)
+
+            if progress:
+                progress(state)
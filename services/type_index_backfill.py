@@ -0,0 +1,168 @@
+# services/type_index_backfill.py
+import time
+from typing import Callable, Dict, Optional
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from config import Config
+from utils.checkpoint import load_checkpoint, save_checkpoint
+
+
+class TypeIndexBackfill:
+    """
+    在线回填类型索引（userDataType = userId#dataType）
+
+    - 分批扫描缺少 userDataType 的记录并逐条补写（条件更新，不会覆盖并发写入）
+    - 每批处理完写一次检查点文件，中断后从检查点继续
+    - 一轮扫描完成后再次执行会开始新的一轮：Bedrock Agent 直接写入的记录不经过 save_trip，
+      不带 userDataType，需要定期重新执行（或 --watch 持续执行）把它们补进索引
+    - 可以先用 ensure_index() 创建 GSI
+    """
+
+    def __init__(self, dynamodb_service, checkpoint_path: Optional[str] = None,
+                 batch_size: int = 100, pause: float = 0.0):
+        self.dynamodb_service = dynamodb_service
+        self.table = dynamodb_service.table
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def ensure_index(self, wait: bool = True) -> str:
+        """
+        如果 GSI 不存在则创建
+
+        Returns:
+            str: 索引状态（CREATING / ACTIVE ...）
+        """
+        index_name = Config.DYNAMODB_TYPE_INDEX_NAME
+        description = self.table.meta.client.describe_table(TableName=self.table.name)['Table']
+
+        for index in description.get('GlobalSecondaryIndexes', []):
+            if index['IndexName'] == index_name:
+                return self._wait_active(index_name) if wait else index['IndexStatus']
+
+        create = {
+            'IndexName': index_name,
+            'KeySchema': [
+                {'AttributeName': 'userDataType', 'KeyType': 'HASH'},
+                {'AttributeName': 'conversationId', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }
+
+        # 预置容量模式的表需要为 GSI 指定容量，沿用表本身的配置
+        billing = description.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+        if billing == 'PROVISIONED':
+            throughput = description['ProvisionedThroughput']
+            create['ProvisionedThroughput'] = {
+                'ReadCapacityUnits': throughput['ReadCapacityUnits'],
+                'WriteCapacityUnits': throughput['WriteCapacityUnits']
+            }
+
+        print(f"Creating index {index_name} on {self.table.name}")
+        self.table.meta.client.update_table(
+            TableName=self.table.name,
+            AttributeDefinitions=[
+                {'AttributeName': 'userDataType', 'AttributeType': 'S'},
+                {'AttributeName': 'conversationId', 'AttributeType': 'S'}
+            ],
+            GlobalSecondaryIndexUpdates=[{'Create': create}]
+        )
+
+        return self._wait_active(index_name) if wait else 'CREATING'
+
+    def _wait_active(self, index_name: str, interval: float = 10) -> str:
+        while True:
+            description = self.table.meta.client.describe_table(TableName=self.table.name)['Table']
+            status = next(
+                index['IndexStatus'] for index in description.get('GlobalSecondaryIndexes', [])
+                if index['IndexName'] == index_name
+            )
+            if status == 'ACTIVE':
+                return status
+            print(f"Index {index_name} is {status}, waiting...")
+            time.sleep(interval)
+
+    def run(self, max_batches: Optional[int] = None,
+            progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        执行回填（从检查点继续）
+
+        Args:
+            max_batches: 最多处理的批次数（可选，便于分多次执行）
+            progress: 每批结束后的回调，参数为当前统计
+
+        Returns:
+            {"last_key", "scanned", "updated", "skipped", "done", "passes"}（统计为本轮的数量）
+        """
+        state = load_checkpoint(self.checkpoint_path, {
+            "last_key": None, "scanned": 0, "updated": 0, "skipped": 0, "done": False, "passes": 1
+        })
+        if state.get('done'):
+            # 上一轮已经完成：从头开始新的一轮，补写之后新写入的记录
+            state = {
+                "last_key": None, "scanned": 0, "updated": 0, "skipped": 0, "done": False,
+                "passes": state.get('passes', 1) + 1
+            }
+
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            kwargs = {
+                'ProjectionExpression': '#uid, #cid, #dt',
+                'ExpressionAttributeNames': {
+                    '#uid': 'userId',
+                    '#cid': 'conversationId',
+                    '#dt': 'dataType'
+                },
+                'FilterExpression': Attr('dataType').exists() & Attr('userDataType').not_exists(),
+                'Limit': self.batch_size
+            }
+            if state['last_key']:
+                kwargs['ExclusiveStartKey'] = state['last_key']
+
+            response = self.table.scan(**kwargs)
+            state['scanned'] += response.get('ScannedCount', 0)
+
+            for item in response.get('Items', []):
+                if self._backfill_item(item):
+                    state['updated'] += 1
+                else:
+                    state['skipped'] += 1
+
+            state['last_key'] = response.get('LastEvaluatedKey')
+            state['done'] = state['last_key'] is None
+            save_checkpoint(self.checkpoint_path, state)
+            batches += 1
+
+            if progress:
+                progress(state)
+
+            if state['done']:
+                break
+
+            if self.pause:
+                time.sleep(self.pause)
+
+        return state
+
+    def _backfill_item(self, item: Dict) -> bool:
+        """补写单条记录的 userDataType；记录已被删除或类型已变化时跳过"""
+        try:
+            self.table.update_item(
+                Key={
+                    'userId': item['userId'],
+                    'conversationId': item['conversationId']
+                },
+                UpdateExpression='SET userDataType = :key',
+                ConditionExpression=Attr('dataType').eq(item['dataType']) & Attr('userDataType').not_exists(),
+                ExpressionAttributeValues={
+                    ':key': self.dynamodb_service.type_index_key(item['userId'], item['dataType'])
+                }
+            )
+            return True
+
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
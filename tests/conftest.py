@@ -0,0 +1,54 @@
+"""
+测试公用的夹具：用 benchmarks/fakes.py 的内存替身代替 DynamoDB，不访问网络
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import InMemoryDynamoDB, InMemoryTable  # noqa: E402
+from config import Config  # noqa: E402
+from services import clients  # noqa: E402
+
+
+@pytest.fixture
+def trip_table():
+    return InMemoryTable(Config.DYNAMODB_TABLE_NAME)
+
+
+@pytest.fixture
+def index_table():
+    return InMemoryTable(Config.SEARCH_INDEX_TABLE_NAME, range_key='indexKey')
+
+
+@pytest.fixture
+def dynamodb(trip_table, index_table):
+    """替换共享的 DynamoDB resource，测试结束后清除所有共享实例和读缓存"""
+    resource = InMemoryDynamoDB(trip_table, index_table)
+    clients.reset()
+    clients.override('dynamodb', resource)
+    yield resource
+    clients.reset()
+
+    from services.dynamodb_service import _trip_cache, _trip_list_cache
+    _trip_cache.clear()
+    _trip_list_cache.clear()
+
+
+@pytest.fixture
+def dynamodb_service(dynamodb, monkeypatch):
+    # 不在测试中提交后台预取任务
+    monkeypatch.setattr(Config, 'PREFETCH_ENABLED', False)
+    return clients.get_dynamodb_service()
+
+
+def make_trip(user_id: str, timestamp_ms: int, data_type: str = 'itinerary', **fields):
+    """conversationId 为 conv-<13 位毫秒时间戳> 的记录"""
+    return {
+        'userId': user_id,
+        'conversationId': f"conv-{timestamp_ms:013d}",
+        'dataType': data_type,
+        **fields
+    }
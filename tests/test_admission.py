@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from utils.admission import AdmissionController, AdmissionRejected
+
+
+def test_disabled_controller_admits_everything():
+    admission = AdmissionController(max_concurrency=0)
+    permits = [admission.acquire('u1') for _ in range(10)]
+    for permit in permits:
+        permit.release()
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_per_user_limit_returns_429():
+    admission = AdmissionController(max_concurrency=10, per_user=2)
+    first, second = admission.acquire('u1'), admission.acquire('u1')
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        admission.acquire('u1')
+    assert excinfo.value.status == 429
+    assert excinfo.value.retry_after >= 1
+
+    # 其他用户不受影响；释放后同一用户可以再次进入
+    admission.acquire('u2').release()
+    first.release()
+    admission.acquire('u1').release()
+    second.release()
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_full_queue_and_queue_timeout_return_503():
+    admission = AdmissionController(max_concurrency=1, queue_size=1, max_wait=0.05)
+    permit = admission.acquire(None)
+
+    errors = []
+    waiter = threading.Thread(target=lambda: errors.append(_reject_reason(admission)))
+    waiter.start()
+    time.sleep(0.01)
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        admission.acquire(None)
+    assert (excinfo.value.status, excinfo.value.reason) == (503, 'queue_full')
+
+    waiter.join()
+    assert errors == ['timeout']
+    permit.release()
+
+    stats = admission.stats()
+    assert (stats['in_flight'], stats['queue_depth']) == (0, 0)
+
+
+def _reject_reason(admission):
+    try:
+        admission.acquire(None).release()
+    except AdmissionRejected as e:
+        return e.reason
+    return None
+
+
+def test_waiters_are_admitted_in_order_when_a_permit_is_released():
+    admission = AdmissionController(max_concurrency=1, queue_size=2, max_wait=5)
+    permit = admission.acquire(None)
+    order = []
+
+    def wait(name):
+        with admission.acquire(None):
+            order.append(name)
+
+    threads = []
+    for name in ('a', 'b'):
+        thread = threading.Thread(target=wait, args=(name,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+
+    assert admission.stats()['queue_depth'] == 2
+    permit.release()
+    for thread in threads:
+        thread.join()
+    assert order == ['a', 'b']
+
+
+def test_throttling_decreases_once_per_call_window():
+    admission = AdmissionController(max_concurrency=8)
+
+    admission.throttled()
+    admission.throttled()  # 同一波调用陆续返回的限流错误
+    assert admission.stats()['concurrency_limit'] == 6
+
+
+def test_only_successful_calls_raise_the_limit():
+    admission = AdmissionController(max_concurrency=8)
+    admission.throttled()
+    limit = admission.stats()['concurrency_limit']
+
+    for _ in range(limit):
+        with pytest.raises(RuntimeError):
+            with admission.acquire(None):
+                raise RuntimeError("Bedrock call failed")
+    assert admission.stats()['concurrency_limit'] == limit
+
+    for _ in range(limit):
+        with admission.acquire(None):
+            pass
+    assert admission.stats()['concurrency_limit'] == limit + 1
+
+
+def test_release_is_idempotent():
+    admission = AdmissionController(max_concurrency=2)
+    permit = admission.acquire('u1')
+    permit.release()
+    permit.release()
+
+    stats = admission.stats()
+    assert stats['in_flight'] == 0
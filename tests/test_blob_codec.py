@@ -0,0 +1,50 @@
+import json
+import zlib
+
+import pytest
+
+from services.blob_codec import VERSION_ZLIB_JSON, compress_item, decode_blob, encode_blob
+
+
+class Binary:
+    """boto3.dynamodb.types.Binary 的最小替身（值在 .value 中）"""
+
+    def __init__(self, value: bytes):
+        self.value = value
+
+
+def test_round_trip_object():
+    itinerary = [{'day': 1, 'activities': [{'name': '浅草寺', 'cost_estimate_usd': 0}]}]
+    blob = encode_blob(itinerary)
+
+    assert blob[0] == VERSION_ZLIB_JSON
+    assert decode_blob(blob) == itinerary
+
+
+def test_round_trip_json_text_is_not_double_encoded():
+    text = json.dumps({'destination': 'Tokyo'})
+    assert decode_blob(encode_blob(text)) == {'destination': 'Tokyo'}
+
+
+def test_decode_accepts_boto_binary():
+    assert decode_blob(Binary(encode_blob({'a': 1}))) == {'a': 1}
+
+
+def test_decode_rejects_empty_and_unknown_version():
+    with pytest.raises(ValueError):
+        decode_blob(b'')
+    with pytest.raises(ValueError):
+        decode_blob(bytes([99]) + zlib.compress(b'{}'))
+
+
+def test_compress_item_replaces_text_attributes():
+    item = {
+        'conversationId': 'conv-0000000000001',
+        'fullItinerary': json.dumps([{'day': 1}]),
+        'tripJson': json.dumps({'days': 1})
+    }
+    compress_item(item)
+
+    assert 'fullItinerary' not in item and 'tripJson' not in item
+    assert decode_blob(item['fullItineraryZ']) == [{'day': 1}]
+    assert decode_blob(item['tripJsonZ']) == {'days': 1}
@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import make_trip
+from services.dynamodb_service import DynamoDBService
+from services.pagination import InvalidCursor
+
+KEY_ATTRS = ('userId', 'conversationId')
+
+
+def test_cursor_round_trip():
+    key = {'userId': 'u1', 'conversationId': 'conv-0000000000042'}
+    cursor = DynamoDBService._encode_cursor(key)
+
+    assert '=' not in cursor
+    assert DynamoDBService._decode_cursor(cursor, 'u1', KEY_ATTRS) == key
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', 'e30', DynamoDBService._encode_cursor(['u1'])])
+def test_malformed_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        DynamoDBService._decode_cursor(cursor, 'u1', KEY_ATTRS)
+
+
+def test_cursor_of_another_user_or_query_is_rejected():
+    cursor = DynamoDBService._encode_cursor({'userId': 'u2', 'conversationId': 'conv-0000000000042'})
+    with pytest.raises(InvalidCursor):
+        DynamoDBService._decode_cursor(cursor, 'u1', KEY_ATTRS)
+
+    # 主键查询的游标不能用于类型索引查询
+    cursor = DynamoDBService._encode_cursor({'userId': 'u1', 'conversationId': 'conv-0000000000042'})
+    with pytest.raises(InvalidCursor):
+        DynamoDBService._decode_cursor(cursor, 'u1', ('userId', 'conversationId', 'userDataType'))
+
+    cursor = DynamoDBService._encode_cursor({
+        'userId': 'u1', 'conversationId': 'conv-0000000000042', 'userDataType': 'u2#itinerary'
+    })
+    with pytest.raises(InvalidCursor):
+        DynamoDBService._decode_cursor(cursor, 'u1', ('userId', 'conversationId', 'userDataType'))
+
+
+def test_pages_cover_every_trip_once(dynamodb_service, trip_table):
+    # 行程和参数记录交错，列表只返回行程：FilterExpression 在 Limit 之后生效，需要连续查询
+    trip_table.load([
+        make_trip('u1', i, 'itinerary' if i % 3 == 0 else 'parameters', destination=f"City {i}")
+        for i in range(1, 61)
+    ])
+
+    seen = []
+    cursor = None
+    while True:
+        trips, cursor = dynamodb_service.get_user_trips_page(
+            'u1', limit=7, cursor=cursor, view='summary'
+        )
+        assert len(trips) <= 7
+        seen += [trip['conversationId'] for trip in trips]
+        if not cursor:
+            break
+
+    expected = [f"conv-{i:013d}" for i in range(60, 0, -1) if i % 3 == 0]
+    assert seen == expected
+
+
+def test_cursor_from_another_user_is_rejected_by_query(dynamodb_service, trip_table):
+    trip_table.load([make_trip('u1', i) for i in range(1, 6)])
+    _, cursor = dynamodb_service.get_user_trips_page('u1', limit=2)
+
+    with pytest.raises(InvalidCursor):
+        dynamodb_service.get_user_trips_page('u2', limit=2, cursor=cursor)
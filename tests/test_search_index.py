@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import make_trip
+from config import Config
+from services import search_index
+from services.pagination import InvalidCursor
+
+DESTINATIONS = ('Tokyo, Japan', 'Tokushima', 'Paris')
+
+
+@pytest.fixture
+def indexed(dynamodb_service, trip_table, monkeypatch):
+    monkeypatch.setattr(Config, 'SEARCH_USE_INDEX', True)
+    # 后台追赶在测试中同步调用（见 test_catch_up_indexes_agent_written_trips）
+    monkeypatch.setattr(search_index, 'schedule_catch_up', lambda *args, **kwargs: False)
+    trip_table.load([
+        make_trip('u1', i, destination=DESTINATIONS[i % 3], budget_tier=('low', 'mid')[i % 2])
+        for i in range(1, 91)
+    ])
+    dynamodb_service.search_index.rebuild('u1')
+    return dynamodb_service
+
+
+def search_all(service, destination=None, budget_tier=None, limit=7):
+    seen = []
+    cursor = None
+    while True:
+        trips, cursor = service.search_trips_page('u1', destination, budget_tier, limit, cursor, 'summary')
+        assert len(trips) <= limit
+        seen += [trip['conversationId'] for trip in trips]
+        if not cursor:
+            return seen
+
+
+def expected(predicate):
+    return [f"conv-{i:013d}" for i in range(90, 0, -1) if predicate(i)]
+
+
+def test_prefix_search_pages_newest_first(indexed):
+    assert search_all(indexed, 'TOK') == expected(lambda i: i % 3 != 2)
+    assert search_all(indexed, 'tokyo japan') == expected(lambda i: i % 3 == 0)
+
+
+def test_destination_and_budget(indexed):
+    assert search_all(indexed, 'toku', 'mid') == expected(lambda i: i % 3 == 1 and i % 2 == 1)
+    assert search_all(indexed, None, 'low') == expected(lambda i: i % 2 == 0)
+
+
+def test_cursor_of_another_query_is_rejected(indexed):
+    _, cursor = indexed.search_trips_page('u1', 'tok', None, 5, None, 'summary')
+
+    with pytest.raises(InvalidCursor):
+        indexed.search_trips_page('u1', 'par', None, 5, cursor, 'summary')
+    with pytest.raises(InvalidCursor):
+        indexed.search_trips_page('u2', 'tok', None, 5, cursor, 'summary')
+
+
+def test_catch_up_indexes_agent_written_trips(indexed, trip_table):
+    # Agent 直接写入，不经过 save_trip
+    trip_table.load([make_trip('u1', 91, destination='Oslo')])
+    assert search_all(indexed, 'osl') == []
+
+    indexed.search_index.catch_up('u1')
+    assert search_all(indexed, 'osl') == ['conv-0000000000091']
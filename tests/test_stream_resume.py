@@ -0,0 +1,74 @@
+from services import chat_stream
+from services.chat_stream import ChunkCoalescer, next_batch, start_stream
+from services.stream_buffer import StreamBuffer, StreamRegistry
+from utils.admission import AdmissionController
+
+
+class FakeBedrockService:
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def invoke_agent_stream(self, user_message, session_id, use_cache=False):
+        yield from self.chunks
+        if self.error:
+            raise self.error
+
+
+def no_coalescing():
+    return ChunkCoalescer(window=0, max_bytes=0, heartbeat=0)
+
+
+def test_resume_from_last_event_id():
+    registry = StreamRegistry(maxsize=8, ttl=60, buffer_events=16)
+    buffer = registry.create('s1')
+    for text in ('a', 'b', 'c'):
+        buffer.append({'type': 'content', 'text': text})
+    buffer.finish()
+
+    resumed, seq = registry.resolve(buffer.event_id(1))
+    assert resumed is buffer and seq == 1
+
+    _, batch, done = next_batch(resumed, seq, no_coalescing())
+    assert done
+    assert [event['text'] for event in batch] == ['b', 'c']
+    assert batch[-1]['id'] == buffer.event_id(3)
+
+
+def test_unknown_or_overflowed_position_cannot_resume():
+    registry = StreamRegistry(maxsize=8, ttl=60, buffer_events=2)
+    buffer = registry.create('s1')
+    for text in ('a', 'b', 'c', 'd'):
+        buffer.append({'type': 'content', 'text': text})
+
+    assert registry.resolve('garbage')[0] is None
+    assert registry.resolve('s1:other-turn:1')[0] is None
+    # 事件 2 已被环形缓冲区丢弃
+    assert registry.resolve(buffer.event_id(1))[0] is None
+    assert registry.resolve(buffer.event_id(3))[0] is buffer
+
+
+def test_read_past_dropped_events_reports_overflow():
+    buffer = StreamBuffer('s1', 't1', maxlen=2)
+    for text in ('a', 'b', 'c'):
+        buffer.append({'type': 'content', 'text': text})
+
+    _, batch, done = next_batch(buffer, 0, no_coalescing())
+    assert done and batch[0]['type'] == 'error'
+
+
+def test_start_stream_releases_permit(monkeypatch):
+    monkeypatch.setattr(chat_stream, 'finish_agent_turn', lambda *args, **kwargs: None)
+    admission = AdmissionController(max_concurrency=4)
+
+    permit = admission.acquire(None)
+    buffer = start_stream(FakeBedrockService(['Hello', ' world']), 'hi', 's1', False, lambda produce: produce(), permit)
+    events, finished = buffer.since(0)
+    assert finished
+    assert [event['type'] for _, event in events] == ['session', 'content', 'content', 'done']
+
+    permit = admission.acquire(None)
+    buffer = start_stream(FakeBedrockService(['Hel'], RuntimeError('boom')), 'hi', 's2', False,
+                          lambda produce: produce(), permit)
+    assert buffer.last_event() == {'type': 'error', 'message': 'boom'}
+    assert admission.stats()['in_flight'] == 0
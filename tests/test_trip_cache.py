@@ -0,0 +1,68 @@
+from conftest import make_trip
+
+
+def test_reads_are_cached_until_invalidated(dynamodb_service, trip_table):
+    trip_table.load([make_trip('u1', 1, destination='Tokyo')])
+
+    trip, etag = dynamodb_service.get_trip_with_etag('u1', 'conv-0000000000001')
+    trip_table.load([make_trip('u1', 1, destination='Osaka')])
+    assert dynamodb_service.get_trip_with_etag('u1', 'conv-0000000000001') == (trip, etag)
+
+    dynamodb_service.invalidate_cache('u1', 'conv-0000000000001')
+    trip, new_etag = dynamodb_service.get_trip_with_etag('u1', 'conv-0000000000001')
+    assert trip['destination'] == 'Osaka' and new_etag != etag
+
+
+def test_detail_read_overlapping_a_write_is_not_cached(dynamodb_service, trip_table, monkeypatch):
+    trip_table.load([make_trip('u1', 1, destination='Tokyo')])
+    get_item = trip_table.get_item
+
+    def get_item_then_write(**kwargs):
+        response = get_item(**kwargs)
+        # 读取返回之后、写入缓存之前，行程被修改
+        trip_table.load([make_trip('u1', 1, destination='Osaka')])
+        dynamodb_service.invalidate_cache('u1', 'conv-0000000000001')
+        return response
+
+    monkeypatch.setattr(trip_table, 'get_item', get_item_then_write)
+    assert dynamodb_service.get_trip_with_etag('u1', 'conv-0000000000001')[0]['destination'] == 'Tokyo'
+
+    monkeypatch.setattr(trip_table, 'get_item', get_item)
+    assert dynamodb_service.get_trip_with_etag('u1', 'conv-0000000000001')[0]['destination'] == 'Osaka'
+
+
+def test_batch_read_overlapping_a_write_is_not_cached(dynamodb_service, trip_table, monkeypatch):
+    trip_table.load([make_trip('u1', 1, destination='Tokyo')])
+    batch_get_items = dynamodb_service._batch_get_items
+
+    def batch_get_then_write(user_id, conversation_ids):
+        items = batch_get_items(user_id, conversation_ids)
+        trip_table.load([make_trip('u1', 1, destination='Osaka')])
+        dynamodb_service.invalidate_cache('u1', 'conv-0000000000001')
+        return items
+
+    monkeypatch.setattr(dynamodb_service, '_batch_get_items', batch_get_then_write)
+    trips, missing = dynamodb_service.get_trips_by_ids('u1', ['conv-0000000000001', 'conv-0000000000002'])
+    assert [trip['destination'] for trip in trips] == ['Tokyo']
+    assert missing == ['conv-0000000000002']
+
+    monkeypatch.setattr(dynamodb_service, '_batch_get_items', batch_get_items)
+    trips, _ = dynamodb_service.get_trips_by_ids('u1', ['conv-0000000000001'])
+    assert trips[0]['destination'] == 'Osaka'
+
+
+def test_list_page_overlapping_a_write_is_not_cached(dynamodb_service, trip_table, monkeypatch):
+    trip_table.load([make_trip('u1', 1, destination='Tokyo')])
+    query = trip_table.query
+
+    def query_then_write(**kwargs):
+        response = query(**kwargs)
+        trip_table.load([make_trip('u1', 2, destination='Osaka')])
+        dynamodb_service.invalidate_cache('u1')
+        return response
+
+    monkeypatch.setattr(trip_table, 'query', query_then_write)
+    assert len(dynamodb_service.get_user_trips_page('u1')[0]) == 1
+
+    monkeypatch.setattr(trip_table, 'query', query)
+    assert len(dynamodb_service.get_user_trips_page('u1')[0]) == 2
@@ -0,0 +1,83 @@
+from boto3.dynamodb.conditions import Key
+
+from conftest import make_trip
+from config import Config
+from services.trip_purge import TripPurge
+
+
+def load_user(dynamodb_service, trip_table, user_id='u1'):
+    """10 个行程（带搜索索引）+ 10 条参数记录，时间戳 1..20"""
+    trip_table.load([
+        make_trip(user_id, i, 'itinerary' if i % 2 else 'parameters', destination=f"City {i}", budget_tier='mid')
+        for i in range(1, 21)
+    ])
+    dynamodb_service.search_index.rebuild(user_id)
+
+
+def keys(table, user_id):
+    return sorted(item.get('conversationId') or item.get('indexKey')
+                  for item in table.query(KeyConditionExpression=Key('userId').eq(user_id))['Items'])
+
+
+def test_purge_whole_user(dynamodb_service, trip_table, index_table):
+    load_user(dynamodb_service, trip_table)
+    load_user(dynamodb_service, trip_table, 'u2')
+
+    report = TripPurge(dynamodb_service, workers=2).run('u1')
+
+    assert report['done'] and report['failed'] == 0
+    assert report['deleted'] == 20
+    assert report['byType'] == {'itinerary': 10, 'parameters': 10}
+    assert keys(trip_table, 'u1') == [] and keys(index_table, 'u1') == []
+    # 其他用户不受影响
+    assert len(keys(trip_table, 'u2')) == 20 and keys(index_table, 'u2')
+
+
+def test_purge_by_type_and_age_removes_matching_search_entries(dynamodb_service, trip_table, index_table,
+                                                               monkeypatch):
+    monkeypatch.setattr(Config, 'SEARCH_USE_INDEX', True)
+    load_user(dynamodb_service, trip_table)
+    entries_before = len(keys(index_table, 'u1'))
+
+    report = TripPurge(dynamodb_service).run('u1', data_type='itinerary', older_than_ms=11)
+
+    # 时间戳 1, 3, 5, 7, 9 的行程
+    assert report['deleted'] == 5
+    remaining = keys(trip_table, 'u1')
+    assert len(remaining) == 15
+    assert all(f"conv-{i:013d}" not in remaining for i in (1, 3, 5, 7, 9))
+    assert len(keys(index_table, 'u1')) == entries_before - report['searchEntriesDeleted']
+    assert {trip['conversationId'] for trip in dynamodb_service.search_trips('u1', 'city')} == \
+        {f"conv-{i:013d}" for i in (11, 13, 15, 17, 19)}
+
+
+def test_dry_run_changes_nothing(dynamodb_service, trip_table, index_table):
+    load_user(dynamodb_service, trip_table)
+    entries = keys(index_table, 'u1')
+
+    report = TripPurge(dynamodb_service).run('u1', dry_run=True)
+
+    assert report['matched'] == 20 and report['deleted'] == 0 and report['done']
+    assert len(keys(trip_table, 'u1')) == 20
+    assert keys(index_table, 'u1') == entries
+
+
+def test_unprocessed_items_are_retried(dynamodb_service, dynamodb, trip_table):
+    trip_table.load([make_trip('u1', i, 'parameters') for i in range(1, 61)])
+    dynamodb.batch_write_limit = 10
+
+    report = TripPurge(dynamodb_service).run('u1')
+
+    assert report['done'] and report['deleted'] == 60
+    assert keys(trip_table, 'u1') == []
+
+
+def test_failed_batches_are_reported(dynamodb_service, dynamodb, trip_table):
+    trip_table.load([make_trip('u1', i, 'parameters') for i in range(1, 31)])
+    dynamodb.batch_write_limit = 0
+
+    report = TripPurge(dynamodb_service, max_attempts=2).run('u1')
+
+    assert not report['done']
+    assert report['failed'] == 30 and report['deleted'] == 0
+    assert report['errors']
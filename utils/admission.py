@@ -0,0 +1,263 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Hashable, Optional
+
+from utils.metrics import (
+    ADMISSION_CONCURRENCY_LIMIT, ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH,
+    ADMISSION_REQUESTS, ADMISSION_WAIT_SECONDS
+)
+
+
+class AdmissionRejected(Exception):
+    """
+    请求未被接纳
+
+    - status: 429（该用户的并发已达上限）或 503（全局队列已满 / 排队超时）
+    - retry_after: 建议客户端重试前等待的秒数（Retry-After 头）
+    """
+
+    def __init__(self, message: str, status: int, retry_after: int, reason: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def is_throttling(error: Exception) -> bool:
+    """是否为 AWS 的限流错误（包括流式响应中途返回的 throttlingException）"""
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    code = response.get('Error', {}).get('Code', '')
+    return code.lower() in ('throttlingexception', 'throttling', 'toomanyrequestsexception')
+
+
+class Permit:
+    """
+    一次被接纳的调用，调用结束后必须 release（重复 release 无效）
+
+    作为上下文管理器使用时，代码块抛出异常视为调用失败
+    """
+
+    def __init__(self, controller: Optional['AdmissionController'], key: Optional[Hashable]):
+        self._controller = controller
+        self._key = key
+        self._start = time.monotonic()
+        self._released = False
+
+    def release(self, success: bool = True):
+        """
+        Args:
+            success: 调用是否成功完成（只有成功的调用会使全局并发上限回升）
+        """
+        if self._released or self._controller is None:
+            return
+        self._released = True
+        self._controller._release(self._key, time.monotonic() - self._start, success)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(exc_type is None)
+        return False
+
+
+class AdmissionController:
+    """
+    Agent 调用的准入控制（线程安全）
+
+    - 全局并发上限：同时进行的调用数；收到限流错误时下调（乘性减少，每个平均调用耗时内最多一次，
+      同一波并发调用陆续返回的限流错误只算一次），之后每成功完成 limit 次调用上调 1（失败的调用不计），
+      直到 max_concurrency（AIMD），
+      使并发稳定在 Bedrock 实际允许的水平，而不是持续触发限流
+    - 每个用户的并发上限：同一用户进行中和排队中的调用数，超出时立即返回 429
+    - 有界等待队列：全局并发已满时按到达顺序排队，队列已满或等待超过 max_wait 秒时返回 503
+
+    Args:
+        max_concurrency: 全局并发上限，<= 0 表示不限制
+        per_user: 每个用户的并发上限，<= 0 表示不限制
+        queue_size: 等待队列长度
+        max_wait: 排队的最长等待时间（秒）
+    """
+
+    def __init__(self, max_concurrency: int, per_user: int = 0, queue_size: int = 0,
+                 max_wait: float = 10):
+        self.max_concurrency = max_concurrency
+        self.per_user = per_user
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+
+        self._limit = max_concurrency
+        self._in_flight = 0
+        self._successes = 0
+        self._users: Dict[Hashable, int] = {}
+        self._waiters: deque = deque()
+        self._cond = threading.Condition()
+        # 调用耗时的指数移动平均，用于估算 Retry-After 和限制下调频率
+        self._avg_duration = 5.0
+        self._last_decrease: Optional[float] = None  # 上次下调并发上限的时间（monotonic）
+
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_per_user": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "throttled": 0
+        }
+
+        ADMISSION_CONCURRENCY_LIMIT.set(max(max_concurrency, 0))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0 or self.per_user > 0
+
+    def acquire(self, key: Hashable) -> Permit:
+        """
+        申请一次调用，必要时排队等待
+
+        Args:
+            key: 用户标识（用于每个用户的并发上限）；None 表示只受全局上限约束
+
+        Raises:
+            AdmissionRejected: 未被接纳
+        """
+        if not self.enabled:
+            return Permit(None, key)
+
+        start = time.monotonic()
+        with self._cond:
+            if self.per_user > 0 and key is not None and self._users.get(key, 0) >= self.per_user:
+                self._reject('per_user')
+                raise AdmissionRejected(
+                    "Too many concurrent requests for this user",
+                    429, self._retry_after(1), 'per_user'
+                )
+
+            if not self._waiters and self._has_capacity():
+                self._admit(key, 0.0)
+                return Permit(self, key)
+
+            if len(self._waiters) >= self.queue_size:
+                self._reject('queue_full')
+                raise AdmissionRejected(
+                    "Agent is busy, please retry later",
+                    503, self._retry_after(len(self._waiters) + 1), 'queue_full'
+                )
+
+            ticket = object()
+            self._waiters.append(ticket)
+            self._users[key] = self._users.get(key, 0) + 1
+            self._stats["queued"] += 1
+            ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+            deadline = start + self.max_wait
+
+            try:
+                while not (self._waiters[0] is ticket and self._has_capacity()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('timeout')
+                        raise AdmissionRejected(
+                            "Timed out waiting for the agent, please retry later",
+                            503, self._retry_after(len(self._waiters)), 'timeout'
+                        )
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiters.remove(ticket)
+                self._leave(key)
+                ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+                # 可能轮到下一个等待者
+                self._cond.notify_all()
+                raise
+
+            self._waiters.popleft()
+            self._users[key] -= 1
+            ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+            self._admit(key, time.monotonic() - start)
+            # 并发上限可能允许下一个等待者也进入
+            self._cond.notify_all()
+            return Permit(self, key)
+
+    def throttled(self):
+        """收到 Bedrock 的限流错误：下调全局并发上限"""
+        with self._cond:
+            self._stats["throttled"] += 1
+            if self.max_concurrency <= 0:
+                return
+            now = time.monotonic()
+            # 下调之前已经发出的调用仍可能返回限流错误，它们不代表新的过载
+            if self._last_decrease is not None and now - self._last_decrease < self._avg_duration:
+                return
+            self._last_decrease = now
+            self._limit = max(1, int(self._limit * 0.75))
+            self._successes = 0
+            ADMISSION_CONCURRENCY_LIMIT.set(self._limit)
+
+    def retry_after(self) -> int:
+        """当前排队情况下建议的 Retry-After 秒数（用于上游限流时的响应）"""
+        with self._cond:
+            return self._retry_after(len(self._waiters) + 1)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters),
+                "concurrency_limit": self._limit,
+                "max_concurrency": self.max_concurrency,
+                "per_user": self.per_user,
+                "queue_size": self.queue_size,
+                "max_wait": self.max_wait,
+                "avg_duration": round(self._avg_duration, 3),
+                **self._stats
+            }
+
+    def _has_capacity(self) -> bool:
+        return self.max_concurrency <= 0 or self._in_flight < self._limit
+
+    def _admit(self, key: Hashable, waited: float):
+        self._in_flight += 1
+        self._users[key] = self._users.get(key, 0) + 1
+        self._stats["admitted"] += 1
+        ADMISSION_IN_FLIGHT.set(self._in_flight)
+        ADMISSION_REQUESTS.labels('admitted').inc()
+        ADMISSION_WAIT_SECONDS.observe(waited)
+
+    def _reject(self, reason: str):
+        self._stats[f"rejected_{reason}"] += 1
+        ADMISSION_REQUESTS.labels(reason).inc()
+
+    def _leave(self, key: Hashable):
+        count = self._users.get(key, 0) - 1
+        if count > 0:
+            self._users[key] = count
+        else:
+            self._users.pop(key, None)
+
+    def _release(self, key: Hashable, duration: float, success: bool):
+        with self._cond:
+            self._in_flight -= 1
+            self._leave(key)
+
+            # 失败的调用（如很快返回的限流错误）既不代表 Bedrock 还有余量，也不代表正常的调用耗时
+            if success:
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+            if success and self.max_concurrency > 0 and self._limit < self.max_concurrency:
+                self._successes += 1
+                if self._successes >= self._limit:
+                    self._limit += 1
+                    self._successes = 0
+                    ADMISSION_CONCURRENCY_LIMIT.set(self._limit)
+
+            ADMISSION_IN_FLIGHT.set(self._in_flight)
+            self._cond.notify_all()
+
+    def _retry_after(self, position: int) -> int:
+        """排在第 position 位时大约需要等待的秒数"""
+        slots = self._limit if self.max_concurrency > 0 else 1
+        return max(1, math.ceil(self._avg_duration * position / max(slots, 1)))
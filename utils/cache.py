@@ -0,0 +1,69 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# 用于区分 "未命中" 和 "缓存了 None"
+MISSING = object()
+
+
+class TTLCache:
+    """
+    线程安全的 LRU + TTL 内存缓存
+
+    - 超过 maxsize 时淘汰最久未使用的条目
+    - 每个条目有独立的过期时间（可以按条目指定 ttl）
+    - 可以缓存 None，未命中时返回 default（默认为 MISSING）
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+def content_etag(data: Any) -> str:
+    """
+    根据内容计算强 ETag（相同内容在任何进程中得到相同的值）
+    """
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str, separators=(',', ':'))
+    return '"' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32] + '"'
@@ -0,0 +1,21 @@
+import json
+import os
+from typing import Dict, Optional
+
+
+def load_checkpoint(path: Optional[str], default: Dict) -> Dict:
+    """读取检查点文件，不存在时返回 default 的副本"""
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return dict(default)
+
+
+def save_checkpoint(path: Optional[str], state: Dict):
+    """原子地写入检查点文件（先写临时文件再替换）"""
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
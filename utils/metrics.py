@@ -0,0 +1,383 @@
+"""
+进程内指标（Prometheus 文本格式，由 /metrics 输出）
+
+- Counter / Histogram 按标签值拆分为子序列，每个子序列有自己的锁，
+  记录一次只做几次加法，不同接口 / 依赖之间互不竞争
+- 指标是进程级的：多进程部署时每个进程各自输出，由 Prometheus 按实例汇总
+"""
+import bisect
+import contextvars
+from abc import ABC, abstractmethod
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 请求 / 依赖调用的默认延迟分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Agent 回复可能持续数分钟
+STREAM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+_registry: List['_Metric'] = []
+_registry_lock = threading.Lock()
+
+# 当前正在执行的 DynamoDBService 方法（用于把消耗的容量记到对应的方法上）
+current_operation: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    'current_operation', default=None
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """创建一个标签值组合对应的子序列"""
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in sorted(children):
+            yield from self._collect_child(values, child)
+
+    @abstractmethod
+    def _collect_child(self, values, child) -> Iterator[str]:
+        """输出一个子序列的样本行"""
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _collect_child(self, values, child):
+        yield f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge(_Metric):
+    """可增可减的当前值（如队列长度）"""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _collect_child(self, values, child):
+        yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # 最后一个是 +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    """分桶直方图（输出累计的 _bucket、_sum、_count）"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _collect_child(self, values, child):
+        counts, total = child.snapshot()
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}"
+        labels = _format_labels(self.labelnames, values)
+        yield f"{self.name}_sum{labels} {_format_value(total)}"
+        yield f"{self.name}_count{labels} {cumulative}"
+
+
+def render() -> str:
+    """所有指标的 Prometheus 文本格式"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = [line for metric in metrics for line in metric.collect()]
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# ---------------------------------------------------------------- 各层使用的指标
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route (streaming responses until the body is sent)',
+    ('method', 'route', 'status')
+)
+
+BEDROCK_FIRST_CHUNK_SECONDS = Histogram(
+    'bedrock_time_to_first_chunk_seconds', 'Time from invoking the agent to its first response chunk',
+    ('operation',), buckets=STREAM_BUCKETS
+)
+BEDROCK_DURATION_SECONDS = Histogram(
+    'bedrock_stream_duration_seconds', 'Total duration of an agent invocation until the stream ends',
+    ('operation',), buckets=STREAM_BUCKETS
+)
+BEDROCK_CALLS = Counter(
+    'bedrock_calls', 'Agent invocations by outcome (success / error / cancelled)',
+    ('operation', 'outcome')
+)
+
+ADMISSION_REQUESTS = Counter(
+    'bedrock_admission_requests', 'Agent invocation admission decisions (admitted / per_user / queue_full / timeout)',
+    ('outcome',)
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    'bedrock_admission_wait_seconds', 'Time admitted agent invocations spent in the wait queue'
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'bedrock_admission_queue_depth', 'Agent invocations currently waiting for a slot'
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'bedrock_admission_in_flight', 'Agent invocations currently running'
+)
+ADMISSION_CONCURRENCY_LIMIT = Gauge(
+    'bedrock_admission_concurrency_limit', 'Current global concurrency limit (lowered on throttling)'
+)
+
+DYNAMODB_SECONDS = Histogram(
+    'dynamodb_operation_duration_seconds', 'Latency of DynamoDBService methods (including read-cache hits)',
+    ('method',)
+)
+DYNAMODB_CALLS = Counter(
+    'dynamodb_operations', 'DynamoDBService method calls by outcome', ('method', 'outcome')
+)
+DYNAMODB_CAPACITY = Counter(
+    'dynamodb_consumed_capacity_units', 'Consumed capacity units reported by DynamoDB',
+    ('method', 'operation')
+)
+
+GEOCODE_SECONDS = Histogram(
+    'geocode_request_duration_seconds', 'Latency of Google Geocoding API calls (cache misses only)'
+)
+GEOCODE_CALLS = Counter(
+    'geocode_requests', 'Google Geocoding API calls by outcome (success / not_found / error)',
+    ('outcome',)
+)
+
+PREFETCH_JOBS = Counter(
+    'prefetch_jobs', 'Background geocode prefetch jobs by outcome (done / failed / cancelled / deduplicated / rejected)',
+    ('outcome',)
+)
+PREFETCH_JOB_SECONDS = Histogram(
+    'prefetch_job_duration_seconds', 'Run time of background geocode prefetch jobs', buckets=STREAM_BUCKETS
+)
+PREFETCH_QUEUE_DEPTH = Gauge(
+    'prefetch_queue_depth', 'Prefetch jobs waiting for a worker'
+)
+
+
+def timed(histogram: Histogram, counter: Counter, name: str):
+    """
+    装饰器：记录函数耗时（histogram）和成功 / 失败次数（counter），标签值为 name
+
+    执行期间 current_operation 为 name，供底层的 boto 事件钩子使用
+    """
+    def decorator(func):
+        latency = histogram.labels(name)
+        success = counter.labels(name, 'success')
+        error = counter.labels(name, 'error')
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            token = current_operation.set(name)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                error.inc()
+                raise
+            else:
+                success.inc()
+                return result
+            finally:
+                latency.observe(time.perf_counter() - start)
+                current_operation.reset(token)
+
+        return wrapper
+    return decorator
+
+
+class StreamTimer:
+    """记录一次 Agent 调用的首个分片耗时、总耗时和结果（finish 只有第一次生效）"""
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.start = time.perf_counter()
+        self.first_chunk = False
+        self.finished = False
+
+    def chunk(self):
+        if not self.first_chunk:
+            self.first_chunk = True
+            BEDROCK_FIRST_CHUNK_SECONDS.labels(self.operation).observe(time.perf_counter() - self.start)
+
+    def finish(self, outcome: str):
+        if self.finished:
+            return
+        self.finished = True
+        BEDROCK_DURATION_SECONDS.labels(self.operation).observe(time.perf_counter() - self.start)
+        BEDROCK_CALLS.labels(self.operation, outcome).inc()
+
+
+# ---------------------------------------------------------------- 接入
+
+def instrument_dynamodb(client):
+    """
+    给 DynamoDB 底层客户端注册事件钩子：每次请求都带上 ReturnConsumedCapacity=TOTAL，
+    并把响应中的消耗容量记到当前的 DynamoDBService 方法上
+    """
+    def request_capacity(params, model, **kwargs):
+        if 'ReturnConsumedCapacity' in model.input_shape.members:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    def record_capacity(parsed, model, **kwargs):
+        consumed = parsed.get('ConsumedCapacity') if isinstance(parsed, dict) else None
+        if not consumed:
+            return
+        entries = consumed if isinstance(consumed, list) else [consumed]
+        units = sum(entry.get('CapacityUnits', 0) for entry in entries)
+        if units:
+            DYNAMODB_CAPACITY.labels(current_operation.get() or 'other', model.name).inc(units)
+
+    client.meta.events.register('provide-client-params.dynamodb.*', request_capacity)
+    client.meta.events.register('after-call.dynamodb.*', record_capacity)
+
+
+def init_app(app):
+    """为 Flask 应用记录每个请求的耗时，并注册 /metrics"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        child = HTTP_REQUEST_SECONDS.labels(request.method, route, response.status_code)
+
+        if response.is_streamed:
+            # 流式响应在响应体发送完（或客户端断开）时才算结束
+            response.call_on_close(lambda: child.observe(time.perf_counter() - start))
+        else:
+            child.observe(time.perf_counter() - start)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,41 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限流器
+
+    - rate: 每秒补充的令牌数（即长期 QPS 上限），<= 0 表示不限流
+    - capacity: 桶容量（允许的瞬时突发量）
+
+    acquire() 采用预约方式：令牌不足时先记账再睡眠，等待者按到达顺序放行
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        获取令牌，必要时阻塞
+
+        Returns:
+            float: 实际等待的秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
@@ -1,13 +1,20 @@
-from flask import jsonify
+from flask import jsonify, request
 from typing import Any, Optional
 
-def success_response(data: Any = None, message: str = "Success", code: int = 200):
-    """统一成功响应格式"""
+def success_response(data: Any = None, message: str = "Success", code: int = 200,
+                     extra: Optional[dict] = None):
+    """
+    统一成功响应格式
+    
+    extra 中的字段会附加到响应顶层（如分页游标 nextCursor）
+    """
     response = {
         "success": True,
         "message": message,
         "data": data
     }
+    if extra:
+        response.update(extra)
     return jsonify(response), code
 
 def error_response(message: str, code: int = 400, error_details: Optional[dict] = None):
@@ -17,4 +24,32 @@ def error_response(message: str, code: int = 400, error_details: Optional[dict]
         "message": message,
         "error": error_details
     }
-    return jsonify(response), code
\ No newline at end of file
+    return jsonify(response), code
+
+def etag_matches(etag: str) -> bool:
+    """请求的 If-None-Match 是否与 ETag 匹配（If-None-Match 使用弱比较）"""
+    header = request.headers.get('If-None-Match')
+    if not header or not etag:
+        return False
+    if header.strip() == '*':
+        return True
+    
+    def strip_weak(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith('W/') else tag
+    
+    return strip_weak(etag) in {strip_weak(tag) for tag in header.split(',')}
+
+
+def conditional_response(data: Any, message: str, etag: str, extra: Optional[dict] = None):
+    """
+    带 ETag 的成功响应：客户端的 If-None-Match 命中时返回 304 且没有响应体
+    """
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    
+    if etag_matches(etag):
+        return '', 304, headers
+    
+    response, code = success_response(data, message, extra=extra)
+    response.headers.update(headers)
+    return response, code
\ No newline at end of file
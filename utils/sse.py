@@ -0,0 +1,25 @@
+import json
+from typing import Any, Dict, Optional
+
+# SSE 响应通用的头部（禁用缓存和 Nginx 缓冲，保证事件及时送达）
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+
+def sse_event(payload: Dict[str, Any], event_id: Optional[str] = None) -> str:
+    """
+    把事件编码为一帧 SSE 数据
+
+    格式与 /api/chat/stream 一致：data: {"type": "...", ...}\\n\\n
+    指定 event_id 时在前面加上 id 行（客户端重连时通过 Last-Event-ID 带回）
+    """
+    if event_id is not None:
+        return f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def sse_comment(text: str) -> str:
+    """SSE 注释帧（客户端忽略），用于保持空闲连接不被代理断开"""
+    return f": {text}\n\n"
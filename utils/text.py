@@ -0,0 +1,22 @@
+import re
+import unicodedata
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(text: str) -> str:
+    """
+    规范化查询文本，用作缓存键
+
+    NFKC 归一化（全角/半角统一）→ casefold（大小写无关）→ 合并连续空白
+
+    Args:
+        text: 原始文本（如 "  東京タワー " / "TOKYO   Tower"）
+
+    Returns:
+        str: 规范化后的文本
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', str(text)).casefold()
+    return _WHITESPACE_RE.sub(' ', text).strip()